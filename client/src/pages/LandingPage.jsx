@@ -378,8 +378,8 @@ const LandingPage = () => {
               >
                 <img 
                   src={
-                    space?.images && Array.isArray(space.images) && space.images.length > 0 
-                      ? space.images[0] 
+                    space?.thumbnail 
+                      ? space.thumbnail 
                       : 'https://images.unsplash.com/photo-1732559797723-4af87682e682?q=80&w=1886&auto=format&fit=crop&ixlib=rb-4.0.3&ixid=M3wxMjA3fDB8MHxwaG90by1wYWdlfHx8fGVufDB8fHx8fA%3D%3D'
                   } 
                   alt={space.name || 'Space'} 
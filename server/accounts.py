@@ -0,0 +1,312 @@
+"""
+Creating user accounts.
+
+Email and username uniqueness is left to the users table's unique
+constraints rather than checked with SELECTs first, which both costs a
+round trip per field and still races with concurrent registrations.
+duplicate_field() tells which constraint an IntegrityError came from.
+
+insert_users() inserts a whole batch of accounts with one executemany;
+provision_users() feeds it from any iterable of rows, committing every
+USER_IMPORT_BATCH_SIZE rows, for bulk provisioning.
+
+import_users() is the admin bulk import (POST /admin/users/import and
+`flask import-users`): records are parsed from CSV or JSONL as the file
+streams in, validated, hashed a batch at a time on the bulk hashing pool,
+inserted with provision_users() and sent verification emails queued in
+the same transaction.
+"""
+import csv
+import io
+from itertools import islice
+import json
+import re
+import secrets
+import time
+
+import click
+from sqlalchemy import insert, select, or_
+from sqlalchemy.exc import IntegrityError
+
+from config import app, db
+from mailer import enqueue_email, enqueue_emails
+from models import User, UserRole
+from passwords import hash_passwords
+
+# Unique user columns, in the order conflicts are reported
+UNIQUE_FIELDS = ('email', 'username')
+
+DUPLICATE_ERRORS = {
+    'email': 'Email address already exists',
+    'username': 'Username already exists',
+}
+
+IMPORT_FIELDS = ('email', 'username', 'password')
+# Throughput is reported per this many created users
+IMPORT_PROGRESS_EVERY = 10_000
+
+
+class ImportFormatError(ValueError):
+    """The import file can't be read at all (as opposed to a bad row)"""
+
+
+def validate_email(email):
+    pattern = r'^[\w\.-]+@[\w\.-]+\.\w+$'
+    return re.match(pattern, email) is not None
+
+
+def validate_password(password):
+    # At least 8 characters, 1 uppercase, 1 lowercase, 1 number
+    if len(password) < 8:
+        return False
+    if not re.search(r'[A-Z]', password):
+        return False
+    if not re.search(r'[a-z]', password):
+        return False
+    if not re.search(r'\d', password):
+        return False
+    return True
+
+
+def verification_email(verification_code):
+    """(subject, body) of the email carrying a verification code"""
+    subject = 'Roomsy - Verify your email address'
+    body = f'''
+    Welcome to Roomsy!
+    
+    Your verification code is: {verification_code}
+    
+    Please enter this code in the verification page to activate your account.
+    This code will expire in 24 hours.
+    
+    Best regards,
+    Roomsy Team
+    '''
+    return subject, body
+
+
+def send_verification_email(email, verification_code):
+    # Queued in the caller's transaction and sent by the mail worker after commit
+    enqueue_email(email, *verification_email(verification_code))
+
+
+def duplicate_field(error):
+    """The unique field an IntegrityError on users violated, or None"""
+    message = str(error.orig)
+    return next((field for field in UNIQUE_FIELDS if field in message), None)
+
+
+def insert_users(rows):
+    """
+    Insert one batch of users (dicts of User columns) in the current
+    transaction. Rows whose email or username is already taken, in the
+    table or earlier in the batch, are skipped. Returns (inserted rows,
+    [(row, field)] for the skipped ones).
+    """
+    taken = {field: set() for field in UNIQUE_FIELDS}
+    existing = db.session.execute(select(User.email, User.username).where(or_(
+        User.email.in_([row['email'] for row in rows]),
+        User.username.in_([row['username'] for row in rows])
+    )))
+    for email, username in existing:
+        taken['email'].add(email)
+        taken['username'].add(username)
+
+    fresh, skipped = [], []
+    for row in rows:
+        field = next((field for field in UNIQUE_FIELDS if row[field] in taken[field]), None)
+        if field:
+            skipped.append((row, field))
+            continue
+        for field in UNIQUE_FIELDS:
+            taken[field].add(row[field])
+        fresh.append(row)
+    if not fresh:
+        return fresh, skipped
+
+    try:
+        with db.session.begin_nested():
+            db.session.execute(insert(User), fresh)
+        return fresh, skipped
+    except IntegrityError:
+        pass
+
+    # Someone registered one of these since the SELECT; find out which
+    # row by row
+    inserted = []
+    for row in fresh:
+        try:
+            with db.session.begin_nested():
+                db.session.execute(insert(User), [row])
+            inserted.append(row)
+        except IntegrityError as e:
+            skipped.append((row, duplicate_field(e)))
+    return inserted, skipped
+
+
+def provision_users(rows, batch_size=None, on_insert=None):
+    """
+    Insert users from the iterable `rows` in batches, committing after
+    each. `on_insert(inserted rows)` runs before each commit, in the same
+    transaction. Returns {'created': count, 'skipped': [(row, field), ...]}.
+    """
+    batch_size = batch_size or app.config['USER_IMPORT_BATCH_SIZE']
+    rows = iter(rows)
+    created, skipped = 0, []
+    while True:
+        batch = list(islice(rows, batch_size))
+        if not batch:
+            break
+        inserted, duplicates = insert_users(batch)
+        if on_insert and inserted:
+            on_insert(inserted)
+        db.session.commit()
+        created += len(inserted)
+        skipped.extend(duplicates)
+    return {'created': created, 'skipped': skipped}
+
+
+def parse_records(stream, file_format):
+    """
+    Yield (line number, record dict or None, error or None) from a binary
+    CSV or JSONL `stream`, reading it incrementally.
+    """
+    text = io.TextIOWrapper(stream, encoding='utf-8-sig', newline='')
+    if file_format == 'csv':
+        reader = csv.DictReader(text)
+        missing = set(IMPORT_FIELDS) - set(reader.fieldnames or ())
+        if missing:
+            raise ImportFormatError(f"CSV header is missing {', '.join(sorted(missing))}")
+        for record in reader:
+            yield reader.line_num, record, None
+    elif file_format == 'jsonl':
+        for line_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield line_number, None, 'Invalid JSON'
+                continue
+            if not isinstance(record, dict):
+                yield line_number, None, 'Expected a JSON object'
+                continue
+            yield line_number, record, None
+    else:
+        raise ImportFormatError(f"Unknown import format '{file_format}'")
+
+
+def check_record(record):
+    """The problem with one import record, or None if it can be imported"""
+    for field in IMPORT_FIELDS:
+        if not isinstance(record.get(field), str) or not record[field].strip():
+            return f'{field} is required'
+    if not validate_email(record['email'].strip()):
+        return 'Invalid email address'
+    if not validate_password(record['password']):
+        return 'Password is too weak'
+    if (record.get('role') or UserRole.CLIENT.value) not in UserRole._value2member_map_:
+        return f"Invalid role '{record['role']}'"
+    return None
+
+
+def queue_verification_emails(rows):
+    enqueue_emails([
+        (row['email'], *verification_email(row['verification_code']))
+        for row in rows
+    ])
+
+
+class ImportReport:
+    """Counts, first errors and throughput of one import"""
+
+    def __init__(self, progress=None):
+        self.started = time.perf_counter()
+        self.created = 0
+        self.invalid = 0
+        self.errors = []
+        self.progress = progress
+
+    def error(self, **details):
+        if len(self.errors) < app.config['USER_IMPORT_MAX_ERRORS']:
+            self.errors.append(details)
+
+    def inserted(self, rows):
+        before = self.created
+        self.created += len(rows)
+        if self.progress and self.created // IMPORT_PROGRESS_EVERY > before // IMPORT_PROGRESS_EVERY:
+            self.progress(self.created, time.perf_counter() - self.started)
+
+    def as_dict(self, skipped):
+        seconds = time.perf_counter() - self.started
+        for row, field in skipped:
+            self.error(email=row['email'], username=row['username'], error=DUPLICATE_ERRORS.get(field, 'Already exists'))
+        return {
+            'created': self.created,
+            'skipped': len(skipped),
+            'invalid': self.invalid,
+            'errors': self.errors,
+            'seconds': round(seconds, 2),
+            'seconds_per_10k_users': round(seconds / self.created * 10_000, 2) if self.created else None,
+        }
+
+
+def import_users(records, batch_size=None, progress=None):
+    """
+    Create unverified users from parse_records() output and queue their
+    verification emails. `progress(created, elapsed seconds)` is called
+    every IMPORT_PROGRESS_EVERY users. Returns the report as a dict.
+    """
+    batch_size = batch_size or app.config['USER_IMPORT_BATCH_SIZE']
+    report = ImportReport(progress)
+
+    def rows():
+        records_iter = iter(records)
+        while True:
+            chunk = list(islice(records_iter, batch_size))
+            if not chunk:
+                break
+            valid = []
+            for line, record, error in chunk:
+                error = error or check_record(record)
+                if error:
+                    report.invalid += 1
+                    report.error(line=line, error=error)
+                else:
+                    valid.append(record)
+            hashes = hash_passwords([record['password'] for record in valid])
+            for record, password_hash in zip(valid, hashes):
+                yield {
+                    'email': record['email'].strip(),
+                    'username': record['username'].strip(),
+                    'password_hash': password_hash,
+                    'role': UserRole(record.get('role') or UserRole.CLIENT.value),
+                    'verification_code': secrets.token_hex(3),
+                }
+
+    def inserted(batch):
+        queue_verification_emails(batch)
+        report.inserted(batch)
+
+    result = provision_users(rows(), batch_size, on_insert=inserted)
+    return report.as_dict(result['skipped'])
+
+
+@app.cli.command('import-users')
+@click.argument('path', type=click.Path(exists=True, dir_okay=False))
+@click.option('--format', 'file_format', type=click.Choice(['csv', 'jsonl']),
+              help='Defaults to the file extension')
+def import_users_command(path, file_format):
+    """Create users from a CSV or JSONL file (email, username, password, role)"""
+    file_format = file_format or ('jsonl' if path.endswith(('.jsonl', '.ndjson')) else 'csv')
+
+    def progress(created, seconds):
+        print(f"{created} users in {seconds:.1f}s ({seconds / created * 10_000:.1f}s per 10k)")
+
+    with open(path, 'rb') as stream:
+        report = import_users(parse_records(stream, file_format), progress=progress)
+    print(f"Created {report['created']} users, skipped {report['skipped']} existing, "
+          f"{report['invalid']} invalid in {report['seconds']}s "
+          f"({report['seconds_per_10k_users']}s per 10k users)")
+    for error in report['errors']:
+        print(error)
@@ -1,31 +1,48 @@
 from config import app
-from email.mime.text import MIMEText
-import smtplib
-import re
 from flask_restful import Resource
 from flask import redirect, session, url_for, request, current_app
-from models import User, UserRole, Space, SpaceStatus, Booking, BookingStatus
+from models import User, UserRole, Space, SpaceStatus, Booking, BookingStatus, utcnow
 from config import app, db, api
+from availability import availability, parse_window
+from search import apply_search, search_terms
+from pagination import MAX_PER_PAGE, InvalidCursor, get_per_page, cursor_requested, keyset_page, cursor_pagination, \
+    total_requested, offset_page
+from caching import TTLCache, ResponseCache, make_backend, clear_on_write
+from reservations import place_hold, attach_payment_intent, release_hold, hold_sweeper
+from stripe_events import record_event, apply_event, mark_processed
+import reconciliation  # registers `flask reconcile-payments`
+from media import stage_images, variant_url, thumbnail_url, image_variants
+from uploads import IMAGE_SIGNATURES, exceeds_pixel_limit, is_oversized, sniff_image_type
+from oidc import Auth0App, oidc_cache
+from passwords import HasherBusy
+from ratelimit import check_rate_limit, record_failure
+from auth import current_auth, token_claims, revoke_tokens
+from accounts import DUPLICATE_ERRORS, duplicate_field, validate_email, validate_password, send_verification_email, \
+    import_users, parse_records, ImportFormatError
 import secrets
 import os
-import requests
+import hashlib
 from datetime import timedelta, datetime, timezone
 from flask_jwt_extended import create_access_token, jwt_required, get_jwt_identity
 from authlib.integrations.flask_client import OAuth
 from sqlalchemy.exc import IntegrityError, SQLAlchemyError
-from sqlalchemy import func, and_, or_
+from sqlalchemy import func, select, exists
 from decimal import Decimal
 import stripe
-import cloudinary
-from cloudinary.utils import cloudinary_url
-from cloudinary.uploader import upload
-from functools import wraps
 import json
 import decimal
-from werkzeug.security import generate_password_hash
+from werkzeug.exceptions import RequestEntityTooLarge
 
 stripe.api_key = os.getenv('STRIPE_SECRET_KEY')
 
+# Listing totals keyed on the normalized filter, and whole public listing
+# responses; both are emptied on any Space write
+space_count_cache = TTLCache(ttl=30)
+client_space_cache = ResponseCache('client_spaces', make_backend(
+    app.config['RESPONSE_CACHE_BACKEND'], ttl=app.config['RESPONSE_CACHE_TTL']
+))
+clear_on_write(Space, space_count_cache, client_space_cache)
+
 oauth = OAuth(app)
 auth0 = oauth.register(
     name='auth0',
@@ -34,127 +51,41 @@ auth0 = oauth.register(
     client_kwargs={
         'scope': 'openid profile email'
     },
-    server_metadata_url=f'https://{app.config.get("AUTH0_DOMAIN")}/.well-known/openid-configuration'
+    client_cls=Auth0App
 )
+if app.config.get('AUTH0_DOMAIN') and app.config['OIDC_REFRESH_WORKER']:
+    oidc_cache.start()
 
 
-def validate_email(email):
-    pattern = r'^[\w\.-]+@[\w\.-]+\.\w+$'
-    return re.match(pattern, email) is not None
-
-def validate_password(password):
-    # At least 8 characters, 1 uppercase, 1 lowercase, 1 number
-    if len(password) < 8:
-        return False
-    if not re.search(r'[A-Z]', password):
-        return False
-    if not re.search(r'[a-z]', password):
-        return False
-    if not re.search(r'\d', password):
-        return False
-    return True
-
-def send_email(recepient, subject, body):
-    sender = os.getenv('EMAIL_USER')
-    password = os.getenv('EMAIL_PASSWORD')
-
-    if not sender or not password:
-        raise ValueError("Email credentials not found in environment variables")
-
-    msg = MIMEText(body)
-    msg['Subject'] = subject
-    msg['From'] = sender
-    msg['To'] = recepient
-
-    try:
-        with smtplib.SMTP('smtp.gmail.com', 587) as smtp:
-            smtp.starttls()
-            smtp.login(sender, password)
-            smtp.send_message(msg)
-    except Exception as e:
-        print(f"Error sending email: {e}")
-        raise e
-
-
-def send_verification_email(email, verification_code):
-    subject = 'Roomsy - Verify your email address'
-    body = f'''
-    Welcome to Roomsy!
-    
-    Your verification code is: {verification_code}
-    
-    Please enter this code in the verification page to activate your account.
-    This code will expire in 24 hours.
-    
-    Best regards,
-    Roomsy Team
-    '''
-    send_email(email, subject, body)
-
-def configure_cloudinary():
-    """Configure Cloudinary with environment variables"""
-    try:
-        cloudinary.config(
-            cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
-            api_key=os.getenv('CLOUDINARY_API_KEY'),
-            api_secret=os.getenv('CLOUDINARY_API_SECRET')
-        )
-    except Exception as e:
-        print(f"Error configuring Cloudinary: {str(e)}")
-        raise
-
-def require_cloudinary(f):
-    """Decorator to ensure Cloudinary is configured before upload"""
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if not all([
-            cloudinary.config().cloud_name,
-            cloudinary.config().api_key,
-            cloudinary.config().api_secret
-        ]):
-            configure_cloudinary()
-        return f(*args, **kwargs)
-    return decorated_function
-
-@require_cloudinary
-def upload_image_to_cloudinary(image_file):
-    """
-    Upload image to Cloudinary with error handling and retry logic
-    
-    Args:
-        image_file: File object from request.files
-    Returns:
-        str: Cloudinary secure URL of the uploaded image
-    Raises:
-        Exception: If upload fails after retries
-    """
-    max_retries = 3
-    retry_count = 0
-    
-    while retry_count < max_retries:
-        try:
-            result = cloudinary.uploader.upload(
-                image_file,
-                folder="charity_stories",
-                transformation={
-                    'width': 800,
-                    'height': 600,
-                    'crop': 'fill',
-                    'quality': 'auto:good'
-                }
-            )
-            return result['secure_url']
-        except Exception as e:
-            retry_count += 1
-            if retry_count == max_retries:
-                print(f"Failed to upload image after {max_retries} attempts: {str(e)}")
-                raise Exception("Failed to upload image to Cloudinary")
-            print(f"Upload attempt {retry_count} failed, retrying...")
+@app.before_request
+def start_hold_sweeper():
+    # Every serving process sweeps expired holds, not just those that place
+    # them; a no-op once the thread is running
+    hold_sweeper.start()
+
+
+def space_etag(space_id, updated_at):
+    """Strong ETag for a space's detail view, derived from id and updated_at"""
+    stamp = updated_at.isoformat() if updated_at else ''
+    return hashlib.sha1(f'{space_id}:{stamp}'.encode()).hexdigest()
+
+def not_modified(etag, cache_control):
+    """Return a bodiless 304 if the request's If-None-Match has `etag`"""
+    if not request.if_none_match.contains(etag):
+        return None
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = cache_control
+    return response
 
 
 class Register(Resource):
     def post(self):
         try:
+            limited = check_rate_limit('register')
+            if limited:
+                return limited
+
             # Get data from request
             data = request.get_json()
 
@@ -178,12 +109,6 @@ class Register(Resource):
             if data['role'] not in UserRole._value2member_map_:
                 return {'error': f"Invalid role. Must be one of {', '.join(UserRole._value2member_map_.keys())}"}, 400
 
-            # Check for existing email or username
-            if User.query.filter_by(email=data['email']).first():
-                return {'error': 'Email address already exists'}, 409
-            if User.query.filter_by(username=data['username']).first():
-                return {'error': 'Username already exists'}, 409
-
             # Generate verification code
             verification_code = secrets.token_hex(3)
 
@@ -196,14 +121,18 @@ class Register(Resource):
             )
             new_user.password = data['password']  # Set password hash
             db.session.add(new_user)
-            db.session.commit()
 
-            # Send verification email
+            # Queue the verification email with the user so both commit together.
+            # The unique constraints catch existing emails and usernames.
+            send_verification_email(data['email'], verification_code)
             try:
-                send_verification_email(data['email'], verification_code)
-            except Exception as e:
-                db.session.rollback()  # Rollback user creation if email fails
-                return {'error': f'Error sending verification email: {str(e)}'}, 500
+                db.session.commit()
+            except IntegrityError as e:
+                db.session.rollback()
+                field = duplicate_field(e)
+                if field is None:
+                    raise
+                return {'error': DUPLICATE_ERRORS[field]}, 409
 
             return {
                 'message': 'Registration successful, check your email for a verification code',
@@ -211,6 +140,9 @@ class Register(Resource):
                 'user_type': new_user.role.value
             }, 201
 
+        except HasherBusy:
+            db.session.rollback()
+            return {'error': 'Too many requests in progress, try again shortly'}, 503, {'Retry-After': str(app.config['PASSWORD_HASH_WAIT_SECONDS'])}
         except Exception as e:
             db.session.rollback()  # Rollback any uncommitted changes
             return {'error': f"An error occurred: {str(e)}"}, 500
@@ -223,11 +155,17 @@ class VerifyEmail(Resource):
             if 'email' not in data or 'verification_code' not in data:
                 return {'error': 'Email and verification code are required'}, 400
             
+            limited = check_rate_limit('verify-email', data['email'])
+            if limited:
+                return limited
+
             user = User.query.filter_by(email=data['email']).first()
             if not user:
+                record_failure('verify-email', data['email'])
                 return {'error': 'User not found'}, 404
             
             if user.verification_code != data['verification_code']:
+                record_failure('verify-email', data['email'])
                 return {'error': 'Invalid verification code'}, 400
             
             user.verification_code = None
@@ -247,6 +185,10 @@ class ResendVerification(Resource):
             
             if 'email' not in data:
                 return {'error': 'Email is required'}, 400
+
+            limited = check_rate_limit('resend-verification', data['email'])
+            if limited:
+                return limited
             
             user = User.query.filter_by(email=data['email']).first()
             if not user:
@@ -257,14 +199,10 @@ class ResendVerification(Resource):
             
             verification_code = secrets.token_hex(3)
             user.verification_code = verification_code
+            send_verification_email(user.email, verification_code)
             db.session.commit()
             
-            try:
-                send_verification_email(user.email, verification_code)
-                return {'message': 'Verification email resent'}, 200
-            except Exception as e:
-                db.session.rollback()
-                return {'error': 'Failed to send verification email'}, 500
+            return {'message': 'Verification email resent'}, 200
                 
         except Exception as e:
             db.session.rollback()
@@ -278,17 +216,24 @@ class Login(Resource):
 
             if not all(key in data for key in ['email', 'password']):
                 return {'error': 'Email and password are required'}, 400
+
+            limited = check_rate_limit('login', data['email'])
+            if limited:
+                return limited
             
             user = User.query.filter_by(email=data['email']).first()
             if not user or not user.verify_password(data['password']):
+                record_failure('login', data['email'])
                 return {'error': 'Invalid email or password'}, 401
+            if user in db.session.dirty:
+                db.session.commit()  # password was rehashed with current settings
             
             if user.verification_code:
                 return {'error': 'Email not yet verified'}, 401
             
             access_token = create_access_token(
                 identity=str(user.id),
-                additional_claims={'role': user.role.value},
+                additional_claims=token_claims(user),
                 expires_delta=timedelta(days=1)
             )
                    
@@ -299,6 +244,8 @@ class Login(Resource):
                 'username': user.username
             }, 200
             
+        except HasherBusy:
+            return {'error': 'Too many login attempts in progress, try again shortly'}, 503, {'Retry-After': str(app.config['PASSWORD_HASH_WAIT_SECONDS'])}
         except Exception as e:
             return {'error': str(e)}, 500
         
@@ -317,14 +264,12 @@ class Auth0Callback(Resource):
     def get(self):
         """Handle Auth0 callback"""
         try:
-            # Exchange authorization code for tokens
+            # Exchange authorization code for tokens; authlib verifies the ID
+            # token against the cached JWKS and returns its claims
             token = auth0.authorize_access_token()
-            
-            # Fetch user info
-            user_info = requests.get(
-                f'https://{app.config.get("AUTH0_DOMAIN")}/userinfo', 
-                headers={'Authorization': f'Bearer {token["access_token"]}'}
-            ).json()
+            user_info = token.get('userinfo')
+            if not user_info:
+                return {'error': 'Missing ID token'}, 400
 
             # Extract user details
             email = user_info.get('email')
@@ -358,6 +303,7 @@ class Auth0Callback(Resource):
             access_token = create_access_token(
                 identity=str(user.id),
                 additional_claims={
+                    **token_claims(user),
                     'user_type': user.role.value,
                     'auth0_sub': auth0_sub
                 },
@@ -394,10 +340,70 @@ class Auth0Logout(Resource):
                           f'returnTo={request.host_url}'
         }, 200
 
+class UserImportResource(Resource):
+    # Content types accepted as the raw request body
+    FORMATS = {
+        'text/csv': 'csv',
+        'application/x-ndjson': 'jsonl',
+        'application/jsonl': 'jsonl',
+    }
+
+    @jwt_required()
+    def post(self):
+        """
+        Bulk-create users from a CSV or JSONL body (email, username,
+        password and optional role per record). The body is parsed as it
+        streams in; see accounts.import_users.
+        """
+        current_user = current_auth()
+        if not current_user:
+            return {'error': 'User not found'}, 404
+        if current_user.role != UserRole.ADMIN:
+            return {'error': 'Only admins can import users'}, 403
+
+        file_format = self.FORMATS.get(request.mimetype)
+        if file_format is None:
+            return {'error': f"Send the file as {', '.join(self.FORMATS)}"}, 415
+
+        try:
+            return import_users(parse_records(request.stream, file_format)), 200
+        except ImportFormatError as e:
+            return {'error': str(e)}, 400
+        except UnicodeDecodeError:
+            db.session.rollback()
+            return {'error': 'The file must be UTF-8 encoded'}, 400
+
 class ProfileResource(Resource):
+    DEFAULT_PER_PAGE = 50
+
+    def page_args(self, prefix):
+        """Read <prefix>_page and <prefix>_per_page query params"""
+        page = max(request.args.get(f'{prefix}_page', 1, type=int), 1)
+        per_page = request.args.get(f'{prefix}_per_page', self.DEFAULT_PER_PAGE, type=int)
+        return page, min(max(per_page, 1), MAX_PER_PAGE)
+
+    def paginate_rows(self, query, count_query, page, per_page):
+        """Fetch one page of projected rows plus its pagination block"""
+        total = db.session.execute(count_query).scalar()
+        rows = db.session.execute(query.limit(per_page).offset((page - 1) * per_page)).all()
+        total_pages = (total + per_page - 1) // per_page
+        return rows, {
+            'total_items': total,
+            'total_pages': total_pages,
+            'current_page': page,
+            'per_page': per_page,
+            'has_next': page < total_pages,
+            'has_prev': page > 1
+        }
+
     @jwt_required()
     def get(self):
-        """Get current user profile with associated spaces and bookings"""
+        """
+        Get current user profile with associated spaces and bookings.
+        Each nested list is paginated with spaces_page/spaces_per_page and
+        bookings_page/bookings_per_page, and loaded with one projected query
+        so the query count doesn't grow with the number of bookings.
+        """
         current_user_id = get_jwt_identity()
         
         user = db.session.get(User, current_user_id)
@@ -405,6 +411,16 @@ class ProfileResource(Resource):
         if not user:
             return {'error': 'User not found'}, 404
 
+        spaces_page, spaces_per_page = self.page_args('spaces')
+        space_rows, spaces_pagination = self.paginate_rows(
+            select(
+                Space.id, Space.name, Space.description, Space.hourly_price,
+                Space.daily_price, Space.created_at, Space.updated_at
+            ).where(Space.owner_id == user.id).order_by(Space.id),
+            select(func.count(Space.id)).where(Space.owner_id == user.id),
+            spaces_page, spaces_per_page
+        )
+
         user_spaces = [
             {
                 'id': space.id,
@@ -415,20 +431,31 @@ class ProfileResource(Resource):
                 'created_at': space.created_at.isoformat(),
                 'updated_at': space.updated_at.isoformat(),
             }
-            for space in user.spaces
+            for space in space_rows
         ]
 
+        bookings_page, bookings_per_page = self.page_args('bookings')
+        booking_rows, bookings_pagination = self.paginate_rows(
+            select(
+                Booking.id, Booking.space_id, Space.name.label('space_name'),
+                Booking.start_time, Booking.end_time, Booking.status, Booking.created_at
+            ).join(Space, Booking.space_id == Space.id)
+            .where(Booking.client_id == user.id).order_by(Booking.id),
+            select(func.count(Booking.id)).where(Booking.client_id == user.id),
+            bookings_page, bookings_per_page
+        )
+
         user_bookings = [
             {
                 'id': booking.id,
-                'space_id': booking.space.id,
-                'space_name': booking.space.name,
+                'space_id': booking.space_id,
+                'space_name': booking.space_name,
                 'start_time': booking.start_time.isoformat(),
                 'end_time': booking.end_time.isoformat(),
                 'status': booking.status.value,
                 'created_at': booking.created_at.isoformat(),
             }
-            for booking in user.bookings
+            for booking in booking_rows
         ]
 
         profile = {
@@ -440,6 +467,10 @@ class ProfileResource(Resource):
             'updated_at': user.updated_at.isoformat(),
             'spaces': user_spaces,
             'bookings': user_bookings,
+            'pagination': {
+                'spaces': spaces_pagination,
+                'bookings': bookings_pagination
+            }
         }
         
         return profile, 200
@@ -483,8 +514,12 @@ class ProfileResource(Resource):
             if len(data['password']) < 8:
                return {'error': 'Password must be at least 8 characters long'}, 400
         
-        # Assuming you're using password hashing
-            user.password_hash = generate_password_hash(data['password'])
+            try:
+                user.password = data['password']
+            except HasherBusy:
+                db.session.rollback()
+                return {'error': 'Too many requests in progress, try again shortly'}, 503, {'Retry-After': str(app.config['PASSWORD_HASH_WAIT_SECONDS'])}
+            revoke_tokens(user)
     
         try:
             db.session.commit()
@@ -509,18 +544,21 @@ class ProfileResource(Resource):
 
 
 class SpaceResource(Resource):
-    ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-    MAX_FILE_SIZE = 5 * 1024 * 1024  # 5MB
+    # Authenticated views may differ per user, so only the browser may keep
+    # a copy, and it must revalidate it
+    DETAIL_CACHE_CONTROL = 'private, no-cache'
     
-    def allowed_file(self, filename):
-        return '.' in filename and \
-               filename.rsplit('.', 1)[1].lower() in self.ALLOWED_EXTENSIONS
-
-    def validate_file_size(self, file):
-        file.seek(0, 2)  # Seek to end of file
-        size = file.tell()  # Get current position (size)
-        file.seek(0)  # Reset file position
-        return size <= self.MAX_FILE_SIZE
+    def check_image(self, file):
+        """Error message for an unacceptable uploaded image, or None"""
+        # Both checks use what was actually received, not the client's
+        # filename or headers
+        if is_oversized(file):
+            return f'File size exceeds maximum limit of {current_app.config["MAX_IMAGE_SIZE"]/1024/1024}MB'
+        if not sniff_image_type(file):
+            return f'Invalid file type. Allowed types: {", ".join(sorted({t for _, t in IMAGE_SIGNATURES}))}'
+        if exceeds_pixel_limit(file):
+            return f'Image dimensions exceed the maximum of {current_app.config["MAX_IMAGE_PIXELS"] // 1_000_000} megapixels'
+        return None
     
 
     @jwt_required()
@@ -528,7 +566,18 @@ class SpaceResource(Resource):
         try:
             # If space_id is provided, fetch a single space
             if space_id:
-                space = Space.query.get(space_id)
+                # Answer revalidations from (id, updated_at) alone, without
+                # loading the JSON columns
+                if request.if_none_match:
+                    row = db.session.execute(
+                        select(Space.id, Space.updated_at).where(Space.id == space_id)
+                    ).first()
+                    if row:
+                        response = not_modified(space_etag(row.id, row.updated_at), self.DETAIL_CACHE_CONTROL)
+                        if response:
+                            return response
+
+                space = db.session.get(Space, space_id)
                 if not space:
                     return {'error': 'Space not found'}, 404
                 space_data = {
@@ -542,19 +591,23 @@ class SpaceResource(Resource):
                     'capacity': space.capacity,
                     'amenities': space.amenities,
                     'rules': space.rules,
-                    'images': space.images or []  # Use the JSON images list directly
+                    'images': [variant_url(image, 'full') for image in space.images or []],
+                    'image_variants': image_variants(space.images),
+                    'image_status': space.image_status
+                }
+                return space_data, 200, {
+                    'ETag': f'"{space_etag(space.id, space.updated_at)}"',
+                    'Cache-Control': self.DETAIL_CACHE_CONTROL
                 }
-                return space_data, 200
 
             # Get query parameters
             status = request.args.get('status')
             page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 8, type=int)
+            per_page = get_per_page(8)
             search = request.args.get('search', '')
 
             # Get current user's type from JWT claims
-            current_user_id = get_jwt_identity()  # Ensure this is a string
-            current_user = db.session.get(User, current_user_id)
+            current_user = current_auth()
             
             if not current_user:
                 return {'error': 'User not found'}, 404
@@ -575,26 +628,26 @@ class SpaceResource(Resource):
                 # Non-admins can only see available spaces
                 query = query.filter(Space.status == SpaceStatus.AVAILABLE)
 
-            # Apply search filter if provided
+            # Apply full-text search if provided, ranked by relevance
             if search:
-                search_term = f"%{search}%"
-                query = query.filter(
-                    db.or_(
-                        Space.name.ilike(search_term),
-                        Space.description.ilike(search_term)
-                    )
-                )
+                query = apply_search(query, search)
 
-            # Execute paginated query
-            paginated_spaces = query.paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
-            )
+            # Execute paginated query, by cursor (no COUNT) or by page
+            if cursor_requested():
+                items, next_cursor = keyset_page(query, [Space.id], request.args['cursor'], per_page)
+                pagination = cursor_pagination(per_page, next_cursor)
+            else:
+                count_key = ('spaces', current_user.role.value, status if current_user.role == UserRole.ADMIN else None,
+                             ' '.join(search_terms(search)).lower())
+                items, pagination = offset_page(
+                    query, page, per_page,
+                    count_cache=space_count_cache, count_key=count_key,
+                    include_total=total_requested()
+                )
 
             # Prepare response data
             spaces = []
-            for space in paginated_spaces.items:
+            for space in items:
                 space_data = {
                     'id': space.id,
                     'name': space.name,
@@ -606,22 +659,18 @@ class SpaceResource(Resource):
                     'capacity': space.capacity,
                     'amenities': space.amenities,
                     'rules': space.rules,
-                    'images': space.images or []  # Use the JSON images list directly
+                    # Listings only need the grid image; the detail view has the rest
+                    'thumbnail': thumbnail_url(space.images)
                 }
                 spaces.append(space_data)
 
             return {
                 'spaces': spaces,
-                'pagination': {
-                    'total_items': paginated_spaces.total,
-                    'total_pages': paginated_spaces.pages,
-                    'current_page': page,
-                    'per_page': per_page,
-                    'has_next': paginated_spaces.has_next,
-                    'has_prev': paginated_spaces.has_prev
-                }
+                'pagination': pagination
             }, 200
 
+        except InvalidCursor as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
 
@@ -630,8 +679,7 @@ class SpaceResource(Resource):
     def post(self):
         """Create a new space"""
         try:
-            current_user_id = get_jwt_identity()
-            current_user = db.session.get(User, current_user_id)
+            current_user = current_auth()
 
             if not current_user:
                 return {'error': 'User not found'}, 404
@@ -649,37 +697,26 @@ class SpaceResource(Resource):
                 if field not in data:
                     return {'error': f'{field} is required'}, 400
                 
-            # Handling multiple image uploads
-            space_images = []
-            if 'images' in request.files:
-                for img in request.files.getlist('images'):
-                    if img and self.allowed_file(img.filename) and self.validate_file_size(img):
-                        try:
-                            img_url = upload_image_to_cloudinary(img)
-                            space_images.append(img_url)
-                        except Exception as e:
-                            # Log the error but continue processing other images
-                            current_app.logger.error(f"Image upload failed: {str(e)}")
-            
+            # Validate everything first so a bad legacy 'image' fails fast,
+            # before anything is staged
+            to_upload = []
+            failed_uploads = []
+            for img in request.files.getlist('images'):
+                if not img or img.filename == '':
+                    continue
+                error = self.check_image(img)
+                if error:
+                    failed_uploads.append({'filename': img.filename, 'error': error})
+                else:
+                    to_upload.append(img)
+
             # Handle single image upload for backwards compatibility
-            if 'image' in request.files:
-                image_file = request.files['image']
-                if image_file.filename != '':
-                    if not self.allowed_file(image_file.filename):
-                        return {
-                            'error': f'Invalid file type. Allowed types: {", ".join(self.ALLOWED_EXTENSIONS)}'
-                        }, 400
-                    
-                    if not self.validate_file_size(image_file):
-                        return {
-                            'error': f'File size exceeds maximum limit of {self.MAX_FILE_SIZE/1024/1024}MB'
-                        }, 400
-                    
-                    try:
-                        image_url = upload_image_to_cloudinary(image_file)
-                        space_images.append(image_url)
-                    except Exception as e:
-                        return {"error": f"Image upload failed: {str(e)}"}, 500
+            image_file = request.files.get('image')
+            if image_file and image_file.filename != '':
+                error = self.check_image(image_file)
+                if error:
+                    return {'error': error}, 400
+                to_upload.append(image_file)
 
             try:
                 amenities = json.loads(data['amenities']) if isinstance(data['amenities'], str) else data['amenities']
@@ -698,14 +735,25 @@ class SpaceResource(Resource):
                 status=SpaceStatus[data['status']],
                 amenities=amenities,
                 rules=rules,
-                images=space_images  # Store the list of image URLs
+                images=[]  # Filled in by the media worker as uploads finish
             )
 
+            # Stage the files locally; the media worker uploads them after
+            # the commit, so creating a space never waits on Cloudinary
+            stage_images(new_space, to_upload)
             db.session.add(new_space)
             db.session.commit()
 
-            return {'message': 'Space created successfully', 'space_id': new_space.id}, 201
+            return {
+                'message': 'Space created successfully',
+                'space_id': new_space.id,
+                'image_status': new_space.image_status,
+                'images_url': f'/spaces/{new_space.id}/images',
+                'failed_uploads': failed_uploads
+            }, 201
         
+        except RequestEntityTooLarge:
+            return {'error': f'Request exceeds maximum size of {current_app.config["MAX_CONTENT_LENGTH"]/1024/1024}MB'}, 413
         except IntegrityError as e:
             db.session.rollback()  # In case of an integrity error
             return {'error': 'Database error: Integrity issue'}, 500
@@ -717,9 +765,7 @@ class SpaceResource(Resource):
     def put(self, space_id):
         """Update a space's details (Admin or Owner only)"""
         try:
-            # Get the current user
-            current_user_id = get_jwt_identity()
-            current_user = db.session.get(User, current_user_id)
+            current_user = current_auth()
 
             if not current_user:
                 return {'error': 'User not found'}, 404
@@ -756,8 +802,8 @@ class SpaceResource(Resource):
             if 'rules' in data:
                 space.rules = data['rules']
 
-            # Set the updated time
-            space.updated_at = func.now()
+            # Set the updated time (also what the detail ETag is built from)
+            space.updated_at = utcnow()
 
             # Commit the changes to the database
             db.session.commit()
@@ -775,9 +821,7 @@ class SpaceResource(Resource):
     def delete(self, space_id):
         """Delete a space (Admin or Owner only)"""
         try:
-            # Get the current user
-            current_user_id = get_jwt_identity()
-            current_user = db.session.get(User, current_user_id)
+            current_user = current_auth()
 
             if not current_user:
                 return {'error': 'User not found'}, 404
@@ -806,38 +850,55 @@ class SpaceResource(Resource):
     
 class ClientSpaceResource(Resource):
     """Resource for client-specific space operations"""
+    DETAIL_CACHE_CONTROL = 'public, max-age=60'
     
-    def get(self):
+    def get(self, space_id=None):
         """
-        Get a list of available spaces with basic information
-        Supports pagination and search functionality
+        Get detailed information about a specific space when space_id is
+        given, otherwise a list of available spaces with basic information.
+        The list supports pagination and search functionality
         """
+        if space_id:
+            return self.get_space(space_id)
+
         try:
             # Get query parameters
             page = request.args.get('page', 1, type=int)
-            per_page = request.args.get('per_page', 10, type=int)
+            per_page = get_per_page(10)
             search = request.args.get('search', '')
+
+            # Anonymous visitors all see the same pages, so serve them from
+            # the response cache when possible
+            cache_params = {
+                'page': page,
+                'per_page': per_page,
+                'search': ' '.join(search_terms(search)).lower(),
+                'cursor': request.args.get('cursor'),
+                'include_total': total_requested()
+            }
+            cache_key = client_space_cache.key(cache_params)
+            cached = client_space_cache.get(cache_key)
+            if cached is not None:
+                return cached, 200, {'X-Cache': 'HIT'}
             
             # Base query - only show available spaces to clients
             query = Space.query.filter(Space.status == SpaceStatus.AVAILABLE)
             
-            # Apply search if provided
+            # Apply full-text search if provided, ranked by relevance
             if search:
-                search_term = f"%{search}%"
-                query = query.filter(
-                    db.or_(
-                        Space.name.ilike(search_term),
-                        Space.description.ilike(search_term),
-                        Space.address.ilike(search_term)
-                    )
-                )
+                query = apply_search(query, search)
             
-            # Execute paginated query
-            paginated_spaces = query.paginate(
-                page=page,
-                per_page=per_page,
-                error_out=False
-            )
+            # Execute paginated query, by cursor (no COUNT) or by page
+            if cursor_requested():
+                items, next_cursor = keyset_page(query, [Space.id], request.args['cursor'], per_page)
+                pagination = cursor_pagination(per_page, next_cursor)
+            else:
+                count_key = ('client_spaces', ' '.join(search_terms(search)).lower())
+                items, pagination = offset_page(
+                    query, page, per_page,
+                    count_cache=space_count_cache, count_key=count_key,
+                    include_total=total_requested()
+                )
             
             # Prepare response with basic information
             spaces = [{
@@ -847,31 +908,38 @@ class ClientSpaceResource(Resource):
                 'hourly_price': str(space.hourly_price),
                 'daily_price': str(space.daily_price),
                 'capacity': space.capacity,
-                'thumbnail': space.images[0].image_url if space.images else None
-            } for space in paginated_spaces.items]
+                'thumbnail': thumbnail_url(space.images)
+            } for space in items]
             
-            return {
+            response = {
                 'spaces': spaces,
-                'pagination': {
-                    'total_items': paginated_spaces.total,
-                    'total_pages': paginated_spaces.pages,
-                    'current_page': page,
-                    'per_page': per_page,
-                    'has_next': paginated_spaces.has_next,
-                    'has_prev': paginated_spaces.has_prev
-                }
-            }, 200
+                'pagination': pagination
+            }
+            client_space_cache.set(cache_key, response)
+            return response, 200, {'X-Cache': 'MISS'}
         
+        except InvalidCursor as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
             
-    def get(self, space_id):
+    def get_space(self, space_id):
         """
         Get detailed information about a specific space
         Including all images, amenities, rules, and availability
         """
         try:
-            space = Space.query.get(space_id)
+            # Answer revalidations without loading the JSON columns
+            if request.if_none_match:
+                row = db.session.execute(
+                    select(Space.id, Space.updated_at, Space.status).where(Space.id == space_id)
+                ).first()
+                if row and row.status == SpaceStatus.AVAILABLE:
+                    response = not_modified(space_etag(row.id, row.updated_at), self.DETAIL_CACHE_CONTROL)
+                    if response:
+                        return response
+
+            space = db.session.get(Space, space_id)
             
             if not space:
                 return {'error': 'Space not found'}, 404
@@ -890,15 +958,93 @@ class ClientSpaceResource(Resource):
                 'capacity': space.capacity,
                 'amenities': space.amenities,
                 'rules': space.rules,
-                'images': [image.image_url for image in space.images],
+                'images': [variant_url(image, 'full') for image in space.images or []],
+                'image_variants': image_variants(space.images),
                 'created_at': space.created_at.isoformat(),
                 'updated_at': space.updated_at.isoformat() if space.updated_at else None,
             }
             
-            return space_details, 200
+            return space_details, 200, {
+                'ETag': f'"{space_etag(space.id, space.updated_at)}"',
+                'Cache-Control': self.DETAIL_CACHE_CONTROL
+            }
             
         except Exception as e:
             return {'error': str(e)}, 500
+
+
+class SpaceImagesResource(Resource):
+    @jwt_required()
+    def get(self, space_id):
+        """Progress of a space's deferred image uploads, for polling"""
+        try:
+            current_user = current_auth()
+            if not current_user:
+                return {'error': 'User not found'}, 404
+
+            space = db.session.get(Space, space_id)
+            if not space:
+                return {'error': 'Space not found'}, 404
+
+            if space.owner_id != current_user.id and current_user.role != UserRole.ADMIN:
+                return {'error': 'Permission denied'}, 403
+
+            return {
+                'space_id': space.id,
+                'image_status': space.image_status,
+                'images': image_variants(space.images),
+                'uploads': [{
+                    'filename': upload.filename,
+                    'status': upload.status,
+                    'url': upload.url,
+                    'error': upload.last_error if upload.status == 'failed' else None
+                } for upload in space.image_uploads]
+            }, 200, {'Cache-Control': 'no-store'}
+
+        except Exception as e:
+            return {'error': str(e)}, 500
+
+
+class SpaceAvailabilityResource(Resource):
+    def get(self, space_id):
+        """
+        Check whether a space is free in [start, end) when both are given,
+        otherwise list its free windows over the next `days` days
+        """
+        try:
+            space = db.session.get(Space, space_id)
+            if not space:
+                return {'error': 'Space not found'}, 404
+
+            try:
+                start, end = parse_window(request.args)
+            except ValueError:
+                return {'error': 'Invalid datetime format. Use ISO format (YYYY-MM-DDTHH:MM:SS)'}, 400
+
+            if start >= end:
+                return {'error': 'End time must be after start time'}, 400
+
+            if space.status != SpaceStatus.AVAILABLE:
+                windows = []
+            else:
+                windows = availability.free_windows(space_id, start, end)
+
+            response = {
+                'space_id': space_id,
+                'start': start.isoformat(),
+                'end': end.isoformat(),
+                'free_windows': [{
+                    'start': window_start.replace(tzinfo=timezone.utc).isoformat(),
+                    'end': window_end.replace(tzinfo=timezone.utc).isoformat()
+                } for window_start, window_end in windows]
+            }
+            if 'start' in request.args and 'end' in request.args:
+                response['available'] = space.status == SpaceStatus.AVAILABLE and \
+                    availability.is_free(space_id, start, end)
+            return response, 200
+
+        except Exception as e:
+            return {'error': str(e)}, 500
         
 
 class BookingResource(Resource):
@@ -918,8 +1064,9 @@ class BookingResource(Resource):
             if booking.status == BookingStatus.COMPLETED:
                 return {'error': 'Cannot cancel a completed booking'}, 400
             
-            # Check cancellation time policy (at least 24 hours notice)
-            if booking.start_time <= datetime.now() + timedelta(hours=24):
+            # Check cancellation time policy (at least 24 hours notice).
+            # start_time is naive UTC, so compare it with UTC, not local time
+            if booking.start_time <= utcnow() + timedelta(hours=24):
                 return {
                     'error': 'Bookings must be cancelled at least 24 hours in advance'
                 }, 400
@@ -933,7 +1080,7 @@ class BookingResource(Resource):
             
             # Update booking status
             booking.status = BookingStatus.CANCELLED
-            booking.updated_at = datetime.now()
+            booking.updated_at = utcnow()
             
             # Attempt to refund the Stripe payment if it exists
             if booking.stripe_payment_intent_id:
@@ -968,8 +1115,9 @@ class BookingResource(Resource):
     def post(self, space_id):
         """Create a new booking for a space with Stripe payment integration"""
         try:
-            # Get current user
-            current_user_id = get_jwt_identity()
+            # Get current user. The identity is a string; place_hold binds it
+            # as a literal, which Postgres won't cast into an integer column
+            current_user_id = int(get_jwt_identity())
             
             # Validate request data
             data = request.get_json()
@@ -986,6 +1134,8 @@ class BookingResource(Resource):
                     start_time = start_time.replace(tzinfo=timezone.utc)
                 if end_time.tzinfo is None:
                     end_time = end_time.replace(tzinfo=timezone.utc)
+                start_time = start_time.astimezone(timezone.utc)
+                end_time = end_time.astimezone(timezone.utc)
             except ValueError:
                 return {'error': 'Invalid datetime format. Use ISO format (YYYY-MM-DDTHH:MM:SS)'}, 400
             
@@ -1005,30 +1155,17 @@ class BookingResource(Resource):
             if space.status != SpaceStatus.AVAILABLE:
                 return {'error': 'Space is not available for booking'}, 400
             
-            # Check for conflicting bookings
-            conflicting_booking = Booking.query.filter(
-                and_(
-                    Booking.space_id == space_id,
-                    Booking.status != BookingStatus.CANCELLED,
-                    or_(
-                        and_(
-                            Booking.start_time <= start_time,
-                            Booking.end_time > start_time
-                        ),
-                        and_(
-                            Booking.start_time < end_time,
-                            Booking.end_time >= end_time
-                        ),
-                        and_(
-                            Booking.start_time >= start_time,
-                            Booking.end_time <= end_time
-                        )
-                    )
-                )
-            ).first()
-            
-            if conflicting_booking:
-                return {'error': 'Space is already booked for this time period'}, 409
+            # The in-memory calendar answers most requests for free slots
+            # without a query. It can lag writes made by other processes, so
+            # a conflict it reports is confirmed against the bookings table
+            # before turning the request away.
+            if not availability.is_free(space_id, start_time, end_time):
+                conflict = db.session.execute(
+                    select(exists().where(Booking.overlaps(space_id, start_time, end_time)))
+                ).scalar()
+                if conflict:
+                    return {'error': 'Space is already booked for this time period'}, 409
+                availability.invalidate(space_id)
             
             # Calculate duration and amount
             duration = end_time - start_time
@@ -1051,39 +1188,43 @@ class BookingResource(Resource):
             # Convert total price to cents for Stripe
             amount_in_cents = int(total_price * 100)
             
-            # Create Stripe Payment Intent
+            # Phase 1: claim the slot with a short-lived PENDING hold. The
+            # database re-checks for conflicts atomically with the insert.
+            booking_id = place_hold(current_user_id, space_id, start_time, end_time, total_price)
+            if booking_id is None:
+                db.session.rollback()
+                return {'error': 'Space is already booked for this time period'}, 409
+            db.session.commit()
+            
+            # Phase 2: create the Stripe Payment Intent with no transaction
+            # open, then attach it to the hold
             try:
                 payment_intent = stripe.PaymentIntent.create(
                     amount=amount_in_cents,
                     currency='usd',
                     payment_method_types=['card'],
                     metadata={
+                        'booking_id': booking_id,
                         'space_id': space_id,
                         'client_id': current_user_id,
                         'start_time': start_time.isoformat(),
                         'end_time': end_time.isoformat()
-                    }
+                    },
+                    idempotency_key=f'booking-{booking_id}'
                 )
             except stripe.error.StripeError as e:
+                release_hold(booking_id)
                 return {'error': f'Payment processing error: {str(e)}'}, 402
             
-            # Create booking
-            new_booking = Booking(
-                client_id=current_user_id,
-                space_id=space_id,
-                start_time=start_time,
-                end_time=end_time,
-                total_price=total_price,
-                status=BookingStatus.PENDING,
-                stripe_payment_intent_id=payment_intent.id
-            )
+            if not attach_payment_intent(booking_id, payment_intent.id):
+                # The hold expired while Stripe was responding
+                try:
+                    stripe.PaymentIntent.cancel(payment_intent.id)
+                except stripe.error.StripeError as e:
+                    print(f"Stripe cancel error: {str(e)}")
+                return {'error': 'Reservation expired, please try again'}, 409
             
-            # Update space status
-            space.status = SpaceStatus.BOOKED
-            
-            # Save to database
-            db.session.add(new_booking)
-            db.session.commit()
+            new_booking = db.session.get(Booking, booking_id)
             
             return {
                 'message': 'Booking initiated. Complete payment to confirm.',
@@ -1097,6 +1238,7 @@ class BookingResource(Resource):
                     'total_hours': hours
                 },
                 'status': new_booking.status.value,
+                'hold_expires_at': new_booking.hold_expires_at.isoformat(),
                 'stripe_client_secret': payment_intent.client_secret
             }, 201
             
@@ -1110,12 +1252,19 @@ class BookingResource(Resource):
         try:
             current_user_id = get_jwt_identity()
             
+            # Project only the columns the response needs, joining the
+            # space's name/address instead of lazy loading it per booking
+            query = Booking.query.join(Space, Booking.space_id == Space.id)\
+                .filter(Booking.client_id == current_user_id)\
+                .with_entities(
+                    Booking.id, Booking.space_id, Booking.start_time, Booking.end_time,
+                    Booking.total_price, Booking.status, Booking.stripe_payment_status,
+                    Space.name.label('space_name'), Space.address.label('space_address')
+                )
+
             if booking_id:
                 # Get specific booking
-                booking = Booking.query.filter_by(
-                    id=booking_id,
-                    client_id=current_user_id
-                ).first()
+                booking = query.filter(Booking.id == booking_id).first()
                 
                 if not booking:
                     return {'error': 'Booking not found'}, 404
@@ -1127,41 +1276,52 @@ class BookingResource(Resource):
                     'end_time': booking.end_time.isoformat(),
                     'total_price': str(booking.total_price),
                     'status': booking.status.value,
-                    'space_name': booking.space.name,
-                    'space_address': booking.space.address,
+                    'space_name': booking.space_name,
+                    'space_address': booking.space_address,
                     'payment_status': booking.stripe_payment_status
                 }, 200
             
             else:
                 # List all user's bookings with pagination
                 page = request.args.get('page', 1, type=int)
-                per_page = request.args.get('per_page', 10, type=int)
-                
-                bookings = Booking.query.filter_by(client_id=current_user_id)\
-                    .order_by(Booking.created_at.desc())\
-                    .paginate(page=page, per_page=per_page, error_out=False)
+                per_page = get_per_page(10)
+
+                if cursor_requested():
+                    # Ids grow with created_at, so newest-first by id matches
+                    # the page mode ordering without comparing timestamps
+                    items, next_cursor = keyset_page(
+                        query, [Booking.id], request.args['cursor'], per_page, descending=True
+                    )
+                    pagination = cursor_pagination(per_page, next_cursor)
+                else:
+                    bookings = query.order_by(Booking.created_at.desc(), Booking.id.desc())\
+                        .paginate(page=page, per_page=per_page, error_out=False)
+                    items = bookings.items
+                    pagination = {
+                        'total_items': bookings.total,
+                        'total_pages': bookings.pages,
+                        'current_page': page,
+                        'per_page': per_page,
+                        'has_next': bookings.has_next,
+                        'has_prev': bookings.has_prev
+                    }
                 
                 return {
                     'bookings': [{
                         'id': b.id,
                         'space_id': b.space_id,
-                        'space_name': b.space.name,
+                        'space_name': b.space_name,
                         'start_time': b.start_time.isoformat(),
                         'end_time': b.end_time.isoformat(),
                         'total_price': str(b.total_price),
                         'status': b.status.value,
                         'payment_status': b.stripe_payment_status
-                    } for b in bookings.items],
-                    'pagination': {
-                        'total_items': bookings.total,
-                        'total_pages': bookings.pages,
-                        'current_page': page,
-                        'per_page': per_page,
-                        'has_next': bookings.has_next,
-                        'has_prev': bookings.has_prev
-                    }
+                    } for b in items],
+                    'pagination': pagination
                 }, 200
                 
+        except InvalidCursor as e:
+            return {'error': str(e)}, 400
         except Exception as e:
             return {'error': str(e)}, 500
 
@@ -1183,43 +1343,25 @@ class StripeWebhookResource(Resource):
             # Invalid signature
             return {'error': 'Invalid signature'}, 400
 
-        # Handle different event types
-        if event.type == 'payment_intent.succeeded':
-            payment_intent = event.data.object
-            
-            # Find the booking associated with this payment intent
-            booking = Booking.query.filter_by(
-                stripe_payment_intent_id=payment_intent.id
-            ).first()
-            
-            if booking:
-                # Update booking status
-                booking.status = BookingStatus.CONFIRMED
-                booking.stripe_charge_id = payment_intent.charges.data[0].id
-                
-                # Ensure the space remains booked
-                if booking.space:
-                    booking.space.status = SpaceStatus.BOOKED
-                
-                db.session.commit()
+        # Duplicate deliveries and Stripe retries are acknowledged without
+        # doing the work again
+        ledger_entry = record_event(event, payload.decode())
+        if ledger_entry is None:
+            return {'received': True, 'duplicate': True}, 200
 
-        elif event.type == 'payment_intent.payment_failed':
-            payment_intent = event.data.object
-            
-            # Find the booking associated with this payment intent
-            booking = Booking.query.filter_by(
-                stripe_payment_intent_id=payment_intent.id
-            ).first()
-            
-            if booking:
-                # Update booking status
-                booking.status = BookingStatus.CANCELLED
-                
-                # Release the space
-                if booking.space:
-                    booking.space.status = SpaceStatus.AVAILABLE
-                
-                db.session.commit()
+        if current_app.config['STRIPE_WEBHOOK_ASYNC']:
+            # Acknowledge now; the ledger worker applies it after the commit
+            db.session.info['stripe_events_queued'] = True
+        else:
+            apply_event(event)
+            mark_processed(ledger_entry)
+
+        try:
+            db.session.commit()
+        except IntegrityError:
+            # Another delivery of the same event committed first
+            db.session.rollback()
+            return {'received': True, 'duplicate': True}, 200
 
         return {'received': True}, 200
 
@@ -1228,10 +1370,13 @@ api.add_resource(BookingResource, '/spaces/<int:space_id>/book', '/bookings', '/
 api.add_resource(StripeWebhookResource, '/stripe-webhook')
 api.add_resource(ClientSpaceResource,'/client/spaces', '/client/spaces/<int:space_id>')
 api.add_resource(SpaceResource, '/spaces', '/spaces/<int:space_id>')
+api.add_resource(SpaceImagesResource, '/spaces/<int:space_id>/images')
+api.add_resource(SpaceAvailabilityResource, '/spaces/<int:space_id>/availability')
 api.add_resource(Auth0Login, '/auth0/login')
 api.add_resource(Auth0Callback, '/auth0/callback')
 api.add_resource(Auth0Logout, '/auth0/logout')
 api.add_resource(ProfileResource, '/profile')
+api.add_resource(UserImportResource, '/admin/users/import')
 api.add_resource(Login, '/login')
 api.add_resource(Register, '/register')
 api.add_resource(VerifyEmail, '/verify-email')
@@ -0,0 +1,85 @@
+"""
+Authorization context for JWT-protected requests.
+
+Access tokens carry the user's role and token version (token_claims()), so
+handlers authorize with current_auth() instead of loading the User row
+just to read its role.
+
+Tokens are still checked against the account: flask_jwt_extended asks
+_token_revoked() on every protected request, which compares the token's
+version and role with the user's current ones. Those come from a small
+cache (AUTH_USER_CACHE_TTL seconds, emptied whenever a User is written in
+this process), so most requests don't query users at all. revoke_tokens()
+bumps the version, which invalidates every token issued before it; a role
+change invalidates tokens carrying the old role. With
+AUTH_CHECK_TOKEN_VERSION off, tokens are trusted until they expire.
+"""
+from flask_jwt_extended import get_jwt
+from sqlalchemy import select
+
+from caching import TTLCache, clear_on_write
+from config import app, db, jwt
+from models import User, UserRole
+
+user_state_cache = TTLCache(ttl=app.config['AUTH_USER_CACHE_TTL'], maxsize=10_000)
+clear_on_write(User, user_state_cache)
+
+
+class AuthContext:
+    """The authenticated user, as far as authorization needs to know"""
+
+    def __init__(self, user_id, role):
+        self.id = user_id
+        self.role = role
+
+
+def token_claims(user):
+    """Additional claims for an access token issued to `user`"""
+    return {'role': user.role.value, 'ver': user.token_version}
+
+
+def revoke_tokens(user):
+    """Invalidate every access token issued to `user` so far (on commit)"""
+    user.token_version = User.token_version + 1
+
+
+def user_state(user_id):
+    """(token_version, role value) for `user_id`, or None if there is no such user"""
+    state = user_state_cache.get(user_id)
+    if state is None:
+        row = db.session.execute(
+            select(User.token_version, User.role).where(User.id == user_id)
+        ).first()
+        if row is None:
+            return None
+        state = (row.token_version, row.role.value)
+        user_state_cache.set(user_id, state)
+    return state
+
+
+@jwt.token_in_blocklist_loader
+def _token_revoked(jwt_header, jwt_payload):
+    if not app.config['AUTH_CHECK_TOKEN_VERSION']:
+        return False
+    state = user_state(int(jwt_payload['sub']))
+    if state is None:
+        return True
+    version, role = state
+    return jwt_payload.get('ver', 0) != version or jwt_payload.get('role', role) != role
+
+
+def current_auth():
+    """
+    AuthContext for the current request's token, or None if the user no
+    longer exists. Call inside @jwt_required().
+    """
+    claims = get_jwt()
+    user_id = int(claims['sub'])
+    role = claims.get('role')
+    if role is None:
+        # Tokens issued before roles were added to the claims
+        state = user_state(user_id)
+        if state is None:
+            return None
+        role = state[1]
+    return AuthContext(user_id, UserRole(role))
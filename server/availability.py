@@ -0,0 +1,203 @@
+"""
+In-process availability engine.
+
+Keeps a sorted list of busy intervals per space, loaded lazily from the
+bookings table and patched incrementally whenever a booking is inserted,
+updated or deleted. Changes are staged at flush time and only applied once
+the session commits, so rolled-back bookings never reach the calendar.
+"""
+from bisect import bisect_left, insort
+from datetime import datetime, timedelta, timezone
+import threading
+import time
+
+from sqlalchemy import event, select
+from sqlalchemy.orm import Session
+
+from config import db
+from models import Booking, ACTIVE_BOOKING_STATUSES
+
+
+def to_utc_naive(value):
+    """Normalize a datetime to naive UTC, the form bookings are stored in"""
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+class SpaceCalendar:
+    """Sorted, non-overlapping busy intervals for a single space"""
+
+    def __init__(self, intervals=()):
+        # (start, end, booking_id) tuples ordered by start time. Bookings on
+        # a space never overlap (the conflict check guarantees it), so ends
+        # are ordered too.
+        self.intervals = sorted(intervals)
+        self.loaded_at = time.monotonic()
+
+    def add(self, start, end, booking_id):
+        self.remove(booking_id)
+        insort(self.intervals, (start, end, booking_id))
+
+    def remove(self, booking_id):
+        self.intervals = [i for i in self.intervals if i[2] != booking_id]
+
+    def is_free(self, start, end):
+        idx = bisect_left(self.intervals, (end,))
+        return idx == 0 or self.intervals[idx - 1][1] <= start
+
+    def free_windows(self, start, end):
+        windows = []
+        cursor = start
+        idx = max(bisect_left(self.intervals, (start,)) - 1, 0)
+        for busy_start, busy_end, _ in self.intervals[idx:]:
+            if busy_start >= end:
+                break
+            if busy_start > cursor:
+                windows.append((cursor, busy_start))
+            cursor = max(cursor, busy_end)
+        if cursor < end:
+            windows.append((cursor, end))
+        return windows
+
+
+class AvailabilityIndex:
+    """Per-space calendars shared by every request in this process"""
+
+    def __init__(self, ttl=300):
+        # Calendars are reloaded after ttl seconds to pick up writes made by
+        # other worker processes.
+        self.ttl = ttl
+        self._calendars = {}
+        self._versions = {}
+        self._lock = threading.Lock()
+
+    def reset(self):
+        with self._lock:
+            self._calendars.clear()
+            self._versions.clear()
+
+    def invalidate(self, space_id=None):
+        """Drop cached calendars so they are reloaded on next use"""
+        with self._lock:
+            if space_id is None:
+                self._calendars.clear()
+            else:
+                self._calendars.pop(space_id, None)
+                self._versions[space_id] = self._versions.get(space_id, 0) + 1
+
+    def _calendar(self, space_id):
+        with self._lock:
+            calendar = self._calendars.get(space_id)
+            if calendar and time.monotonic() - calendar.loaded_at < self.ttl:
+                return calendar
+            version = self._versions.get(space_id, 0)
+
+        # Past bookings can't affect availability, so only load the ones
+        # still running or upcoming.
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        rows = db.session.execute(
+            select(Booking.start_time, Booking.end_time, Booking.id).where(
+                Booking.space_id == space_id,
+                Booking.holds_slot(),
+                Booking.end_time > now
+            )
+        ).all()
+        calendar = SpaceCalendar(
+            (to_utc_naive(start), to_utc_naive(end), booking_id)
+            for start, end, booking_id in rows
+        )
+
+        with self._lock:
+            # Only publish the snapshot if no commit touched this space while
+            # we were reading it.
+            if self._versions.get(space_id, 0) == version:
+                self._calendars[space_id] = calendar
+        return calendar
+
+    def is_free(self, space_id, start, end):
+        """Return True if nothing is booked on the space in [start, end)"""
+        calendar = self._calendar(space_id)
+        with self._lock:
+            return calendar.is_free(to_utc_naive(start), to_utc_naive(end))
+
+    def free_windows(self, space_id, start, end):
+        """List the free [start, end) windows on the space within the range"""
+        calendar = self._calendar(space_id)
+        with self._lock:
+            return calendar.free_windows(to_utc_naive(start), to_utc_naive(end))
+
+    def apply(self, changes):
+        """Apply committed booking changes to any calendars already loaded"""
+        with self._lock:
+            for booking_id, space_id, start, end, active in changes:
+                self._versions[space_id] = self._versions.get(space_id, 0) + 1
+                calendar = self._calendars.get(space_id)
+                if calendar is None:
+                    continue
+                if active:
+                    calendar.add(to_utc_naive(start), to_utc_naive(end), booking_id)
+                else:
+                    calendar.remove(booking_id)
+
+
+availability = AvailabilityIndex()
+
+
+def record_change(session, booking_id, space_id, start, end, active):
+    """
+    Stage a booking change for the calendars, applied when `session`
+    commits. ORM writes are staged automatically; Core inserts and updates
+    must call this themselves.
+    """
+    session.info.setdefault('availability_changes', []).append(
+        (booking_id, space_id, start, end, active)
+    )
+
+
+def _stage(target, active):
+    session = Session.object_session(target)
+    if session is None:
+        return
+    record_change(session, target.id, target.space_id, target.start_time, target.end_time, active)
+
+
+@event.listens_for(Booking, 'after_insert')
+@event.listens_for(Booking, 'after_update')
+def _booking_saved(mapper, connection, target):
+    _stage(target, target.status in ACTIVE_BOOKING_STATUSES)
+
+
+@event.listens_for(Booking, 'after_delete')
+def _booking_deleted(mapper, connection, target):
+    _stage(target, False)
+
+
+@event.listens_for(Session, 'after_commit')
+def _session_committed(session):
+    changes = session.info.pop('availability_changes', None)
+    if changes:
+        availability.apply(changes)
+
+
+@event.listens_for(Session, 'after_rollback')
+def _session_rolled_back(session):
+    session.info.pop('availability_changes', None)
+
+
+def parse_window(args, default_days=7, max_days=90):
+    """Read the ?start=&end= or ?days= window from request args"""
+    now = datetime.now(timezone.utc)
+    start = args.get('start')
+    end = args.get('end')
+    start = datetime.fromisoformat(start) if start else now
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if end:
+        end = datetime.fromisoformat(end)
+        if end.tzinfo is None:
+            end = end.replace(tzinfo=timezone.utc)
+    else:
+        days = min(args.get('days', default_days, type=int), max_days)
+        end = start + timedelta(days=days)
+    return start, end
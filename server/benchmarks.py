@@ -0,0 +1,162 @@
+"""
+Micro-benchmarks for hot database paths.
+
+Each benchmark builds its own throwaway SQLite database from the models'
+metadata, so it never touches roomsy.db. Run with:
+
+    python benchmarks.py booking-conflicts
+"""
+from datetime import datetime, timedelta
+from decimal import Decimal
+import os
+import random
+import sys
+import tempfile
+import time
+
+from sqlalchemy import create_engine, func, select, text
+from sqlalchemy.orm import Session
+
+from config import db
+from models import User, Space, Booking, UserRole, SpaceStatus, BookingStatus
+from search import apply_search
+
+
+def make_engine():
+    """Create a fresh file-backed SQLite engine with the full schema"""
+    fd, path = tempfile.mkstemp(suffix='.db', prefix='roomsy-bench-')
+    os.close(fd)
+    engine = create_engine(f'sqlite:///{path}')
+    db.metadata.create_all(engine)
+    return engine, path
+
+
+def timed(fn, repeat=200):
+    """Return the median wall time of fn() in milliseconds"""
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - started) * 1000)
+    samples.sort()
+    return samples[len(samples) // 2]
+
+
+def bench_booking_conflicts(sizes=(1_000, 10_000, 100_000, 1_000_000), num_spaces=100):
+    """Conflict check latency for a busy space as the bookings table grows"""
+    engine, path = make_engine()
+    base = datetime(2025, 1, 1)
+    statuses = list(BookingStatus)
+
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [{
+            'id': 1, 'email': 'bench@example.com', 'username': 'bench',
+            'password_hash': 'x', 'role': UserRole.OWNER,
+        }])
+        conn.execute(Space.__table__.insert(), [{
+            'id': space_id, 'owner_id': 1, 'name': f'Space {space_id}',
+            'address': 'Bench St', 'capacity': 10, 'hourly_price': Decimal('10'),
+            'daily_price': Decimal('80'), 'status': SpaceStatus.AVAILABLE,
+        } for space_id in range(1, num_spaces + 1)])
+
+    inserted = 0
+    print(f"{'bookings':>10} {'conflict check (ms)':>20}")
+    for size in sizes:
+        rows = []
+        for i in range(inserted, size):
+            # Space 1 is the hot space and gets a tenth of all history
+            space_id = 1 if i % 10 == 0 else random.randint(2, num_spaces)
+            start = base + timedelta(hours=i // 10 * 3)
+            rows.append({
+                'client_id': 1, 'space_id': space_id,
+                'start_time': start, 'end_time': start + timedelta(hours=2),
+                'total_price': Decimal('20'), 'status': random.choice(statuses),
+            })
+            if len(rows) == 50_000:
+                with engine.begin() as conn:
+                    conn.execute(Booking.__table__.insert(), rows)
+                rows = []
+        if rows:
+            with engine.begin() as conn:
+                conn.execute(Booking.__table__.insert(), rows)
+        inserted = size
+
+        # New bookings land at the end of the calendar, after all history
+        probe_start = base + timedelta(hours=(size // 10 - 1) * 3)
+        stmt = select(Booking.id).where(
+            Booking.overlaps(1, probe_start, probe_start + timedelta(hours=4))
+        ).limit(1)
+        with Session(engine) as session:
+            elapsed = timed(lambda: session.execute(stmt).first())
+        print(f'{size:>10} {elapsed:>20.3f}')
+
+    with engine.connect() as conn:
+        compiled = stmt.compile(engine, compile_kwargs={'literal_binds': True})
+        plan = conn.execute(text(f'EXPLAIN QUERY PLAN {compiled}')).fetchall()
+        print('plan:', '; '.join(row[-1] for row in plan))
+
+    engine.dispose()
+    os.remove(path)
+
+
+def bench_space_search(num_spaces=100_000, terms=('loft', 'stu', 'quiet garden', 'nairobi', 'zq')):
+    """ILIKE scan vs full-text index for a listing page plus its total count"""
+    engine, path = make_engine()
+    rng = random.Random(42)
+    common = ['loft', 'studio', 'quiet', 'garden', 'rooftop', 'office', 'hall',
+              'kitchen', 'gallery', 'lounge', 'terrace', 'workshop', 'bright', 'cosy']
+    # A long tail of rarer words so descriptions look like real text
+    vocabulary = common + [
+        ''.join(rng.choices('abcdefghijklmnopqrstuvwxyz', k=rng.randint(4, 9)))
+        for _ in range(5000)
+    ]
+    cities = ['Nairobi', 'Mombasa', 'Kisumu', 'Nakuru', 'Eldoret']
+
+    with engine.begin() as conn:
+        conn.execute(User.__table__.insert(), [{
+            'id': 1, 'email': 'bench@example.com', 'username': 'bench',
+            'password_hash': 'x', 'role': UserRole.OWNER,
+        }])
+        conn.execute(Space.__table__.insert(), [{
+            'owner_id': 1,
+            'name': ' '.join(rng.sample(common, 2)).title(),
+            'description': ' '.join(rng.choices(vocabulary, k=40)),
+            'address': f'{rng.randint(1, 999)} {rng.choice(cities)} Road',
+            'capacity': 10, 'hourly_price': Decimal('10'), 'daily_price': Decimal('80'),
+            'status': SpaceStatus.AVAILABLE,
+        } for _ in range(num_spaces)])
+
+    def page_and_count(stmt):
+        session.execute(stmt.limit(10)).all()
+        session.execute(select(func.count()).select_from(stmt.order_by(None).subquery())).scalar()
+
+    print(f"{'term':>14} {'matches':>8} {'ilike (ms)':>12} {'fts (ms)':>10}")
+    with Session(engine) as session:
+        for term in terms:
+            base = select(Space.id).where(Space.status == SpaceStatus.AVAILABLE)
+            pattern = f'%{term}%'
+            scan = base.where(Space.name.ilike(pattern) | Space.description.ilike(pattern) |
+                              Space.address.ilike(pattern))
+            indexed = apply_search(base, term, dialect='sqlite')
+            matches = session.execute(
+                select(func.count()).select_from(indexed.order_by(None).subquery())
+            ).scalar()
+            scan_ms = timed(lambda: page_and_count(scan), repeat=5)
+            fts_ms = timed(lambda: page_and_count(indexed), repeat=5)
+            print(f'{term:>14} {matches:>8} {scan_ms:>12.3f} {fts_ms:>10.3f}')
+
+    engine.dispose()
+    os.remove(path)
+
+
+BENCHMARKS = {
+    'booking-conflicts': bench_booking_conflicts,
+    'space-search': bench_space_search,
+}
+
+
+if __name__ == '__main__':
+    names = sys.argv[1:] or list(BENCHMARKS)
+    for name in names:
+        print(f'== {name} ==')
+        BENCHMARKS[name]()
@@ -0,0 +1,159 @@
+"""
+Small caches and cache backends.
+
+TTLCache is a thread-safe, in-process LRU whose entries also expire after
+`ttl` seconds. SharedCacheStandIn mimics a shared cache server (values are
+serialized, so nothing is shared by reference) for development and tests.
+ResponseCache namespaces whole API responses on top of either backend.
+clear_on_write() ties caches to a model so they are emptied as soon as a
+session that inserted, updated or deleted rows of that model commits.
+"""
+from collections import OrderedDict
+import json
+import threading
+import time
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+
+class TTLCache:
+    def __init__(self, ttl, maxsize=1024):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._entries = OrderedDict()
+        self._counters = {}
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self):
+        """Bumped by every clear(); see set()"""
+        return self._generation
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value, ttl=None, generation=None):
+        """
+        Store `value`. With `generation` (read before computing the value),
+        the write is dropped if the cache was cleared since.
+        """
+        with self._lock:
+            if generation is not None and generation != self._generation:
+                return
+            self._entries[key] = (value, time.monotonic() + (ttl or self.ttl))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def incr(self, key, delta=1, ttl=None):
+        """
+        Atomically add to a counter and return it. Counters without `ttl`
+        are kept outside the LRU; with one they are LRU entries that expire
+        `ttl` seconds after their first increment.
+        """
+        with self._lock:
+            if ttl is None:
+                self._counters[key] = self._counters.get(key, 0) + delta
+                return self._counters[key]
+            now = time.monotonic()
+            value, expires_at = self._entries.get(key, (0, now))
+            if expires_at <= now:
+                value, expires_at = 0, now + ttl
+            self._entries[key] = (value + delta, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+            return value + delta
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+            self._generation += 1
+
+
+class SharedCacheStandIn(TTLCache):
+    """
+    Local stand-in for a shared cache such as Redis or Memcached. Values
+    round-trip through JSON like they would over the wire, so callers can't
+    rely on getting the same object back. A real client only needs the same
+    get/set/incr/clear methods.
+    """
+
+    def get(self, key):
+        value = super().get(key)
+        return None if value is None else json.loads(value)
+
+    def set(self, key, value, ttl=None, generation=None):
+        super().set(key, json.dumps(value), ttl, generation)
+
+
+def make_backend(name, ttl, maxsize=1024):
+    backends = {'local': TTLCache, 'shared': SharedCacheStandIn}
+    if name not in backends:
+        raise ValueError(f"Unknown cache backend '{name}'")
+    return backends[name](ttl=ttl, maxsize=maxsize)
+
+
+class ResponseCache:
+    """
+    Cache for API response bodies. Keys carry a generation number stored in
+    the backend, so clear() invalidates every entry in one step even when
+    the backend is shared between processes.
+    """
+
+    def __init__(self, namespace, backend):
+        self.namespace = namespace
+        self.backend = backend
+
+    def key(self, params):
+        """
+        Key for `params` under the current generation. Take it before
+        building a response and store the response under it, so a clear()
+        in between leaves the stale body unreachable.
+        """
+        generation = self.backend.incr(f'{self.namespace}:generation', 0)
+        return f'{self.namespace}:{generation}:{json.dumps(params, sort_keys=True)}'
+
+    def get(self, key):
+        return self.backend.get(key)
+
+    def set(self, key, body):
+        self.backend.set(key, body)
+
+    def clear(self):
+        self.backend.incr(f'{self.namespace}:generation')
+
+
+def clear_on_write(model, *caches):
+    """Clear `caches` after any commit that wrote rows of `model`"""
+    marker = object()
+
+    def staged(mapper, connection, target):
+        session = Session.object_session(target)
+        if session is not None:
+            session.info[marker] = True
+
+    for name in ('after_insert', 'after_update', 'after_delete'):
+        event.listen(model, name, staged)
+
+    @event.listens_for(Session, 'after_commit')
+    def committed(session):
+        if session.info.pop(marker, False):
+            for cache in caches:
+                cache.clear()
+
+    @event.listens_for(Session, 'after_rollback')
+    def rolled_back(session):
+        session.info.pop(marker, None)
@@ -3,11 +3,12 @@ from flask_migrate import Migrate
 from flask_restful import Api
 from flask_sqlalchemy import SQLAlchemy
 from sqlalchemy import MetaData
-from flask_bcrypt import Bcrypt
 from flask_cors import CORS
 from flask_jwt_extended import JWTManager
+from werkzeug.middleware.proxy_fix import ProxyFix
 from datetime import timedelta
 import os
+import instrumentation
 
 app = Flask(__name__)
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///roomsy.db'
@@ -16,12 +17,114 @@ app.secret_key = b"\xa4\x82\x9fs\xf2\x81\xa4'&\xfd\xf1\x07\xe2\x1b>\xc7"
 app.json.compact = False
 app.config['JWT_ACCESS_TOKEN_EXPIRES'] = timedelta(days=10)
 
+# Bulk user provisioning (see accounts.py)
+app.config['USER_IMPORT_BATCH_SIZE'] = 1000
+app.config['USER_IMPORT_HASH_WORKERS'] = int(os.getenv('USER_IMPORT_HASH_WORKERS', os.cpu_count() or 2))
+app.config['USER_IMPORT_MAX_ERRORS'] = 100  # row errors listed in an import report
+
+# Token checks (see auth.py): compare each token's version and role with
+# the user's, cached per user for AUTH_USER_CACHE_TTL seconds (0: no cache)
+app.config['AUTH_CHECK_TOKEN_VERSION'] = True
+app.config['AUTH_USER_CACHE_TTL'] = 30
+
+# Outbound mail queue (see mailer.py)
+app.config['MAIL_SERVER'] = os.getenv('MAIL_SERVER', 'smtp.gmail.com')
+app.config['MAIL_PORT'] = int(os.getenv('MAIL_PORT', 587))
+app.config['MAIL_USE_TLS'] = os.getenv('MAIL_USE_TLS', 'true').lower() == 'true'
+app.config['MAIL_QUEUE_WORKER'] = True  # send from a background thread in this process
+app.config['MAIL_BATCH_SIZE'] = 50
+app.config['MAIL_MAX_ATTEMPTS'] = 5
+app.config['MAIL_RETRY_BASE_SECONDS'] = 30
+app.config['MAIL_POLL_SECONDS'] = 30
+
+# Password hashing (see passwords.py)
+app.config['PASSWORD_HASHER'] = 'bcrypt'
+app.config['PASSWORD_BCRYPT_ROUNDS'] = 12  # existing hashes are upgraded on login when this changes
+app.config['PASSWORD_HASH_WORKERS'] = int(os.getenv('PASSWORD_HASH_WORKERS', 2))  # 0 hashes on the request thread
+app.config['PASSWORD_HASH_MAX_PENDING'] = 16  # queued + running jobs before callers wait
+app.config['PASSWORD_HASH_WAIT_SECONDS'] = 5  # then fail with 503
+
+# Outbound HTTP (see http_client.py)
+app.config['HTTP_TIMEOUT'] = (3.05, 20)  # (connect, read) seconds when a call sets none
+app.config['HTTP_POOL_HOSTS'] = 10  # hosts with a kept-alive pool
+app.config['HTTP_POOL_SIZE'] = 10  # connections kept per host
+app.config['HTTP_RETRIES'] = 2
+app.config['STRIPE_TIMEOUT'] = 30
+
+# Unpaid bookings hold their slot this long (see reservations.py)
+app.config['BOOKING_HOLD_MINUTES'] = 15
+app.config['HOLD_SWEEP_QUEUE_WORKER'] = True  # expire holds from a background thread in this process
+app.config['HOLD_SWEEP_BATCH_SIZE'] = 200
+app.config['HOLD_SWEEP_POLL_SECONDS'] = 60
+app.config['HOLD_SWEEP_CANCEL_CONCURRENCY'] = 4
+
+# Stripe webhook events (see stripe_events.py). With STRIPE_WEBHOOK_ASYNC
+# the webhook only records events and a background worker applies them.
+app.config['STRIPE_WEBHOOK_ASYNC'] = os.getenv('STRIPE_WEBHOOK_ASYNC', 'false').lower() == 'true'
+app.config['STRIPE_EVENTS_QUEUE_WORKER'] = True
+app.config['STRIPE_EVENTS_BATCH_SIZE'] = 50
+app.config['STRIPE_EVENTS_MAX_ATTEMPTS'] = 5
+app.config['STRIPE_EVENTS_RETRY_BASE_SECONDS'] = 30
+app.config['STRIPE_EVENTS_POLL_SECONDS'] = 30
+
+# Stripe reconciliation (see reconciliation.py)
+app.config['STRIPE_RECONCILE_PAGE_SIZE'] = 100  # Stripe's maximum
+app.config['STRIPE_RECONCILE_LOOKBACK_HOURS'] = 24
+app.config['STRIPE_RECONCILE_INITIAL_DAYS'] = 7
+
+# Image uploads (see uploads.py)
+app.config['MAX_IMAGE_SIZE'] = 5 * 1024 * 1024  # per file
+app.config['MAX_IMAGE_PIXELS'] = 40_000_000  # width x height, read from the header before decoding
+app.config['MAX_CONTENT_LENGTH'] = 30 * 1024 * 1024  # whole request; larger bodies get 413
+app.config['UPLOAD_CONCURRENCY'] = 4  # parallel uploads across all requests
+app.config['UPLOAD_TIMEOUT'] = 20  # seconds per attempt
+app.config['UPLOAD_MAX_RETRIES'] = 3
+app.config['UPLOAD_BACKOFF_SECONDS'] = 0.5
+app.config['UPLOAD_DEADLINE'] = 60  # seconds for a whole batch
+
+# Deferred image pipeline (see media.py)
+app.config['MEDIA_STAGING_DIR'] = os.getenv('MEDIA_STAGING_DIR', os.path.join(app.instance_path, 'media-staging'))
+app.config['MEDIA_QUEUE_WORKER'] = True  # upload from a background thread in this process
+app.config['MEDIA_BATCH_SIZE'] = 8
+app.config['MEDIA_MAX_ATTEMPTS'] = 3  # each attempt already retries UPLOAD_MAX_RETRIES times
+app.config['MEDIA_RETRY_BASE_SECONDS'] = 60
+app.config['MEDIA_POLL_SECONDS'] = 30
+
+# Response cache for public listings: 'local' (in-process LRU) or 'shared'
+app.config['RESPONSE_CACHE_BACKEND'] = os.getenv('RESPONSE_CACHE_BACKEND', 'local')
+app.config['RESPONSE_CACHE_TTL'] = int(os.getenv('RESPONSE_CACHE_TTL', 60))
+
+# Rate limits for the account endpoints (see ratelimit.py): 'local' keeps
+# counters in this process, 'shared' in a cache all processes use
+app.config['RATE_LIMIT_ENABLED'] = True
+app.config['RATE_LIMIT_BACKEND'] = os.getenv('RATE_LIMIT_BACKEND', 'local')
+app.config['RATE_LIMITS'] = {  # kind -> (max hits, window seconds)
+    'login': {'ip': (20, 60), 'email_failures': (5, 15 * 60)},
+    'register': {'ip': (5, 60)},
+    'verify-email': {'ip': (20, 60), 'email_failures': (5, 15 * 60)},
+    'resend-verification': {'ip': (5, 60), 'email': (3, 15 * 60)},
+}
+# Reverse proxies in front of the app. The 'ip' limits key on
+# request.remote_addr, which behind a proxy is the proxy itself, so every
+# client would share one bucket. With N trusted hops ProxyFix takes the
+# client address from the Nth X-Forwarded-For entry from the right. Keep
+# it 0 when clients connect directly, or they can pick their own address.
+app.config['TRUSTED_PROXY_COUNT'] = int(os.getenv('TRUSTED_PROXY_COUNT', 0))
+if app.config['TRUSTED_PROXY_COUNT']:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=app.config['TRUSTED_PROXY_COUNT'])
+
 # Auth0 Configuration
 app.config['AUTH0_DOMAIN'] = os.getenv('AUTH0_DOMAIN')
 app.config['AUTH0_CLIENT_ID'] = os.getenv('AUTH0_CLIENT_ID')
 app.config['AUTH0_CLIENT_SECRET'] = os.getenv('AUTH0_CLIENT_SECRET')
 app.config['AUTH0_AUDIENCE'] = os.getenv('AUTHO_AUDIENCE')
 
+# Auth0 discovery document and signing keys (see oidc.py)
+app.config['OIDC_REFRESH_WORKER'] = True  # warm and refresh from a background thread in this process
+app.config['OIDC_REFRESH_SECONDS'] = 30 * 60
+app.config['OIDC_CACHE_TTL'] = 60 * 60  # refetched inline on the next login after this
+app.config['OIDC_MIN_REFRESH_SECONDS'] = 60  # between forced JWKS refetches for unknown keys
+
 CORS(app)
 
 metadata = MetaData(naming_convention={
@@ -32,6 +135,6 @@ db = SQLAlchemy(metadata=metadata)
 db.init_app(app)
 
 migrate = Migrate(app, db)
-bcrypt = Bcrypt(app)
 api = Api(app)
 jwt = JWTManager(app)
+instrumentation.init_app(app)
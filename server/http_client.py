@@ -0,0 +1,141 @@
+"""
+Shared outbound HTTP layer.
+
+Every requests-based client (our own calls, the Stripe SDK and Auth0 via
+authlib) goes through one HTTPAdapter, so connections to each host are
+kept alive in a pool and reused across requests instead of paying DNS, TCP
+and TLS again. Cloudinary's SDK talks to urllib3 directly, so its module
+level PoolManager is replaced with one sized for parallel uploads.
+
+Requests without an explicit timeout get HTTP_TIMEOUT, idempotent requests
+are retried on connection errors and 502/503/504, and each host's call
+count, error count and latency are collected in `host_metrics`.
+"""
+from collections import defaultdict
+import threading
+import time
+from urllib.parse import urlsplit
+
+from authlib.integrations.requests_client import OAuth2Session
+import cloudinary
+import cloudinary.uploader
+import requests
+from requests.adapters import HTTPAdapter
+import stripe
+import urllib3
+from urllib3.util.retry import Retry
+
+from config import app
+
+
+class HostMetrics:
+    """Thread-safe per-host call counts and latencies"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hosts = defaultdict(lambda: {'requests': 0, 'errors': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+
+    def record(self, host, elapsed_ms, error=False):
+        with self._lock:
+            entry = self._hosts[host]
+            entry['requests'] += 1
+            entry['errors'] += int(error)
+            entry['total_ms'] += elapsed_ms
+            entry['max_ms'] = max(entry['max_ms'], elapsed_ms)
+
+    def snapshot(self):
+        """{host: {requests, errors, avg_ms, max_ms}}"""
+        with self._lock:
+            return {
+                host: {
+                    'requests': entry['requests'],
+                    'errors': entry['errors'],
+                    'avg_ms': round(entry['total_ms'] / entry['requests'], 1),
+                    'max_ms': round(entry['max_ms'], 1),
+                }
+                for host, entry in self._hosts.items()
+            }
+
+    def clear(self):
+        with self._lock:
+            self._hosts.clear()
+
+
+host_metrics = HostMetrics()
+
+
+class PooledAdapter(HTTPAdapter):
+    """HTTPAdapter that applies the default timeout and records metrics"""
+
+    def send(self, request, timeout=None, **kwargs):
+        started = time.perf_counter()
+        error = True
+        try:
+            response = super().send(request, timeout=timeout or app.config['HTTP_TIMEOUT'], **kwargs)
+            error = response.status_code >= 500
+            return response
+        finally:
+            host_metrics.record(urlsplit(request.url).netloc, (time.perf_counter() - started) * 1000, error)
+
+    def close(self):
+        # Shared by every session, including short-lived ones authlib opens
+        # and closes per call; closing one must not drop the pools
+        pass
+
+
+adapter = PooledAdapter(
+    pool_connections=app.config['HTTP_POOL_HOSTS'],
+    pool_maxsize=app.config['HTTP_POOL_SIZE'],
+    max_retries=Retry(
+        total=app.config['HTTP_RETRIES'],
+        backoff_factor=0.3,
+        status_forcelist=(502, 503, 504),
+        raise_on_status=False
+    )
+)
+
+
+def mount_pool(session):
+    """Route `session`'s HTTP(S) traffic through the shared pools"""
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
+
+
+http_session = mount_pool(requests.Session())
+
+
+class PooledOAuth2Session(OAuth2Session):
+    """authlib session class (client_cls) that uses the shared pools"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        mount_pool(self)
+
+
+class InstrumentedPoolManager(urllib3.PoolManager):
+    """urllib3 PoolManager that records per-host metrics"""
+
+    def urlopen(self, method, url, *args, **kwargs):
+        started = time.perf_counter()
+        error = True
+        try:
+            response = super().urlopen(method, url, *args, **kwargs)
+            error = response.status >= 500
+            return response
+        finally:
+            host_metrics.record(urlsplit(url).netloc, (time.perf_counter() - started) * 1000, error)
+
+
+# Stripe: reuse the shared session. POSTs aren't retried by the adapter;
+# the SDK retries them itself with idempotency keys.
+stripe.default_http_client = stripe.RequestsClient(timeout=app.config['STRIPE_TIMEOUT'], session=http_session)
+stripe.max_network_retries = app.config['HTTP_RETRIES']
+
+# Cloudinary: its default pool keeps a single connection per host, so
+# parallel uploads would open (and handshake) new ones every time
+cloudinary.uploader._http = InstrumentedPoolManager(
+    num_pools=app.config['HTTP_POOL_HOSTS'],
+    maxsize=app.config['UPLOAD_CONCURRENCY'],
+    **cloudinary.CERT_KWARGS
+)
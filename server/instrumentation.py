@@ -0,0 +1,57 @@
+"""
+Per-request SQL statement counting.
+
+Every statement executed through SQLAlchemy is counted against the current
+request, reported back in the X-SQL-Query-Count header when enabled, and
+logged when a request crosses SQL_QUERY_WARN_THRESHOLD. Tests can use
+recorded_queries() to assert exact statement counts for a block of code.
+"""
+from contextlib import contextmanager
+import threading
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+_local = threading.local()
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def _count_statement(conn, cursor, statement, parameters, context, executemany):
+    if has_app_context():
+        g.sql_query_count = g.get('sql_query_count', 0) + 1
+    for recorder in getattr(_local, 'recorders', ()):
+        recorder.append(statement)
+
+
+@contextmanager
+def recorded_queries():
+    """Collect the SQL statements this thread executes inside the block"""
+    statements = []
+    recorders = getattr(_local, 'recorders', None)
+    if recorders is None:
+        recorders = _local.recorders = []
+    recorders.append(statements)
+    try:
+        yield statements
+    finally:
+        recorders.remove(statements)
+
+
+def init_app(app):
+    app.config.setdefault('SQL_QUERY_COUNT_HEADER', app.debug)
+    app.config.setdefault('SQL_QUERY_WARN_THRESHOLD', 20)
+
+    @app.before_request
+    def reset_query_count():
+        g.sql_query_count = 0
+
+    @app.after_request
+    def report_query_count(response):
+        count = g.get('sql_query_count', 0)
+        if app.config['SQL_QUERY_COUNT_HEADER'] or app.testing:
+            response.headers['X-SQL-Query-Count'] = str(count)
+        threshold = app.config['SQL_QUERY_WARN_THRESHOLD']
+        if threshold and count > threshold:
+            app.logger.warning(f"{count} SQL queries for {request.method} {request.path}")
+        return response
@@ -0,0 +1,141 @@
+"""
+Outbound mail queue.
+
+Request handlers call enqueue_email(), which only adds a row to the
+outbound_emails table in the caller's transaction. A background worker
+thread claims due rows in batches, sends them over one authenticated SMTP
+connection reused for every message until the queue is empty, and
+reschedules failures with exponential backoff.
+
+Settings (MAIL_SERVER, MAIL_BATCH_SIZE, ...) live in config.py.
+"""
+from email.mime.text import MIMEText
+import os
+import smtplib
+
+from flask import current_app
+from sqlalchemy import event, insert
+from sqlalchemy.orm import Session
+
+from config import app, db
+from models import OutboundEmail, utcnow
+from workers import QueueWorker
+
+
+def enqueue_email(recipient, subject, body):
+    """Queue an email in the current session; it is sent after commit"""
+    email = OutboundEmail(recipient=recipient, subject=subject, body=body)
+    db.session.add(email)
+    db.session.info['mail_queued'] = True
+    return email
+
+
+def enqueue_emails(messages):
+    """Queue many (recipient, subject, body) emails with one executemany"""
+    if messages:
+        db.session.execute(insert(OutboundEmail), [
+            {'recipient': recipient, 'subject': subject, 'body': body}
+            for recipient, subject, body in messages
+        ])
+        db.session.info['mail_queued'] = True
+
+
+class SMTPTransport:
+    """One lazily opened, reused, authenticated SMTP connection"""
+
+    def __init__(self, config):
+        self.config = config
+        self._smtp = None
+
+    def _connect(self):
+        sender = os.getenv('EMAIL_USER')
+        password = os.getenv('EMAIL_PASSWORD')
+        smtp = smtplib.SMTP(self.config['MAIL_SERVER'], self.config['MAIL_PORT'], timeout=30)
+        if self.config['MAIL_USE_TLS']:
+            smtp.starttls()
+        if sender and password:
+            smtp.login(sender, password)
+        return smtp
+
+    def send(self, recipient, subject, body):
+        sender = os.getenv('EMAIL_USER')
+        if not sender:
+            raise ValueError("Email credentials not found in environment variables")
+
+        msg = MIMEText(body)
+        msg['Subject'] = subject
+        msg['From'] = sender
+        msg['To'] = recipient
+
+        if self._smtp is None:
+            self._smtp = self._connect()
+        try:
+            self._smtp.send_message(msg)
+        except smtplib.SMTPServerDisconnected:
+            # The server dropped an idle connection; reconnect once
+            self._smtp = self._connect()
+            self._smtp.send_message(msg)
+
+    def close(self):
+        if self._smtp is not None:
+            try:
+                self._smtp.quit()
+            except smtplib.SMTPException:
+                pass
+            self._smtp = None
+
+
+class MailWorker(QueueWorker):
+    model = OutboundEmail
+    claimed_status = 'sending'
+    name = 'mail-queue'
+    config_prefix = 'MAIL'
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.transport = SMTPTransport(app.config)
+
+    def idle(self):
+        # Nothing left to send: drop the connection rather than hold it idle
+        self.transport.close()
+
+    def process_batch(self):
+        """Send one batch of due emails; returns how many were attempted"""
+        emails = self.claim()
+        for email in emails:
+            email.attempts += 1
+            try:
+                self.transport.send(email.recipient, email.subject, email.body)
+                email.status = 'sent'
+                email.sent_at = utcnow()
+                email.last_error = None
+                email.claim_token = None
+            except Exception as e:
+                # Drop the connection so the next message starts clean
+                self.transport.close()
+                if not self.retry_later(email, e):
+                    current_app.logger.error(f"Giving up on email {email.id} to {email.recipient}: {e}")
+            # Record each outcome right away so a crash can't resend mail
+            # that already went out
+            db.session.commit()
+        return len(emails)
+
+
+mail_worker = MailWorker(app)
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_worker(session):
+    if session.info.pop('mail_queued', False):
+        mail_worker.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_wake(session):
+    session.info.pop('mail_queued', None)
+
+
+@app.cli.command('send-queued-emails')
+def send_queued_emails():
+    """Send all due queued emails and exit"""
+    print(f"Processed {mail_worker.drain()} queued emails")
@@ -0,0 +1,226 @@
+"""
+Deferred image pipeline.
+
+SpaceResource.post only writes the uploaded files to MEDIA_STAGING_DIR and
+records a SpaceImageUpload row per file, so the space is created without
+waiting on Cloudinary. After the commit a background worker resizes each
+staged file into the VARIANTS below with Pillow, uploads them in batches
+(in parallel, through uploads.upload_images), fills in Space.images as
+uploads finish and keeps Space.image_status up to date for clients polling
+GET /spaces/<id>/images.
+
+Each Space.images entry maps variant names to URLs. Entries written before
+variants existed are plain URL strings; variant_url() reads both.
+"""
+import io
+import os
+import uuid
+
+from flask import current_app
+from PIL import Image, ImageOps, features
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from werkzeug.datastructures import FileStorage
+
+from config import app, db
+from models import SpaceImageUpload
+from uploads import sniff_image_type, upload_images
+from workers import QueueWorker
+
+# name -> (width, height, crop). Cropped variants fill the box exactly;
+# 'full' only shrinks to fit inside it.
+VARIANTS = {
+    'thumbnail': (320, 240, True),
+    'card': (640, 480, True),
+    'full': (1600, 1200, False),
+}
+VARIANT_QUALITY = 80
+VARIANT_FORMAT, VARIANT_EXTENSION = ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+
+
+def variant_url(image, variant):
+    """URL of `variant` for one Space.images entry"""
+    if isinstance(image, str):
+        return image
+    return image.get(variant) or image.get('full')
+
+
+def thumbnail_url(images):
+    """The listing thumbnail for a space: the first image's smallest variant"""
+    return variant_url(images[0], 'thumbnail') if images else None
+
+
+def image_variants(images):
+    """Space.images with legacy URL strings expanded to variant dicts"""
+    return [
+        {name: variant_url(image, name) for name in VARIANTS}
+        for image in images or []
+    ]
+
+
+def make_variants(path):
+    """
+    Decode the image at `path` and return {variant name: encoded bytes}.
+    Raises OSError (PIL.UnidentifiedImageError) for files that aren't images
+    and PIL.Image.DecompressionBombError for ones too large to decode.
+    """
+    with Image.open(path) as original:
+        # Let JPEG decode at a reduced scale when the source is much larger
+        # than the biggest variant
+        width, height, _ = VARIANTS['full']
+        original.draft('RGB', (width, height))
+        image = ImageOps.exif_transpose(original)
+        if VARIANT_FORMAT == 'JPEG' or image.mode not in ('RGB', 'RGBA'):
+            keep_alpha = VARIANT_FORMAT == 'WEBP' and 'A' in image.getbands()
+            image = image.convert('RGBA' if keep_alpha else 'RGB')
+
+        variants = {}
+        for name, (width, height, crop) in VARIANTS.items():
+            if crop:
+                resized = ImageOps.fit(image, (width, height), Image.LANCZOS)
+            else:
+                resized = image.copy()
+                resized.thumbnail((width, height), Image.LANCZOS)
+            buffer = io.BytesIO()
+            resized.save(buffer, VARIANT_FORMAT, quality=VARIANT_QUALITY)
+            variants[name] = buffer.getvalue()
+        return variants
+
+
+def stage_images(space, files):
+    """
+    Save `files` to the staging directory and queue them for upload to
+    `space` in the current session. Staged files are removed again if the
+    session rolls back.
+    """
+    staging_dir = current_app.config['MEDIA_STAGING_DIR']
+    os.makedirs(staging_dir, exist_ok=True)
+    staged = db.session.info.setdefault('media_staged', [])
+
+    for position, image_file in enumerate(files):
+        path = os.path.join(staging_dir, f'{uuid.uuid4().hex}.{sniff_image_type(image_file)}')
+        image_file.save(path)
+        staged.append(path)
+        space.image_uploads.append(SpaceImageUpload(
+            position=position,
+            filename=image_file.filename,
+            staged_path=path
+        ))
+    space.image_status = 'pending' if files else 'ready'
+
+
+def refresh_space_images(space):
+    """Rebuild Space.images and image_status from its upload rows"""
+    uploads = space.image_uploads
+    space.images = [upload.variants for upload in uploads if upload.status == 'uploaded']
+    statuses = {upload.status for upload in uploads}
+    if statuses & {'pending', 'uploading'}:
+        space.image_status = 'pending'
+    elif 'failed' in statuses:
+        space.image_status = 'failed'
+    else:
+        space.image_status = 'ready'
+
+
+def remove_staged(paths):
+    for path in paths:
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+class MediaWorker(QueueWorker):
+    model = SpaceImageUpload
+    claimed_status = 'uploading'
+    name = 'media-queue'
+    config_prefix = 'MEDIA'
+
+    def process_batch(self):
+        """Resize and upload one batch of staged images; returns how many were attempted"""
+        uploads = self.claim()
+        files = {}
+        done = []
+        for upload in uploads:
+            upload.attempts += 1
+            try:
+                variants = make_variants(upload.staged_path)
+            except (OSError, Image.DecompressionBombError) as e:
+                # Missing, undecodable or too large to decode: retrying can't help
+                upload.status = 'failed'
+                upload.last_error = str(e)
+                upload.claim_token = None
+                done.append(upload.staged_path)
+                continue
+            except Exception as e:
+                # Anything else only costs this image an attempt, never the
+                # rest of the batch
+                if not self.retry_later(upload, e):
+                    current_app.logger.error(f"Giving up on image {upload.filename} for space {upload.space_id}")
+                    done.append(upload.staged_path)
+                continue
+            stem = os.path.splitext(upload.filename)[0]
+            files[upload.id] = {
+                name: FileStorage(stream=io.BytesIO(data), filename=f'{stem}-{name}.{VARIANT_EXTENSION}')
+                for name, data in variants.items()
+            }
+
+        # Every variant of every image in the batch goes up in parallel
+        batch = [image_file for variants in files.values() for image_file in variants.values()]
+        urls, failures = upload_images(batch)
+        errors = {id(image_file): error for image_file, error in failures}
+        urls = iter(urls)
+        uploaded = {id(image_file): next(urls) for image_file in batch if id(image_file) not in errors}
+
+        for upload in uploads:
+            variants = files.get(upload.id)
+            if variants is None:
+                continue
+            failed = [errors[id(image_file)] for image_file in variants.values() if id(image_file) in errors]
+            if failed:
+                if not self.retry_later(upload, failed[0]):
+                    current_app.logger.error(f"Giving up on image {upload.filename} for space {upload.space_id}")
+                    done.append(upload.staged_path)
+            else:
+                upload.status = 'uploaded'
+                upload.variants = {name: uploaded[id(image_file)] for name, image_file in variants.items()}
+                upload.url = upload.variants['full']
+                upload.last_error = None
+                upload.claim_token = None
+                done.append(upload.staged_path)
+
+        for space in {upload.space for upload in uploads}:
+            refresh_space_images(space)
+        db.session.commit()
+        remove_staged(done)
+        return len(uploads)
+
+
+media_worker = MediaWorker(app)
+
+
+@event.listens_for(SpaceImageUpload, 'after_delete')
+def _discard_staged(mapper, connection, target):
+    # A space deleted before its images uploaded leaves nothing to upload
+    session = Session.object_session(target)
+    if session is not None and target.status != 'uploaded':
+        session.info.setdefault('media_discarded', []).append(target.staged_path)
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_worker(session):
+    if session.info.pop('media_staged', None):
+        media_worker.wake()
+    remove_staged(session.info.pop('media_discarded', []))
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_uncommitted(session):
+    remove_staged(session.info.pop('media_staged', []))
+    session.info.pop('media_discarded', None)
+
+
+@app.cli.command('process-staged-images')
+def process_staged_images():
+    """Upload all due staged images and exit"""
+    print(f"Processed {media_worker.drain()} staged images")
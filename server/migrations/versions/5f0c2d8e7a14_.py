@@ -0,0 +1,71 @@
+"""add full-text search index for spaces
+
+Revision ID: 5f0c2d8e7a14
+Revises: b41d7e2a9c53
+Create Date: 2026-10-17 10:03:51.774102
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5f0c2d8e7a14'
+down_revision = 'b41d7e2a9c53'
+branch_labels = None
+depends_on = None
+
+# Kept in step with search.py. Note that batch_alter_table on `spaces`
+# recreates the table on SQLite and drops these triggers, so later
+# migrations that batch-alter spaces must re-run them.
+SQLITE_UPGRADE = [
+    """CREATE VIRTUAL TABLE IF NOT EXISTS spaces_fts USING fts5(
+        name, description, address,
+        content='spaces', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    """CREATE TRIGGER IF NOT EXISTS spaces_fts_ai AFTER INSERT ON spaces BEGIN
+        INSERT INTO spaces_fts(rowid, name, description, address)
+        VALUES (new.id, new.name, new.description, new.address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS spaces_fts_ad AFTER DELETE ON spaces BEGIN
+        INSERT INTO spaces_fts(spaces_fts, rowid, name, description, address)
+        VALUES ('delete', old.id, old.name, old.description, old.address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS spaces_fts_au AFTER UPDATE OF name, description, address ON spaces BEGIN
+        INSERT INTO spaces_fts(spaces_fts, rowid, name, description, address)
+        VALUES ('delete', old.id, old.name, old.description, old.address);
+        INSERT INTO spaces_fts(rowid, name, description, address)
+        VALUES (new.id, new.name, new.description, new.address);
+    END""",
+    "INSERT INTO spaces_fts(spaces_fts) VALUES ('rebuild')",
+]
+
+SQLITE_DOWNGRADE = [
+    "DROP TRIGGER IF EXISTS spaces_fts_au",
+    "DROP TRIGGER IF EXISTS spaces_fts_ad",
+    "DROP TRIGGER IF EXISTS spaces_fts_ai",
+    "DROP TABLE IF EXISTS spaces_fts",
+]
+
+
+def upgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_UPGRADE:
+            op.execute(statement)
+    elif dialect == 'postgresql':
+        op.execute(
+            "CREATE INDEX idx_space_search ON spaces USING gin ("
+            "to_tsvector('english', coalesce(name, '') || ' ' || coalesce(description, '') || ' ' || coalesce(address, ''))"
+            ")"
+        )
+
+
+def downgrade():
+    dialect = op.get_bind().dialect.name
+    if dialect == 'sqlite':
+        for statement in SQLITE_DOWNGRADE:
+            op.execute(statement)
+    elif dialect == 'postgresql':
+        op.execute("DROP INDEX IF EXISTS idx_space_search")
@@ -0,0 +1,26 @@
+"""add client booking listing index
+
+Revision ID: 9a7e4c1b2d68
+Revises: 5f0c2d8e7a14
+Create Date: 2026-10-17 11:20:37.502913
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9a7e4c1b2d68'
+down_revision = '5f0c2d8e7a14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('bookings', schema=None) as batch_op:
+        batch_op.create_index('idx_booking_client', ['client_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('bookings', schema=None) as batch_op:
+        batch_op.drop_index('idx_booking_client')
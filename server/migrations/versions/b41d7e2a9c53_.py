@@ -0,0 +1,26 @@
+"""add per-space booking interval index
+
+Revision ID: b41d7e2a9c53
+Revises: 652381081ae1
+Create Date: 2026-10-17 09:12:04.318266
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b41d7e2a9c53'
+down_revision = '652381081ae1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('bookings', schema=None) as batch_op:
+        batch_op.create_index('idx_booking_space_interval', ['space_id', 'status', 'end_time', 'start_time'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('bookings', schema=None) as batch_op:
+        batch_op.drop_index('idx_booking_space_interval')
@@ -0,0 +1,33 @@
+"""release spaces left BOOKED by the old booking flow
+
+Revision ID: c9d4e6a1f273
+Revises: b3f07c2d9e14
+Create Date: 2026-10-17 23:40:12.507316
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c9d4e6a1f273'
+down_revision = 'b3f07c2d9e14'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Bookings used to mark their whole space BOOKED, which hides it from
+    # client listings. Slots are held per booking now, so nothing sets or
+    # clears that status any more. The enum is stored by name. updated_at
+    # is bumped so ETags for these spaces change.
+    op.execute(
+        "UPDATE spaces SET status = 'AVAILABLE', updated_at = CURRENT_TIMESTAMP "
+        "WHERE status = 'BOOKED'"
+    )
+
+
+def downgrade():
+    # Which spaces were BOOKED isn't recorded, and the old flow doesn't need
+    # it to be restored
+    pass
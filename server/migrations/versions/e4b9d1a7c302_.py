@@ -0,0 +1,53 @@
+"""add deferred image uploads
+
+Revision ID: e4b9d1a7c302
+Revises: c83f5a0e6b27
+Create Date: 2026-10-17 15:02:37.480215
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e4b9d1a7c302'
+down_revision = 'c83f5a0e6b27'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # Plain ADD COLUMN rather than batch_alter_table: rebuilding spaces on
+    # SQLite would drop the spaces_fts triggers
+    op.add_column('spaces', sa.Column('image_status', sa.String(length=20), server_default='ready', nullable=False))
+
+    op.create_table('space_image_uploads',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('space_id', sa.Integer(), nullable=False),
+    sa.Column('position', sa.Integer(), nullable=False),
+    sa.Column('filename', sa.String(length=255), nullable=False),
+    sa.Column('staged_path', sa.String(length=512), nullable=False),
+    sa.Column('status', sa.String(length=20), nullable=False),
+    sa.Column('url', sa.String(length=512), nullable=True),
+    sa.Column('attempts', sa.Integer(), nullable=False),
+    sa.Column('next_attempt_at', sa.DateTime(), nullable=False),
+    sa.Column('claim_token', sa.String(length=32), nullable=True),
+    sa.Column('claimed_at', sa.DateTime(), nullable=True),
+    sa.Column('last_error', sa.Text(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.ForeignKeyConstraint(['space_id'], ['spaces.id'], ),
+    sa.PrimaryKeyConstraint('id')
+    )
+    with op.batch_alter_table('space_image_uploads', schema=None) as batch_op:
+        batch_op.create_index('idx_space_image_upload_due', ['status', 'next_attempt_at'], unique=False)
+        batch_op.create_index('idx_space_image_upload_space', ['space_id'], unique=False)
+
+
+def downgrade():
+    with op.batch_alter_table('space_image_uploads', schema=None) as batch_op:
+        batch_op.drop_index('idx_space_image_upload_space')
+        batch_op.drop_index('idx_space_image_upload_due')
+
+    op.drop_table('space_image_uploads')
+
+    op.drop_column('spaces', 'image_status')
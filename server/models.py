@@ -1,10 +1,16 @@
-from config import bcrypt, db
-from datetime import datetime
+from config import db
+import passwords
+from datetime import datetime, timezone
 from sqlalchemy.orm import validates
-from sqlalchemy import Enum, func
+from sqlalchemy import Enum, func, and_, or_
 import enum
 
 
+def utcnow():
+    """Naive UTC now with microseconds (func.now() only has seconds on SQLite)"""
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+
 class UserRole(str, enum.Enum):
     ADMIN = 'admin'
     CLIENT = 'client'
@@ -21,6 +27,14 @@ class BookingStatus(str, enum.Enum):
     CANCELLED = 'cancelled'
     COMPLETED = 'completed'
 
+# Statuses that hold a slot on a space's calendar. Listed explicitly (rather
+# than "!= CANCELLED") so the interval index can be probed per status.
+ACTIVE_BOOKING_STATUSES = (
+    BookingStatus.PENDING,
+    BookingStatus.CONFIRMED,
+    BookingStatus.COMPLETED,
+)
+
 class User(db.Model):
     __tablename__ = 'users'
 
@@ -31,6 +45,8 @@ class User(db.Model):
     role = db.Column(db.Enum(UserRole), nullable=False, default=UserRole.CLIENT)
     verification_code = db.Column(db.String(255))
     auth0_sub = db.Column(db.String(255), unique=True)
+    # Access tokens carry this; bumping it revokes every token issued so far
+    token_version = db.Column(db.Integer, nullable=False, default=0, server_default='0')
     created_at = db.Column(db.DateTime, default=func.now())
     updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
 
@@ -48,10 +64,14 @@ class User(db.Model):
     
     @password.setter
     def password(self, password):
-        self.password_hash = bcrypt.generate_password_hash(password).decode('utf-8')
+        self.password_hash = passwords.hash_password(password)
 
     def verify_password(self, password):
-        return bcrypt.check_password_hash(self.password_hash, password)
+        """Check `password`, rehashing it (uncommitted) if the stored hash is outdated"""
+        matches, needs_rehash = passwords.verify_password(self.password_hash, password)
+        if needs_rehash:
+            self.password = password
+        return matches
     
     @validates('email')
     def validate_email(self, key, email):
@@ -75,11 +95,18 @@ class Space(db.Model):
     amenities = db.Column(db.JSON) 
     rules = db.Column(db.JSON)
     images = db.Column(db.JSON)
+    # 'ready', or 'pending' while staged images are still uploading, or
+    # 'failed' if some of them could not be uploaded (see media.py)
+    image_status = db.Column(db.String(20), nullable=False, default='ready', server_default='ready')
     created_at = db.Column(db.DateTime, default=func.now())
-    updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
+    # Python-side so consecutive edits within a second get distinct values;
+    # detail ETags are derived from it
+    updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
 
      # Relationships
     bookings = db.relationship('Booking', backref='space', lazy=True, cascade='all, delete-orphan')
+    image_uploads = db.relationship('SpaceImageUpload', backref='space', lazy=True, cascade='all, delete-orphan',
+                                    order_by='SpaceImageUpload.position')
     
     @validates('hourly_rate', 'daily_rate')
     def validate_rates(self, key, value):
@@ -100,11 +127,38 @@ class Booking(db.Model):
     stripe_payment_intent_id = db.Column(db.String(255), nullable=True)
     stripe_charge_id = db.Column(db.String(255), nullable=True)
     stripe_payment_status = db.Column(db.String(50), nullable=True)
+    # When an unpaid PENDING booking stops holding its slot (naive UTC)
+    hold_expires_at = db.Column(db.DateTime, nullable=True)
     created_at = db.Column(db.DateTime, default=func.now())
     updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
 
      # Relationships
     payment = db.relationship('Payment', backref='booking', lazy=True, uselist=False, cascade='all, delete-orphan')
+
+    @classmethod
+    def holds_slot(cls):
+        """
+        Filter for bookings that keep their slot taken: active ones, except
+        PENDING holds past hold_expires_at that the sweeper hasn't cancelled yet
+        """
+        return and_(
+            cls.status.in_(ACTIVE_BOOKING_STATUSES),
+            or_(
+                cls.status != BookingStatus.PENDING,
+                cls.hold_expires_at.is_(None),
+                cls.hold_expires_at > utcnow()
+            )
+        )
+
+    @classmethod
+    def overlaps(cls, space_id, start_time, end_time):
+        """Filter for bookings holding a slot on a space that intersect [start_time, end_time)"""
+        return and_(
+            cls.space_id == space_id,
+            cls.holds_slot(),
+            cls.start_time < end_time,
+            cls.end_time > start_time
+        )
     
     @validates('start_time', 'end_time')
     def validate_booking_times(self, key, value):
@@ -125,7 +179,75 @@ class Payment(db.Model):
     created_at = db.Column(db.DateTime, default=func.now())
     updated_at = db.Column(db.DateTime, default=func.now(), onupdate=func.now())
 
+class OutboundEmail(db.Model):
+    """Queued outgoing email, sent by the background mail worker"""
+    __tablename__ = 'outbound_emails'
+
+    id = db.Column(db.Integer, primary_key=True)
+    recipient = db.Column(db.String(255), nullable=False)
+    subject = db.Column(db.String(255), nullable=False)
+    body = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, sending, sent, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    claim_token = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    sent_at = db.Column(db.DateTime)
+    created_at = db.Column(db.DateTime, default=func.now())
+
+class SpaceImageUpload(db.Model):
+    """An image staged on local disk, uploaded by the background media worker"""
+    __tablename__ = 'space_image_uploads'
+
+    id = db.Column(db.Integer, primary_key=True)
+    space_id = db.Column(db.Integer, db.ForeignKey('spaces.id'), nullable=False)
+    position = db.Column(db.Integer, nullable=False)
+    filename = db.Column(db.String(255), nullable=False)
+    staged_path = db.Column(db.String(512), nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, uploading, uploaded, failed
+    url = db.Column(db.String(512))  # the 'full' variant
+    variants = db.Column(db.JSON)  # variant name -> URL, see media.VARIANTS
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    claim_token = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    created_at = db.Column(db.DateTime, default=func.now())
+
+class StripeEvent(db.Model):
+    """Ledger of received Stripe webhook events, keyed by Stripe's event ID"""
+    __tablename__ = 'stripe_events'
+
+    id = db.Column(db.String(255), primary_key=True)
+    type = db.Column(db.String(100), nullable=False)
+    payload = db.Column(db.Text, nullable=False)
+    status = db.Column(db.String(20), nullable=False, default='pending')  # pending, processing, processed, failed
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    next_attempt_at = db.Column(db.DateTime, nullable=False, default=utcnow)
+    claim_token = db.Column(db.String(32))
+    claimed_at = db.Column(db.DateTime)
+    last_error = db.Column(db.Text)
+    received_at = db.Column(db.DateTime, default=utcnow)
+    processed_at = db.Column(db.DateTime)
+
+class SyncState(db.Model):
+    """Named high-water marks for incremental sync jobs"""
+    __tablename__ = 'sync_state'
+
+    name = db.Column(db.String(50), primary_key=True)
+    value = db.Column(db.BigInteger, nullable=False)
+    updated_at = db.Column(db.DateTime, default=utcnow, onupdate=utcnow)
+
 #Indices for common queries
 db.Index('idx_space_status', Space.status)
 db.Index('idx_booking_dates', Booking.start_time, Booking.end_time)
-db.Index('idx_user_role', User.role)
\ No newline at end of file
+db.Index('idx_booking_client', Booking.client_id)
+db.Index('idx_booking_space_interval', Booking.space_id, Booking.status, Booking.end_time, Booking.start_time)
+db.Index('idx_booking_payment_intent', Booking.stripe_payment_intent_id)
+db.Index('idx_booking_hold_expiry', Booking.status, Booking.hold_expires_at)
+db.Index('idx_user_role', User.role)
+db.Index('idx_outbound_email_due', OutboundEmail.status, OutboundEmail.next_attempt_at)
+db.Index('idx_space_image_upload_due', SpaceImageUpload.status, SpaceImageUpload.next_attempt_at)
+db.Index('idx_space_image_upload_space', SpaceImageUpload.space_id)
+db.Index('idx_stripe_event_due', StripeEvent.status, StripeEvent.next_attempt_at)
@@ -0,0 +1,108 @@
+"""
+Auth0 OpenID Connect discovery cache.
+
+authlib fetches the discovery document and the JWKS lazily on the first
+login and then keeps them for the life of the process. OIDCCache holds both
+with a TTL instead: it is warmed when the app starts and refreshed by a
+background thread every OIDC_REFRESH_SECONDS, so logins verify the ID token
+locally without waiting on Auth0. If a refresh fails the previous documents
+keep being served. A token signed with an unknown key forces a JWKS refresh
+(Auth0 rotated its keys), at most once per OIDC_MIN_REFRESH_SECONDS.
+"""
+import threading
+import time
+
+from authlib.integrations.flask_client import FlaskOAuth2App
+
+from config import app
+from http_client import http_session, PooledOAuth2Session
+
+
+class OIDCCache:
+    def __init__(self, config):
+        self.config = config
+        self._metadata = None
+        self._jwks = None
+        self._loaded_at = None
+        self._jwks_loaded_at = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def metadata_url(self):
+        return f'https://{self.config["AUTH0_DOMAIN"]}/.well-known/openid-configuration'
+
+    def _get(self, url):
+        response = http_session.get(url)
+        response.raise_for_status()
+        return response.json()
+
+    def refresh(self):
+        """Fetch the discovery document and JWKS now"""
+        metadata = self._get(self.metadata_url)
+        jwks = self._get(metadata['jwks_uri'])
+        now = time.monotonic()
+        with self._lock:
+            self._metadata, self._jwks = metadata, jwks
+            self._loaded_at = self._jwks_loaded_at = now
+
+    def _stale(self):
+        return self._loaded_at is None or \
+            time.monotonic() - self._loaded_at > self.config['OIDC_CACHE_TTL']
+
+    def _ensure_loaded(self):
+        if not self._stale():
+            return
+        try:
+            self.refresh()
+        except Exception as e:
+            if self._metadata is None:
+                raise
+            app.logger.warning(f"Auth0 metadata refresh failed, serving cached copy: {e}")
+
+    def metadata(self):
+        self._ensure_loaded()
+        return self._metadata
+
+    def jwks(self, force=False):
+        """
+        The JWKS. `force` refetches it unless that was done within the last
+        OIDC_MIN_REFRESH_SECONDS, so bogus key ids can't make every login
+        call Auth0.
+        """
+        self._ensure_loaded()
+        if force and time.monotonic() - self._jwks_loaded_at > self.config['OIDC_MIN_REFRESH_SECONDS']:
+            jwks = self._get(self._metadata['jwks_uri'])
+            with self._lock:
+                self._jwks = jwks
+                self._jwks_loaded_at = time.monotonic()
+        return self._jwks
+
+    def _run(self):
+        while True:
+            try:
+                self.refresh()
+            except Exception as e:
+                app.logger.error(f"Auth0 metadata refresh failed: {e}")
+            time.sleep(self.config['OIDC_REFRESH_SECONDS'])
+
+    def start(self):
+        """Warm the cache and keep it fresh from a background thread"""
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='oidc-refresh', daemon=True)
+                self._thread.start()
+
+
+oidc_cache = OIDCCache(app.config)
+
+
+class Auth0App(FlaskOAuth2App):
+    """authlib remote app that reads discovery and keys from oidc_cache"""
+    client_cls = PooledOAuth2Session
+
+    def load_server_metadata(self):
+        return {**self.server_metadata, **oidc_cache.metadata()}
+
+    def fetch_jwk_set(self, force=False):
+        return oidc_cache.jwks(force)
@@ -0,0 +1,132 @@
+"""
+Shared pagination helpers.
+
+Listings support two modes. Offset mode (?page=&per_page=) reports totals,
+which can come from a count cache or be skipped with ?include_total=false.
+Cursor mode (?cursor=) seeks past the last row of the previous page on an
+indexed key, so deep pages cost the same as the first one and no COUNT(*)
+is issued.
+"""
+import base64
+import json
+from datetime import datetime
+
+from flask import request
+from sqlalchemy import DateTime, Integer, tuple_
+
+MAX_PER_PAGE = 100
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def get_per_page(default):
+    """Read ?per_page=, clamped to [1, MAX_PER_PAGE]"""
+    per_page = request.args.get('per_page', default, type=int)
+    return min(max(per_page, 1), MAX_PER_PAGE)
+
+
+def total_requested():
+    """Totals are on by default and skipped with ?include_total=false"""
+    return request.args.get('include_total', 'true').lower() not in ('false', '0', 'no')
+
+
+def cursor_requested():
+    """Cursor mode is opted into with ?cursor= (empty for the first page)"""
+    return 'cursor' in request.args
+
+
+def encode_cursor(values):
+    values = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def cursor_value(column, value):
+    """One decoded cursor value, checked against its column's type"""
+    if isinstance(column.type, DateTime):
+        if not isinstance(value, str):
+            raise TypeError
+        return datetime.fromisoformat(value)
+    expected = int if isinstance(column.type, Integer) else str
+    # bool is an int subclass, but true isn't an id
+    if not isinstance(value, expected) or isinstance(value, bool):
+        raise TypeError
+    return value
+
+
+def decode_cursor(cursor, columns):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(values, list) or len(values) != len(columns):
+            raise ValueError
+        return [cursor_value(column, value) for column, value in zip(columns, values)]
+    except (ValueError, TypeError):
+        raise InvalidCursor('Invalid cursor')
+
+
+def keyset_page(query, columns, cursor, per_page, descending=False):
+    """
+    Fetch one page of `query` ordered by `columns` (a unique key), starting
+    after `cursor`. Returns (items, next_cursor); next_cursor is None on
+    the last page.
+    """
+    key = tuple_(*columns)
+    if cursor:
+        values = tuple_(*decode_cursor(cursor, columns))
+        query = query.filter(key < values if descending else key > values)
+
+    ordering = [column.desc() if descending else column.asc() for column in columns]
+    items = query.order_by(None).order_by(*ordering).limit(per_page + 1).all()
+
+    if len(items) <= per_page:
+        return items, None
+    items = items[:per_page]
+    return items, encode_cursor([getattr(items[-1], column.key) for column in columns])
+
+
+def cursor_pagination(per_page, next_cursor):
+    return {
+        'per_page': per_page,
+        'next_cursor': next_cursor,
+        'has_next': next_cursor is not None
+    }
+
+
+def offset_page(query, page, per_page, count_cache=None, count_key=None, include_total=True):
+    """
+    Fetch one OFFSET page of `query`. has_next comes from reading one extra
+    row, so the total is only needed for total_items/total_pages. It is
+    served from `count_cache` under `count_key` when present, and reported
+    with total_source 'cached' or 'exact'.
+    """
+    page = max(page, 1)
+    rows = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+    items = rows[:per_page]
+
+    total = total_pages = total_source = None
+    if include_total:
+        total_source = 'exact'
+        if count_cache is not None:
+            # Taken before counting, so a total computed across a write
+            # isn't cached
+            generation = count_cache.generation
+            total = count_cache.get(count_key)
+            if total is not None:
+                total_source = 'cached'
+        if total is None:
+            total = query.order_by(None).count()
+            if count_cache is not None:
+                count_cache.set(count_key, total, generation=generation)
+        total_pages = (total + per_page - 1) // per_page
+
+    return items, {
+        'total_items': total,
+        'total_pages': total_pages,
+        'total_source': total_source,
+        'current_page': page,
+        'per_page': per_page,
+        'has_next': len(rows) > per_page,
+        'has_prev': page > 1
+    }
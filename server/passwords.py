@@ -0,0 +1,158 @@
+"""
+Password hashing.
+
+Every password goes through the hasher named by PASSWORD_HASHER, with its
+cost taken from config. verify_password() also accepts hashes made with an
+older cost or scheme (including Werkzeug's pbkdf2/scrypt hashes written by
+earlier profile updates) and reports that they need rehashing, so logins
+upgrade them transparently.
+
+bcrypt is deliberately slow, so hashing runs in a process pool of
+PASSWORD_HASH_WORKERS processes rather than on request threads. At most
+PASSWORD_HASH_MAX_PENDING jobs are queued or running; a caller that can't
+get a slot within PASSWORD_HASH_WAIT_SECONDS gets HasherBusy, so a burst
+of login attempts is shed instead of piling up behind the pool. With
+PASSWORD_HASH_WORKERS = 0 hashing runs inline (CLI tools and tests).
+
+Bulk imports hash through hash_passwords() on a separate pool of
+USER_IMPORT_HASH_WORKERS processes, so they can't take the slots logins
+need.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+import threading
+
+import bcrypt
+from werkzeug.security import check_password_hash as werkzeug_check
+
+from config import app
+
+
+class HasherBusy(Exception):
+    """Every hashing slot stayed taken for PASSWORD_HASH_WAIT_SECONDS"""
+
+
+def _bcrypt_hash(password, rounds):
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds)).decode('utf-8')
+
+
+def _bcrypt_check(password_hash, password):
+    return bcrypt.checkpw(password.encode('utf-8'), password_hash.encode('utf-8'))
+
+
+class BcryptHasher:
+    prefixes = ('$2a$', '$2b$', '$2y$')
+
+    def __init__(self, config):
+        self.config = config
+
+    @property
+    def rounds(self):
+        return self.config['PASSWORD_BCRYPT_ROUNDS']
+
+    def identifies(self, password_hash):
+        return password_hash.startswith(self.prefixes)
+
+    def hash_job(self, password):
+        """(function, args) that hash `password`, for the process pool"""
+        return _bcrypt_hash, (password, self.rounds)
+
+    def check_job(self, password_hash, password):
+        return _bcrypt_check, (password_hash, password)
+
+    def needs_rehash(self, password_hash):
+        return int(password_hash.split('$')[2]) != self.rounds
+
+
+class WerkzeugHasher:
+    """Reads the pbkdf2/scrypt hashes Werkzeug's generate_password_hash made"""
+    prefixes = ('pbkdf2:', 'scrypt:')
+
+    def __init__(self, config):
+        self.config = config
+
+    def identifies(self, password_hash):
+        return password_hash.startswith(self.prefixes)
+
+    def check_job(self, password_hash, password):
+        return werkzeug_check, (password_hash, password)
+
+
+HASHERS = {'bcrypt': BcryptHasher}
+LEGACY_HASHERS = [WerkzeugHasher]
+
+
+class HashingPool:
+    """Process pool with a bounded number of queued and running jobs"""
+
+    def __init__(self, config, workers_setting='PASSWORD_HASH_WORKERS'):
+        self.config = config
+        self.workers_setting = workers_setting
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(config['PASSWORD_HASH_MAX_PENDING'])
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn: forking a process that runs worker threads isn't safe
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.config[self.workers_setting],
+                    mp_context=multiprocessing.get_context('spawn')
+                )
+            return self._executor
+
+    def run(self, function, args):
+        if not self.config[self.workers_setting]:
+            return function(*args)
+        if not self._slots.acquire(timeout=self.config['PASSWORD_HASH_WAIT_SECONDS']):
+            raise HasherBusy()
+        try:
+            return self._get_executor().submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+    def map(self, function, args_list):
+        """Run `function` over `args_list` across the pool, waiting for all of them"""
+        if not self.config[self.workers_setting]:
+            return [function(*args) for args in args_list]
+        return list(self._get_executor().map(function, *zip(*args_list), chunksize=8))
+
+
+hashing_pool = HashingPool(app.config)
+bulk_hashing_pool = HashingPool(app.config, 'USER_IMPORT_HASH_WORKERS')
+
+
+def get_hasher():
+    return HASHERS[app.config['PASSWORD_HASHER']](app.config)
+
+
+def hash_password(password):
+    return hashing_pool.run(*get_hasher().hash_job(password))
+
+
+def hash_passwords(passwords):
+    """Hash many passwords in parallel on the bulk pool, in order"""
+    hasher = get_hasher()
+    jobs = [hasher.hash_job(password) for password in passwords]
+    if not jobs:
+        return []
+    return bulk_hashing_pool.map(jobs[0][0], [args for _, args in jobs])
+
+
+def verify_password(password_hash, password):
+    """
+    Returns (matches, needs_rehash). needs_rehash is True when the hash
+    was made with another scheme or cost than the current configuration.
+    """
+    current = get_hasher()
+    if current.identifies(password_hash):
+        matches = hashing_pool.run(*current.check_job(password_hash, password))
+        return matches, matches and current.needs_rehash(password_hash)
+
+    for hasher_cls in [*HASHERS.values(), *LEGACY_HASHERS]:
+        hasher = hasher_cls(app.config)
+        if hasher.identifies(password_hash):
+            matches = hashing_pool.run(*hasher.check_job(password_hash, password))
+            return matches, matches
+    return False, False
@@ -0,0 +1,96 @@
+"""
+Rate limits for the unauthenticated account endpoints.
+
+Each limit is a sliding window counter: hits are counted in fixed windows
+in a cache backend (see caching.make_backend), and the previous window's
+count is weighted by how much of it still overlaps the sliding window.
+That takes two counters per key whichever backend is used, so the same
+limits hold across processes with the 'shared' backend.
+
+RATE_LIMITS maps an endpoint to its limits, each (max hits, window
+seconds):
+  ip              every request, per client address
+  email           every request, per email address
+  email_failures  only failed attempts (wrong password or code), per email
+
+All of them are checked before the handler touches the database or hashes
+a password, so rejected requests cost two cache lookups.
+
+Client addresses come from request.remote_addr. Behind reverse proxies,
+set TRUSTED_PROXY_COUNT so it is read from X-Forwarded-For (see config.py).
+"""
+import math
+import time
+
+from flask import request
+
+from caching import make_backend
+from config import app
+
+
+class SlidingWindow:
+    def __init__(self, backend, name, limit, window):
+        self.backend = backend
+        self.name = name
+        self.limit = limit
+        self.window = window
+
+    def _count(self, key, delta):
+        now = time.time()
+        current = int(now // self.window)
+        # Counters outlive their window by one more, while they're "previous"
+        ttl = 2 * self.window
+        hits = self.backend.incr(f'ratelimit:{self.name}:{key}:{current}', delta, ttl=ttl)
+        previous = self.backend.incr(f'ratelimit:{self.name}:{key}:{current - 1}', 0, ttl=ttl)
+        overlap = 1 - (now % self.window) / self.window
+        return previous * overlap + hits, math.ceil(self.window - now % self.window)
+
+    def hit(self, key):
+        """Count a hit; returns seconds to wait if it went over the limit, else None"""
+        count, reset = self._count(key, 1)
+        return reset if count > self.limit else None
+
+    def exceeded(self, key):
+        """Seconds to wait if `key` is already at the limit, else None"""
+        count, reset = self._count(key, 0)
+        return reset if count >= self.limit else None
+
+
+rate_limit_backend = make_backend(app.config['RATE_LIMIT_BACKEND'], ttl=60, maxsize=100_000)
+
+
+def window(endpoint, kind):
+    limit, seconds = app.config['RATE_LIMITS'][endpoint][kind]
+    return SlidingWindow(rate_limit_backend, f'{endpoint}:{kind}', limit, seconds)
+
+
+def _normalize(email):
+    return str(email).strip().lower()
+
+
+def too_many(retry_after):
+    return {'error': 'Too many attempts, try again later'}, 429, {'Retry-After': str(retry_after)}
+
+
+def check_rate_limit(endpoint, email=None):
+    """
+    Count this request against `endpoint`'s limits. Returns a 429 response
+    to send back if any limit is exceeded, else None.
+    """
+    if not app.config['RATE_LIMIT_ENABLED']:
+        return None
+    limits = app.config['RATE_LIMITS'][endpoint]
+    retry_after = None
+    if 'ip' in limits:
+        retry_after = window(endpoint, 'ip').hit(request.remote_addr)
+    if retry_after is None and email and 'email' in limits:
+        retry_after = window(endpoint, 'email').hit(_normalize(email))
+    if retry_after is None and email and 'email_failures' in limits:
+        retry_after = window(endpoint, 'email_failures').exceeded(_normalize(email))
+    return None if retry_after is None else too_many(retry_after)
+
+
+def record_failure(endpoint, email):
+    """Count a failed attempt for `email` (wrong password, wrong code)"""
+    if app.config['RATE_LIMIT_ENABLED'] and email:
+        window(endpoint, 'email_failures').hit(_normalize(email))
@@ -0,0 +1,97 @@
+"""
+Stripe payment reconciliation.
+
+Webhooks can be missed, so `flask reconcile-payments` pages through recent
+PaymentIntents and brings the matching bookings up to date: it records
+Stripe's status in Booking.stripe_payment_status, confirms PENDING bookings
+whose intent succeeded and cancels those whose intent was canceled.
+
+Runs are incremental. The newest `created` timestamp seen is stored as a
+high-water mark, and the next run lists intents created since then, minus
+STRIPE_RECONCILE_LOOKBACK_HOURS to catch intents that changed state after
+the last run saw them. Each page of results is applied in one transaction.
+"""
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+
+import click
+from flask import current_app
+import stripe
+
+from config import app, db
+from models import Booking, BookingStatus, SyncState, utcnow
+from stripe_events import confirm_booking
+
+HIGH_WATER_MARK = 'stripe_payment_intents'
+
+
+def sync_booking(booking, payment_intent):
+    """Bring one booking in line with its PaymentIntent; returns True if it changed"""
+    before = (booking.status, booking.stripe_payment_status)
+    booking.stripe_payment_status = payment_intent.status
+    if booking.status == BookingStatus.PENDING:
+        if payment_intent.status == 'succeeded':
+            confirm_booking(booking, payment_intent)
+        elif payment_intent.status == 'canceled':
+            booking.status = BookingStatus.CANCELLED
+    return (booking.status, booking.stripe_payment_status) != before
+
+
+def reconcile_payments(since=None):
+    """
+    Reconcile bookings with PaymentIntents created at or after `since` (a
+    unix timestamp), defaulting to the stored high-water mark. Returns
+    counts of intents seen, pages applied and bookings updated.
+    """
+    config = current_app.config
+    state = db.session.get(SyncState, HIGH_WATER_MARK)
+    if since is None:
+        if state is not None:
+            since = state.value - int(timedelta(hours=config['STRIPE_RECONCILE_LOOKBACK_HOURS']).total_seconds())
+        else:
+            start = datetime.now(timezone.utc) - timedelta(days=config['STRIPE_RECONCILE_INITIAL_DAYS'])
+            since = int(start.timestamp())
+    # Don't keep the read transaction open while waiting on Stripe
+    db.session.commit()
+
+    page_size = config['STRIPE_RECONCILE_PAGE_SIZE']
+    intents = stripe.PaymentIntent.list(created={'gte': since}, limit=page_size).auto_paging_iter()
+    high_water = state.value if state is not None else since
+    stats = {'intents': 0, 'pages': 0, 'bookings_updated': 0}
+
+    while True:
+        # Fetching happens between transactions, never inside one
+        page = list(islice(intents, page_size))
+        if not page:
+            break
+        bookings = Booking.query.filter(
+            Booking.stripe_payment_intent_id.in_([intent.id for intent in page])
+        ).all()
+        by_intent = {booking.stripe_payment_intent_id: booking for booking in bookings}
+        for intent in page:
+            high_water = max(high_water, intent.created)
+            booking = by_intent.get(intent.id)
+            if booking is not None and sync_booking(booking, intent):
+                stats['bookings_updated'] += 1
+        db.session.commit()
+        stats['intents'] += len(page)
+        stats['pages'] += 1
+
+    # Only advance the mark once every page is in: results come newest
+    # first, so a partial run must not skip the older intents next time
+    state = db.session.get(SyncState, HIGH_WATER_MARK) or SyncState(name=HIGH_WATER_MARK)
+    state.value = high_water
+    state.updated_at = utcnow()
+    db.session.add(state)
+    db.session.commit()
+    return stats
+
+
+@app.cli.command('reconcile-payments')
+@click.option('--since', type=int, default=None,
+              help='Unix timestamp to start from instead of the stored high-water mark')
+def reconcile_payments_command(since):
+    """Update bookings from recent Stripe PaymentIntents"""
+    stats = reconcile_payments(since)
+    print(f"Reconciled {stats['intents']} PaymentIntents in {stats['pages']} pages, "
+          f"updated {stats['bookings_updated']} bookings")
@@ -0,0 +1,175 @@
+"""
+Booking holds.
+
+Creating a booking is split in two so no database transaction stays open
+across the Stripe round trip. place_hold() claims the slot with a PENDING
+booking that expires after BOOKING_HOLD_MINUTES, in one short transaction.
+The caller commits, creates the PaymentIntent with no transaction open, and
+then attach_payment_intent() links it to the hold, or release_hold() frees
+the slot if Stripe failed.
+
+Holds nobody paid for are expired by HoldSweeper, which runs in a
+background thread of every process serving requests (see app.py) or
+through the `expire-holds` CLI command for cron. Until it gets to them,
+expired holds already stop counting as conflicts (Booking.overlaps).
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+import time
+
+from flask import current_app
+from sqlalchemy import exists, insert, literal, select, update
+import stripe
+
+from availability import record_change
+from config import app, db
+from models import Booking, BookingStatus, Space, utcnow
+from workers import QueueWorker
+
+# Stripe has no bulk cancel, so a sweep's cancellations go out in parallel
+_stripe_executor = ThreadPoolExecutor(
+    max_workers=app.config['HOLD_SWEEP_CANCEL_CONCURRENCY'],
+    thread_name_prefix='hold-sweep-cancel'
+)
+
+
+def place_hold(client_id, space_id, start_time, end_time, total_price):
+    """
+    Insert a PENDING booking for the slot unless an active booking overlaps
+    it. Returns the new booking's id, or None if the slot is taken.
+
+    The overlap check and the insert are one INSERT ... SELECT ... WHERE
+    NOT EXISTS, so two requests for the same slot can't both pass the check
+    between each other's read and write. On SQLite the statement runs under
+    the database write lock; elsewhere the space row is locked first.
+    """
+    db.session.execute(select(Space.id).where(Space.id == space_id).with_for_update())
+
+    hold_expires_at = utcnow() + timedelta(minutes=current_app.config['BOOKING_HOLD_MINUTES'])
+    values = {
+        Booking.client_id: client_id,
+        Booking.space_id: space_id,
+        Booking.start_time: start_time,
+        Booking.end_time: end_time,
+        Booking.total_price: total_price,
+        Booking.status: BookingStatus.PENDING,
+        Booking.hold_expires_at: hold_expires_at,
+    }
+    source = select(*[literal(value, column.type) for column, value in values.items()])\
+        .where(~exists().where(Booking.overlaps(space_id, start_time, end_time)))
+    booking_id = db.session.execute(
+        insert(Booking).from_select([column.key for column in values], source).returning(Booking.id)
+    ).scalar()
+
+    if booking_id is not None:
+        # A Core insert skips the ORM events that keep calendars current
+        record_change(db.session, booking_id, space_id, start_time, end_time, True)
+    return booking_id
+
+
+def attach_payment_intent(booking_id, payment_intent_id):
+    """
+    Link a PaymentIntent to a hold that is still PENDING and commit.
+    Returns False if the hold was released in the meantime.
+    """
+    result = db.session.execute(
+        update(Booking)
+        .where(Booking.id == booking_id, Booking.status == BookingStatus.PENDING)
+        .values(stripe_payment_intent_id=payment_intent_id),
+        execution_options={'synchronize_session': False}
+    )
+    db.session.commit()
+    return result.rowcount == 1
+
+
+def release_hold(booking_id):
+    """Cancel a hold that is still PENDING, freeing its slot, and commit"""
+    released = db.session.execute(
+        update(Booking)
+        .where(Booking.id == booking_id, Booking.status == BookingStatus.PENDING)
+        .values(status=BookingStatus.CANCELLED)
+        .returning(Booking.space_id, Booking.start_time, Booking.end_time),
+        execution_options={'synchronize_session': False}
+    ).first()
+    if released:
+        record_change(db.session, booking_id, released.space_id, released.start_time, released.end_time, False)
+    db.session.commit()
+    return released is not None
+
+
+def cancel_payment_intent(payment_intent_id):
+    """Cancel an abandoned PaymentIntent; returns False if Stripe refused"""
+    try:
+        stripe.PaymentIntent.cancel(payment_intent_id, cancellation_reason='abandoned')
+        return True
+    except stripe.error.StripeError as e:
+        app.logger.warning(f"Could not cancel PaymentIntent {payment_intent_id}: {e}")
+        return False
+
+
+class HoldSweeper(QueueWorker):
+    """Cancels PENDING bookings whose hold has expired, in bulk"""
+    name = 'hold-sweeper'
+    config_prefix = 'HOLD_SWEEP'
+
+    def __init__(self, app):
+        super().__init__(app)
+        self.metrics = {
+            'holds_expired': 0,
+            'intents_cancelled': 0,
+            'intent_cancel_failures': 0,
+            'last_batch_ms': None,
+        }
+
+    def process_batch(self):
+        """Expire one batch of holds; returns how many were expired"""
+        started = time.perf_counter()
+        due = select(Booking.id).where(
+            Booking.status == BookingStatus.PENDING,
+            Booking.hold_expires_at <= utcnow()
+        ).order_by(Booking.hold_expires_at).limit(self.setting('BATCH_SIZE'))
+
+        # One UPDATE for the whole batch; re-checking the status keeps a
+        # booking confirmed since the SELECT from being cancelled
+        expired = db.session.execute(
+            update(Booking)
+            .where(Booking.id.in_(due.scalar_subquery()), Booking.status == BookingStatus.PENDING)
+            .values(status=BookingStatus.CANCELLED)
+            .returning(Booking.id, Booking.space_id, Booking.start_time, Booking.end_time,
+                       Booking.stripe_payment_intent_id),
+            execution_options={'synchronize_session': False}
+        ).all()
+        for row in expired:
+            record_change(db.session, row.id, row.space_id, row.start_time, row.end_time, False)
+        db.session.commit()
+
+        # Cancel the intents after the commit so Stripe latency never holds
+        # the write lock
+        intents = [row.stripe_payment_intent_id for row in expired if row.stripe_payment_intent_id]
+        cancelled = sum(_stripe_executor.map(cancel_payment_intent, intents))
+
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        self.metrics['holds_expired'] += len(expired)
+        self.metrics['intents_cancelled'] += cancelled
+        self.metrics['intent_cancel_failures'] += len(intents) - cancelled
+        self.metrics['last_batch_ms'] = round(elapsed_ms, 1)
+        if expired:
+            current_app.logger.info(
+                f"Expired {len(expired)} booking holds, cancelled {cancelled}/{len(intents)} "
+                f"PaymentIntents in {elapsed_ms:.1f} ms"
+            )
+        return len(expired)
+
+
+hold_sweeper = HoldSweeper(app)
+
+
+@app.cli.command('expire-holds')
+def expire_holds():
+    """Expire all abandoned booking holds and exit"""
+    started = time.perf_counter()
+    expired = hold_sweeper.drain()
+    metrics = hold_sweeper.metrics
+    print(f"Expired {expired} booking holds in {(time.perf_counter() - started) * 1000:.1f} ms "
+          f"({metrics['intents_cancelled']} PaymentIntents cancelled, "
+          f"{metrics['intent_cancel_failures']} failed)")
@@ -0,0 +1,103 @@
+"""
+Full-text search over spaces.
+
+On SQLite the name, description and address columns are mirrored into an
+external-content FTS5 table kept in sync by triggers. On Postgres the same
+text is matched through a GIN-indexed tsvector expression. Other backends
+fall back to the old ILIKE scan.
+"""
+import re
+
+from sqlalchemy import DDL, event, func, literal_column, or_, select, table, column
+
+from config import db
+from models import Space
+
+FTS_TABLE = 'spaces_fts'
+
+SQLITE_DDL = [
+    f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+        name, description, address,
+        content='spaces', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON spaces BEGIN
+        INSERT INTO {FTS_TABLE}(rowid, name, description, address)
+        VALUES (new.id, new.name, new.description, new.address);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON spaces BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description, address)
+        VALUES ('delete', old.id, old.name, old.description, old.address);
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE OF name, description, address ON spaces BEGIN
+        INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, name, description, address)
+        VALUES ('delete', old.id, old.name, old.description, old.address);
+        INSERT INTO {FTS_TABLE}(rowid, name, description, address)
+        VALUES (new.id, new.name, new.description, new.address);
+    END""",
+]
+
+POSTGRES_DDL = [
+    """CREATE INDEX IF NOT EXISTS idx_space_search ON spaces USING gin (
+        to_tsvector('english', coalesce(name, '') || ' ' || coalesce(description, '') || ' ' || coalesce(address, ''))
+    )""",
+]
+
+for statement in SQLITE_DDL:
+    event.listen(Space.__table__, 'after_create', DDL(statement).execute_if(dialect='sqlite'))
+for statement in POSTGRES_DDL:
+    event.listen(Space.__table__, 'after_create', DDL(statement).execute_if(dialect='postgresql'))
+event.listen(Space.__table__, 'before_drop', DDL(f'DROP TABLE IF EXISTS {FTS_TABLE}').execute_if(dialect='sqlite'))
+
+fts = table(FTS_TABLE, column('rowid'), column('rank'))
+
+
+def search_terms(search):
+    """Split user input into plain word tokens, dropping FTS syntax"""
+    return re.findall(r'\w+', search)
+
+
+def search_document():
+    """The text Postgres indexes; must match idx_space_search exactly"""
+    text = func.coalesce(Space.name, '') + ' ' + func.coalesce(Space.description, '') + \
+        ' ' + func.coalesce(Space.address, '')
+    return func.to_tsvector('english', text)
+
+
+def apply_search(query, search, dialect=None):
+    """
+    Filter a Space query (ORM Query or select) to rows matching every word
+    in `search` as a prefix, ordered by relevance
+    """
+    terms = search_terms(search)
+    if not terms:
+        return query
+
+    dialect = dialect or db.engine.dialect.name
+
+    if dialect == 'sqlite':
+        match = ' '.join(f'"{term}"*' for term in terms)
+        # The LIMIT/OFFSET keep SQLite from flattening the subquery into the
+        # outer join. Flattened, the planner may drive the join from spaces
+        # (e.g. via idx_space_status) and re-run the MATCH once per row.
+        matches = select(fts.c.rowid, fts.c.rank)\
+            .where(literal_column(FTS_TABLE).op('MATCH')(match))\
+            .limit(-1).offset(0)\
+            .subquery()
+        return query.join(matches, matches.c.rowid == Space.id)\
+            .order_by(matches.c.rank)
+
+    if dialect == 'postgresql':
+        tsquery = func.to_tsquery('english', ' & '.join(f'{term}:*' for term in terms))
+        document = search_document()
+        return query.filter(document.op('@@')(tsquery))\
+            .order_by(func.ts_rank(document, tsquery).desc())
+
+    for term in terms:
+        pattern = f'%{term}%'
+        query = query.filter(or_(
+            Space.name.ilike(pattern),
+            Space.description.ilike(pattern),
+            Space.address.ilike(pattern)
+        ))
+    return query
@@ -10,6 +10,7 @@ import os
 import requests
 from io import BytesIO
 from config import app
+import search  # registers the full-text index DDL with create_all
 
 # Load environment variables
 load_dotenv()
@@ -0,0 +1,167 @@
+"""
+Stripe webhook event ledger.
+
+Every verified webhook event is recorded in the stripe_events table, keyed
+by Stripe's event ID, so duplicate deliveries and Stripe's retries are
+acknowledged after a single primary-key lookup without redoing any work.
+
+Events are applied in the webhook request by default. With
+STRIPE_WEBHOOK_ASYNC the webhook only records the event and acknowledges
+it, and a background worker applies queued events from the ledger, which
+keeps webhook responses well inside Stripe's timeout during load spikes.
+"""
+import json
+
+from flask import current_app
+from sqlalchemy import event, exists, select
+from sqlalchemy.orm import Session
+import stripe
+
+from config import app, db
+from models import Booking, BookingStatus, SpaceStatus, StripeEvent, utcnow
+from workers import QueueWorker
+
+
+def record_event(stripe_event, payload):
+    """
+    Add `stripe_event` to the ledger in the current session. Returns the
+    new StripeEvent, or None if this event was already received.
+    """
+    if db.session.get(StripeEvent, stripe_event.id) is not None:
+        return None
+    ledger_entry = StripeEvent(id=stripe_event.id, type=stripe_event.type, payload=payload)
+    db.session.add(ledger_entry)
+    return ledger_entry
+
+
+def charge_id(payment_intent):
+    """The charge behind a succeeded PaymentIntent, on old and new API versions"""
+    # Attribute access rather than .get(): stripe objects stopped being
+    # dicts in newer SDKs
+    if getattr(payment_intent, 'latest_charge', None):
+        return payment_intent.latest_charge
+    charges = getattr(payment_intent, 'charges', None)
+    return charges.data[0].id if charges and charges.data else None
+
+
+def slot_retaken(booking):
+    """True if `booking`'s hold has expired and another booking holds its slot"""
+    if booking.status != BookingStatus.PENDING or booking.hold_expires_at is None \
+            or booking.hold_expires_at > utcnow():
+        return False
+    return db.session.execute(select(exists().where(
+        Booking.overlaps(booking.space_id, booking.start_time, booking.end_time),
+        Booking.id != booking.id
+    ))).scalar()
+
+
+def refund_late_payment(booking, payment_intent):
+    """
+    Refund a payment that succeeded for an already cancelled booking. The
+    idempotency key makes redeliveries safe; a Stripe error propagates so
+    the event is retried (by Stripe, or the ledger worker in async mode).
+    """
+    try:
+        stripe.Refund.create(
+            payment_intent=payment_intent.id,
+            metadata={'booking_id': booking.id},
+            idempotency_key=f'refund-{payment_intent.id}'
+        )
+    except stripe.error.InvalidRequestError as e:
+        # Refunded by an earlier delivery whose idempotency key has expired
+        if e.code != 'charge_already_refunded':
+            raise
+    booking.stripe_payment_status = 'refunded'
+    current_app.logger.warning(
+        f"Refunded payment {payment_intent.id} for cancelled booking {booking.id}"
+    )
+
+
+def confirm_booking(booking, payment_intent):
+    """Mark `booking` paid; returns False (and refunds) for a booking already cancelled"""
+    if slot_retaken(booking):
+        # Expired holds stop blocking their slot before the sweeper gets to
+        # them, so someone else may have booked it in the meantime
+        booking.status = BookingStatus.CANCELLED
+    if booking.status == BookingStatus.CANCELLED:
+        # The hold expired before payment went through; the slot may
+        # have been rebooked, so don't resurrect it
+        refund_late_payment(booking, payment_intent)
+        return False
+    booking.status = BookingStatus.CONFIRMED
+    booking.stripe_charge_id = charge_id(payment_intent)
+    return True
+
+
+def apply_event(stripe_event):
+    """Update bookings for one Stripe event, in the current session"""
+    if stripe_event.type not in ('payment_intent.succeeded', 'payment_intent.payment_failed'):
+        return
+
+    payment_intent = stripe_event.data.object
+    # Find the booking associated with this payment intent
+    booking = Booking.query.filter_by(
+        stripe_payment_intent_id=payment_intent.id
+    ).first()
+    if not booking:
+        return
+
+    booking.stripe_payment_status = getattr(payment_intent, 'status', None)
+    if stripe_event.type == 'payment_intent.succeeded':
+        confirm_booking(booking, payment_intent)
+    else:
+        booking.status = BookingStatus.CANCELLED
+        # Release the space
+        if booking.space and booking.space.status == SpaceStatus.BOOKED:
+            booking.space.status = SpaceStatus.AVAILABLE
+
+
+def mark_processed(ledger_entry):
+    ledger_entry.status = 'processed'
+    ledger_entry.processed_at = utcnow()
+    ledger_entry.claim_token = None
+    ledger_entry.last_error = None
+
+
+class StripeEventWorker(QueueWorker):
+    model = StripeEvent
+    claimed_status = 'processing'
+    name = 'stripe-events'
+    config_prefix = 'STRIPE_EVENTS'
+
+    def process_batch(self):
+        """Apply one batch of queued events; returns how many were attempted"""
+        ledger_entries = self.claim()
+        for ledger_entry in ledger_entries:
+            ledger_entry.attempts += 1
+            try:
+                # A savepoint, so a failure only undoes the event's own
+                # changes and the attempt still counts
+                with db.session.begin_nested():
+                    apply_event(stripe.Event.construct_from(json.loads(ledger_entry.payload), stripe.api_key))
+                mark_processed(ledger_entry)
+            except Exception as e:
+                if not self.retry_later(ledger_entry, e):
+                    current_app.logger.error(f"Giving up on Stripe event {ledger_entry.id}: {e}")
+            db.session.commit()
+        return len(ledger_entries)
+
+
+stripe_event_worker = StripeEventWorker(app)
+
+
+@event.listens_for(Session, 'after_commit')
+def _wake_worker(session):
+    if session.info.pop('stripe_events_queued', False):
+        stripe_event_worker.wake()
+
+
+@event.listens_for(Session, 'after_rollback')
+def _discard_wake(session):
+    session.info.pop('stripe_events_queued', None)
+
+
+@app.cli.command('process-stripe-events')
+def process_stripe_events():
+    """Apply all queued Stripe events and exit"""
+    print(f"Processed {stripe_event_worker.drain()} Stripe events")
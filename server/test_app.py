@@ -1,19 +1,69 @@
 import pytest
 from flask_jwt_extended import create_access_token
-from app import app, db
-from models import User, UserRole, Space, SpaceStatus
+from app import app, db, space_count_cache, client_space_cache, auth0
+from flask import session
+from caching import ResponseCache, SharedCacheStandIn, TTLCache
+from pagination import offset_page
+from mailer import mail_worker
+from uploads import CappedSpooledFile
+from reservations import hold_sweeper, place_hold
+from stripe_events import stripe_event_worker
+from reconciliation import reconcile_payments
+from http_client import host_metrics, http_session, PooledOAuth2Session
+from oidc import OIDCCache, oidc_cache
+from ratelimit import rate_limit_backend, SlidingWindow
+from auth import user_state_cache
+import accounts
+from accounts import provision_users, import_users
+import passwords
+from sqlalchemy import false, update
+from passwords import HashingPool, hashing_pool, get_hasher
+from werkzeug.security import generate_password_hash
+from werkzeug.middleware.proxy_fix import ProxyFix
+from authlib.jose import JsonWebKey, jwt as jose_jwt
+from media import media_worker, make_variants, VARIANTS, VARIANT_EXTENSION
+from PIL import Image
+from models import User, UserRole, Space, SpaceStatus, Booking, BookingStatus, OutboundEmail, StripeEvent, SyncState, utcnow
+from availability import availability
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal
+from instrumentation import recorded_queries
+import base64
 import json
-from unittest.mock import patch
+from unittest.mock import patch, MagicMock
+from aiosmtpd.controller import Controller
+import socket
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from requests.adapters import HTTPAdapter
+from urllib.parse import urlparse, parse_qs
+import stripe
+import io
+import struct
+import zlib
+import threading
+import time
 
 @pytest.fixture
 def client():
     """Configure Flask test client"""
     app.config['TESTING'] = True
     app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///:memory:'
+    app.config['MAIL_QUEUE_WORKER'] = False
+    app.config['MEDIA_QUEUE_WORKER'] = False
+    app.config['HOLD_SWEEP_QUEUE_WORKER'] = False
+    app.config['STRIPE_EVENTS_QUEUE_WORKER'] = False
+    app.config['PASSWORD_HASH_WORKERS'] = 0
+    app.config['PASSWORD_BCRYPT_ROUNDS'] = 4
+    app.config['USER_IMPORT_HASH_WORKERS'] = 0
     
     with app.test_client() as client:
         with app.app_context():
             db.create_all()
+            availability.reset()
+            space_count_cache.clear()
+            client_space_cache.clear()
+            rate_limit_backend.clear()
+            user_state_cache.clear()
             yield client
             db.session.remove()
             db.drop_all()
@@ -171,6 +221,358 @@ class TestAuthentication:
         assert response.status_code == 200
         assert 'Email verified successfully' in response.get_data(as_text=True)
 
+def verified_user(email='test@example.com', password='Test123!'):
+    user = User(email=email, username=email.split('@')[0], role=UserRole.CLIENT, verification_code=None)
+    user.password = password
+    db.session.add(user)
+    db.session.commit()
+    return user
+
+def login(client, email='test@example.com', password='Test123!'):
+    return client.post('/login', json={'email': email, 'password': password})
+
+class TestPasswords:
+    def test_legacy_werkzeug_hash_is_upgraded_on_login(self, client):
+        """Test a Werkzeug hash still logs in and is replaced with the configured hasher"""
+        user = verified_user()
+        user.password_hash = generate_password_hash('Test123!')
+        db.session.commit()
+
+        assert login(client, password='wrong').status_code == 401
+        assert login(client).status_code == 200
+        db.session.refresh(user)
+        assert user.password_hash.startswith('$2b$04$')
+        assert login(client).status_code == 200
+
+    def test_cost_change_rehashes_on_login(self, client, monkeypatch):
+        """Test hashes made with an old cost are rehashed with the current one"""
+        user = verified_user()
+        monkeypatch.setitem(app.config, 'PASSWORD_BCRYPT_ROUNDS', 5)
+
+        assert login(client).status_code == 200
+        db.session.refresh(user)
+        assert user.password_hash.startswith('$2b$05$')
+
+    def test_profile_password_change_can_log_in(self, client):
+        """Test passwords set through the profile use the same hasher as login"""
+        user = verified_user()
+        headers = {'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'}
+        response = client.put('/profile', json={'password': 'Changed123!'}, headers=headers)
+        assert response.status_code == 200
+
+        assert login(client, password='Changed123!').status_code == 200
+        assert login(client).status_code == 401
+
+    def test_hashing_runs_in_process_pool(self, client, monkeypatch):
+        """Test hashes and checks round-trip through a worker process"""
+        monkeypatch.setitem(app.config, 'PASSWORD_HASH_WORKERS', 1)
+        pool = HashingPool(app.config)
+        password_hash = pool.run(*get_hasher().hash_job('Test123!'))
+        assert pool.run(*get_hasher().check_job(password_hash, 'Test123!'))
+        assert not pool.run(*get_hasher().check_job(password_hash, 'wrong'))
+        pool._executor.shutdown()
+
+    def test_saturated_pool_sheds_logins(self, client, monkeypatch):
+        """Test logins fail fast with 503 when every hashing slot is taken"""
+        verified_user()
+        monkeypatch.setitem(app.config, 'PASSWORD_HASH_WORKERS', 1)
+        monkeypatch.setitem(app.config, 'PASSWORD_HASH_WAIT_SECONDS', 0.01)
+        monkeypatch.setattr(hashing_pool, '_slots', threading.BoundedSemaphore(1))
+        hashing_pool._slots.acquire()
+
+        response = login(client)
+        assert response.status_code == 503
+        assert 'Retry-After' in response.headers
+
+    def test_saturated_pool_sheds_password_changes(self, client, monkeypatch):
+        """Test a profile password change gets 503, not 500, when every hashing slot is taken"""
+        user = verified_user()
+        headers = {'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'}
+        monkeypatch.setitem(app.config, 'PASSWORD_HASH_WORKERS', 1)
+        monkeypatch.setitem(app.config, 'PASSWORD_HASH_WAIT_SECONDS', 0.01)
+        monkeypatch.setattr(hashing_pool, '_slots', threading.BoundedSemaphore(1))
+        hashing_pool._slots.acquire()
+
+        response = client.put('/profile', json={'username': 'renamed', 'password': 'Changed123!'}, headers=headers)
+        assert response.status_code == 503
+        assert 'Retry-After' in response.headers
+        assert db.session.get(User, user.id).username == 'test'
+
+class TestRateLimits:
+    def test_failed_logins_lock_the_email_before_any_lookup(self, client):
+        """Test repeated wrong passwords are rejected without touching the database"""
+        verified_user()
+        limit, _ = app.config['RATE_LIMITS']['login']['email_failures']
+        for _ in range(limit):
+            assert login(client, password='wrong').status_code == 401
+
+        with recorded_queries() as queries:
+            response = login(client, email='Test@Example.com ')
+        assert response.status_code == 429
+        assert int(response.headers['Retry-After']) > 0
+        assert queries == []
+
+        assert login(client, email='other@example.com').status_code == 401
+
+    def test_ip_limit_applies_to_every_request(self, client, monkeypatch):
+        """Test one address is cut off after its per-window quota"""
+        monkeypatch.setitem(app.config['RATE_LIMITS'], 'register', {'ip': (2, 60)})
+        statuses = [client.post('/register', json={}).status_code for _ in range(3)]
+        assert statuses == [400, 400, 429]
+        other = client.post('/register', json={}, environ_base={'REMOTE_ADDR': '10.0.0.2'})
+        assert other.status_code == 400
+
+    def test_ip_limit_keys_on_forwarded_address_behind_proxy(self, client, monkeypatch):
+        """Test clients behind a trusted proxy get their own buckets, keyed on X-Forwarded-For"""
+        monkeypatch.setitem(app.config['RATE_LIMITS'], 'register', {'ip': (1, 60)})
+        monkeypatch.setattr(app, 'wsgi_app', ProxyFix(app.wsgi_app, x_for=1))
+        proxy = {'REMOTE_ADDR': '10.0.0.1'}
+
+        def register(client_address):
+            return client.post('/register', json={}, environ_base=proxy,
+                               headers={'X-Forwarded-For': f'1.2.3.4, {client_address}'}).status_code
+
+        assert [register('203.0.113.7'), register('203.0.113.7')] == [400, 429]
+        assert register('198.51.100.9') == 400
+
+    def test_wrong_verification_codes_are_limited(self, client):
+        """Test guessing verification codes locks the email"""
+        client.post('/register', json={'email': 'new@example.com', 'username': 'new',
+                                       'password': 'Test123!', 'role': 'client'})
+        limit, _ = app.config['RATE_LIMITS']['verify-email']['email_failures']
+        for _ in range(limit):
+            response = client.post('/verify-email', json={'email': 'new@example.com', 'verification_code': 'nope'})
+            assert response.status_code == 400
+        code = User.query.filter_by(email='new@example.com').one().verification_code
+        response = client.post('/verify-email', json={'email': 'new@example.com', 'verification_code': code})
+        assert response.status_code == 429
+
+    def test_previous_window_still_counts(self, monkeypatch):
+        """Test hits from the previous window are weighted by their overlap"""
+        window = SlidingWindow(TTLCache(ttl=60), 'test', limit=10, window=60)
+        monkeypatch.setattr(time, 'time', lambda: 6030.0)
+        for _ in range(10):
+            assert window.hit('key') is None
+        assert window.exceeded('key') == 30
+
+        monkeypatch.setattr(time, 'time', lambda: 6105.0)  # 25% of the previous window still overlaps
+        assert window.exceeded('key') is None
+        assert [window.hit('key') for _ in range(8)][-2:] == [None, 15]
+
+class TestAuthContext:
+    def claims_headers(self, client):
+        verified_user(email='owner@example.com')
+        user = User.query.filter_by(email='owner@example.com').one()
+        user.role = UserRole.OWNER
+        db.session.commit()
+        token = login(client, email='owner@example.com').get_json()['access_token']
+        return user, {'Authorization': f'Bearer {token}'}
+
+    def test_authorizes_from_claims_without_user_query(self, client):
+        """Test a warm token check needs no users query"""
+        user, headers = self.claims_headers(client)
+        client.get('/spaces', headers=headers)
+
+        with recorded_queries() as queries:
+            response = client.get('/spaces', headers=headers)
+        assert response.status_code == 200
+        assert not [q for q in queries if 'users' in q]
+
+    def test_password_change_revokes_existing_tokens(self, client):
+        """Test tokens issued before a password change are rejected"""
+        user, headers = self.claims_headers(client)
+        response = client.put('/profile', json={'password': 'Changed123!'}, headers=headers)
+        assert response.status_code == 200
+
+        assert client.get('/spaces', headers=headers).status_code == 401
+        token = login(client, email='owner@example.com', password='Changed123!').get_json()['access_token']
+        assert client.get('/spaces', headers={'Authorization': f'Bearer {token}'}).status_code == 200
+
+    def test_role_change_and_deletion_invalidate_tokens(self, client):
+        """Test a token whose role is stale, or whose user is gone, is rejected"""
+        user, headers = self.claims_headers(client)
+        user.role = UserRole.CLIENT
+        db.session.commit()
+        assert client.get('/spaces', headers=headers).status_code == 401
+
+        # Tokens without role claims take the role from the user
+        headers = {'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'}
+        assert client.get('/spaces', headers=headers).status_code == 200
+        db.session.delete(user)
+        db.session.commit()
+        assert client.get('/spaces', headers=headers).status_code == 401
+
+    def test_version_check_can_be_disabled(self, client, monkeypatch):
+        """Test with the check off, claims are trusted without any lookup"""
+        user, headers = self.claims_headers(client)
+        monkeypatch.setitem(app.config, 'AUTH_CHECK_TOKEN_VERSION', False)
+        user_state_cache.clear()
+
+        with recorded_queries() as queries:
+            response = client.post('/spaces', data=space_form(), headers=headers)
+        assert response.status_code == 201
+        assert not [q for q in queries if 'FROM users' in q]
+
+def user_row(n, **overrides):
+    row = {'email': f'user{n}@example.com', 'username': f'user{n}', 'password_hash': 'x',
+           'role': UserRole.CLIENT, 'verification_code': None}
+    row.update(overrides)
+    return row
+
+class TestRegistration:
+    def register(self, client, email='new@example.com', username='new'):
+        return client.post('/register', json={'email': email, 'username': username,
+                                              'password': 'Test123!', 'role': 'client'})
+
+    def test_register_is_a_single_insert(self, client):
+        """Test registration doesn't look up email or username before inserting"""
+        with recorded_queries() as queries:
+            assert self.register(client).status_code == 201
+        users = [q for q in queries if 'users' in q]
+        assert users[0].startswith('INSERT INTO users')
+        assert len([q for q in users if q.startswith('INSERT')]) == 1
+
+    def test_duplicates_map_to_409(self, client):
+        """Test each unique constraint maps to its own 409"""
+        assert self.register(client).status_code == 201
+
+        response = self.register(client, username='other')
+        assert response.status_code == 409
+        assert response.get_json()['error'] == 'Email address already exists'
+        response = self.register(client, email='other@example.com')
+        assert response.status_code == 409
+        assert response.get_json()['error'] == 'Username already exists'
+        assert OutboundEmail.query.count() == 1
+
+    def test_concurrent_registrations_have_one_winner(self, client):
+        """Test racing registrations for one email give one 201 and 409s, never a 500"""
+        barrier = threading.Barrier(5)
+        statuses = []
+
+        def attempt(n):
+            with app.test_client() as thread_client:
+                barrier.wait()
+                statuses.append(self.register(thread_client, username=f'racer{n}').status_code)
+
+        threads = [threading.Thread(target=attempt, args=(n,)) for n in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        assert sorted(statuses) == [201] + [409] * 4
+        assert User.query.filter_by(email='new@example.com').count() == 1
+
+    def test_provision_users_in_batches(self, client):
+        """Test bulk provisioning inserts in batches and skips taken emails and usernames"""
+        db.session.add(User(**user_row(3)))
+        db.session.commit()
+        rows = [user_row(n) for n in range(2500)]
+        rows.append(user_row(9000, email='user7@example.com'))
+        rows.append(user_row(9001, username='user8'))
+
+        with recorded_queries() as queries:
+            result = provision_users(rows, batch_size=1000)
+
+        assert result['created'] == 2499
+        assert [(row['username'], field) for row, field in result['skipped']] == [
+            ('user3', 'email'), ('user9000', 'email'), ('user8', 'username')
+        ]
+        assert User.query.count() == 2500
+        assert len([q for q in queries if q.startswith('INSERT')]) == 3
+
+    def test_provisioning_survives_a_race(self, client, monkeypatch):
+        """Test a batch conflicting after the duplicate check falls back to row by row"""
+        db.session.add(User(**user_row(1, username='existing')))
+        db.session.commit()
+        # Pretend user1 registered between the check and the insert
+        monkeypatch.setattr(accounts, 'or_', lambda *clauses: false())
+
+        result = provision_users([user_row(n) for n in range(3)])
+        assert result['created'] == 2
+        assert [(row['username'], field) for row, field in result['skipped']] == [('user1', 'email')]
+        assert User.query.count() == 3
+
+IMPORT_CSV = """email,username,password,role
+one@example.com,one,Secret123!,client
+two@example.com,two,Secret123!,owner
+not-an-email,bad,Secret123!,client
+admin@example.com,dupe,Secret123!,client
+three@example.com,three,weak,client
+four@example.com,four,Secret123!,
+"""
+
+class TestUserImport:
+    def post_import(self, client, headers, body, content_type='text/csv'):
+        return client.post('/admin/users/import', data=body, headers={**headers, 'Content-Type': content_type})
+
+    def test_csv_import_creates_unverified_users_and_queues_emails(self, client, admin_headers):
+        """Test valid rows are created, bad and existing ones reported by line"""
+        response = self.post_import(client, admin_headers, IMPORT_CSV)
+        assert response.status_code == 200
+        report = response.get_json()
+        assert (report['created'], report['skipped'], report['invalid']) == (3, 1, 2)
+        assert report['seconds_per_10k_users'] is not None
+        assert {'line': 4, 'error': 'Invalid email address'} in report['errors']
+        assert {'line': 6, 'error': 'Password is too weak'} in report['errors']
+        assert {'email': 'admin@example.com', 'username': 'dupe', 'error': 'Email address already exists'} in report['errors']
+
+        two = User.query.filter_by(email='two@example.com').one()
+        assert two.role == UserRole.OWNER and two.verification_code
+        assert User.query.filter_by(email='four@example.com').one().role == UserRole.CLIENT
+        emails = OutboundEmail.query.order_by(OutboundEmail.id).all()
+        assert [e.recipient for e in emails] == ['one@example.com', 'two@example.com', 'four@example.com']
+        assert two.verification_code in emails[1].body
+
+    def test_jsonl_import_reports_unreadable_lines(self, client, admin_headers):
+        """Test JSONL records are imported and malformed lines reported"""
+        body = '\n'.join([
+            json.dumps({'email': 'one@example.com', 'username': 'one', 'password': 'Secret123!'}),
+            '{not json',
+            '',
+            json.dumps({'email': 'two@example.com', 'username': 'two', 'password': 'Secret123!', 'role': 'chief'}),
+        ])
+        report = self.post_import(client, admin_headers, body, 'application/x-ndjson').get_json()
+        assert report['created'] == 1
+        assert report['errors'] == [{'line': 2, 'error': 'Invalid JSON'}, {'line': 4, 'error': "Invalid role 'chief'"}]
+
+    def test_import_is_admin_only_and_checks_the_file(self, client, admin_headers):
+        """Test non-admins, unknown content types and headerless CSV are rejected"""
+        user = verified_user()
+        headers = {'Authorization': f'Bearer {create_access_token(identity=str(user.id))}'}
+        assert self.post_import(client, headers, IMPORT_CSV).status_code == 403
+        assert self.post_import(client, admin_headers, IMPORT_CSV, 'application/json').status_code == 415
+        response = self.post_import(client, admin_headers, 'email,username\na@example.com,a\n')
+        assert response.status_code == 400
+        assert 'password' in response.get_json()['error']
+
+    def test_large_import_runs_in_batches_on_the_hashing_pool(self, client, monkeypatch):
+        """Test hashing goes through worker processes and throughput is reported"""
+        monkeypatch.setitem(app.config, 'USER_IMPORT_HASH_WORKERS', 2)
+        monkeypatch.setattr(accounts, 'IMPORT_PROGRESS_EVERY', 10)
+        records = ((n, {'email': f'user{n}@example.com', 'username': f'user{n}', 'password': 'Secret123!'}, None)
+                   for n in range(25))
+        progress = []
+
+        with recorded_queries() as queries:
+            report = import_users(records, batch_size=10, progress=lambda created, seconds: progress.append(created))
+        passwords.bulk_hashing_pool._executor.shutdown()
+        monkeypatch.setattr(passwords.bulk_hashing_pool, '_executor', None)
+
+        assert report['created'] == 25
+        assert progress == [10, 20]
+        assert len([q for q in queries if q.startswith('INSERT INTO users')]) == 3
+        assert len([q for q in queries if q.startswith('INSERT INTO outbound_emails')]) == 3
+        assert login(client, email='user7@example.com', password='Secret123!').get_json()['error'] == 'Email not yet verified'
+
+    def test_cli_import(self, client, tmp_path):
+        """Test `flask import-users` imports a file and prints the summary"""
+        path = tmp_path / 'users.csv'
+        path.write_text(IMPORT_CSV)
+        result = app.test_cli_runner().invoke(args=['import-users', str(path)])
+        assert result.exit_code == 0, result.output
+        assert 'Created 4 users, skipped 0 existing, 2 invalid' in result.output
+
 # Space Management Tests
 class TestSpaces:
     def test_create_space_success(self, client):
@@ -287,4 +689,1128 @@ class TestSpaces:
         'rules': ['no smoking']
     }
 
-    
\ No newline at end of file
+    
+
+# Pagination Tests
+class TestCursorPagination:
+    def add_spaces(self, owner, count):
+        db.session.add_all([Space(
+            owner_id=owner.id, name=f'Space {i}', description='Room', address='1 Main St',
+            capacity=5, hourly_price=10, daily_price=50, status=SpaceStatus.AVAILABLE
+        ) for i in range(count)])
+        db.session.commit()
+
+    def test_walk_spaces_by_cursor(self, client, admin_user):
+        """Test cursor mode returns every space once with no COUNT query"""
+        self.add_spaces(admin_user, 7)
+        seen, cursor = [], ''
+        while cursor is not None:
+            with recorded_queries() as statements:
+                response = client.get('/client/spaces', query_string={'cursor': cursor, 'per_page': 3})
+            assert not any('count(' in statement.lower() for statement in statements)
+            body = response.get_json()
+            seen += [s['id'] for s in body['spaces']]
+            cursor = body['pagination']['next_cursor']
+        assert seen == sorted(seen) and len(seen) == 7
+
+    def test_walk_bookings_by_cursor(self, client, admin_user, admin_headers, sample_space):
+        """Test booking cursors page newest first"""
+        add_bookings(admin_user, sample_space, 5)
+        first = client.get('/bookings?cursor=&per_page=2', headers=admin_headers).get_json()
+        assert [b['id'] for b in first['bookings']] == [5, 4]
+
+        cursor = first['pagination']['next_cursor']
+        second = client.get(f'/bookings?cursor={cursor}&per_page=2', headers=admin_headers).get_json()
+        assert [b['id'] for b in second['bookings']] == [3, 2]
+        assert second['pagination']['has_next'] is True
+
+    def test_per_page_is_capped(self, client, admin_headers, sample_space):
+        """Test per_page can't exceed the hard cap in either mode"""
+        response = client.get('/spaces?per_page=100000', headers=admin_headers)
+        assert response.get_json()['pagination']['per_page'] == 100
+
+    def test_total_count_is_cached_until_write(self, client, admin_user, admin_headers):
+        """Test listing totals are cached per filter and dropped on Space writes"""
+        self.add_spaces(admin_user, 3)
+        first = client.get('/spaces?per_page=2', headers=admin_headers).get_json()['pagination']
+        second = client.get('/spaces?per_page=2', headers=admin_headers).get_json()['pagination']
+        assert (first['total_source'], second['total_source']) == ('exact', 'cached')
+        assert second['total_items'] == 3 and second['has_next'] is True
+
+        self.add_spaces(admin_user, 1)
+        third = client.get('/spaces?per_page=2', headers=admin_headers).get_json()['pagination']
+        assert (third['total_source'], third['total_items']) == ('exact', 4)
+
+    def test_include_total_opt_out(self, client, admin_user):
+        """Test ?include_total=false skips the COUNT query"""
+        self.add_spaces(admin_user, 3)
+        with recorded_queries() as statements:
+            response = client.get('/client/spaces?per_page=2&include_total=false')
+        assert not any('count(' in statement.lower() for statement in statements)
+        pagination = response.get_json()['pagination']
+        assert pagination['total_items'] is None and pagination['has_next'] is True
+
+    def test_invalid_cursor(self, client):
+        """Test a malformed cursor is rejected"""
+        response = client.get('/client/spaces?cursor=not-a-cursor')
+        assert response.status_code == 400
+
+    @pytest.mark.parametrize('value', [{'id': 1}, [1], '1', True, None])
+    def test_cursor_values_must_match_the_key(self, client, admin_headers, value):
+        """Test well-formed cursors holding the wrong kind of value get 400, not 500"""
+        cursor = base64.urlsafe_b64encode(json.dumps([value]).encode()).decode().rstrip('=')
+        assert client.get(f'/client/spaces?cursor={cursor}').status_code == 400
+        assert client.get(f'/bookings?cursor={cursor}', headers=admin_headers).status_code == 400
+
+# Response Cache Tests
+class TestResponseCache:
+    def test_public_listing_cached_until_space_write(self, client, admin_headers, sample_space):
+        """Test anonymous listings are served from cache and invalidated on writes"""
+        assert client.get('/client/spaces').headers['X-Cache'] == 'MISS'
+        with recorded_queries() as statements:
+            response = client.get('/client/spaces')
+        assert response.headers['X-Cache'] == 'HIT'
+        assert statements == []
+
+        client.put(f'/spaces/{sample_space.id}', json={'name': 'Renamed'}, headers=admin_headers)
+        response = client.get('/client/spaces')
+        assert response.headers['X-Cache'] == 'MISS'
+        assert response.get_json()['spaces'][0]['name'] == 'Renamed'
+
+    def test_cache_keyed_on_params(self, client, sample_space):
+        """Test different pages and searches get their own entries"""
+        client.get('/client/spaces?search=test')
+        assert client.get('/client/spaces?search=other').headers['X-Cache'] == 'MISS'
+        assert client.get('/client/spaces?search=TEST').headers['X-Cache'] == 'HIT'
+        assert client.get('/client/spaces?page=2').headers['X-Cache'] == 'MISS'
+
+    def test_shared_backend_generations(self):
+        """Test clearing a shared-backend cache invalidates every key at once"""
+        cache = ResponseCache('test', SharedCacheStandIn(ttl=60))
+        cache.set(cache.key({'page': 1}), {'spaces': [1]})
+        assert cache.get(cache.key({'page': 1})) == {'spaces': [1]}
+        cache.clear()
+        assert cache.get(cache.key({'page': 1})) is None
+
+    def test_response_built_across_a_write_is_not_served(self):
+        """Test a body computed before a clear() is stored where no one reads it"""
+        cache = ResponseCache('test', SharedCacheStandIn(ttl=60))
+        key = cache.key({'page': 1})
+        assert cache.get(key) is None
+        cache.clear()  # a Space write commits while the response is built
+        cache.set(key, {'spaces': ['stale']})
+        assert cache.get(cache.key({'page': 1})) is None
+
+    def test_count_computed_across_a_write_is_not_cached(self, client, sample_space):
+        """Test a total counted before a Space write commits isn't cached"""
+        query = Space.query
+        original_count = query.count
+
+        def count_then_write():
+            total = original_count()
+            space_count_cache.clear()  # a write commits after the COUNT
+            return total
+
+        with patch.object(type(query), 'count', side_effect=count_then_write, autospec=False):
+            offset_page(Space.query, 1, 10, count_cache=space_count_cache, count_key='race')
+        assert space_count_cache.get('race') is None
+
+        _, pagination = offset_page(Space.query, 1, 10, count_cache=space_count_cache, count_key='race')
+        assert pagination['total_source'] == 'exact'
+        assert space_count_cache.get('race') == 1
+
+# Conditional GET Tests
+class TestConditionalGet:
+    def test_client_space_not_modified(self, client, admin_headers, sample_space):
+        """Test a matching If-None-Match gets a 304 without loading JSON columns"""
+        first = client.get(f'/client/spaces/{sample_space.id}')
+        etag = first.headers['ETag']
+        assert first.headers['Cache-Control'] == 'public, max-age=60'
+
+        with recorded_queries() as statements:
+            second = client.get(f'/client/spaces/{sample_space.id}', headers={'If-None-Match': etag})
+        assert second.status_code == 304
+        assert second.data == b''
+        assert not any('amenities' in statement for statement in statements)
+
+        client.put(f'/spaces/{sample_space.id}', json={'rules': ['no pets']}, headers=admin_headers)
+        third = client.get(f'/client/spaces/{sample_space.id}', headers={'If-None-Match': etag})
+        assert third.status_code == 200
+        assert third.headers['ETag'] != etag
+        assert third.get_json()['rules'] == ['no pets']
+
+    def test_space_detail_etag(self, client, admin_headers, sample_space):
+        """Test the authenticated detail view also revalidates by ETag"""
+        first = client.get(f'/spaces/{sample_space.id}', headers=admin_headers)
+        assert first.headers['Cache-Control'] == 'private, no-cache'
+
+        headers = dict(admin_headers, **{'If-None-Match': first.headers['ETag']})
+        assert client.get(f'/spaces/{sample_space.id}', headers=headers).status_code == 304
+
+# Search Tests
+class TestSearch:
+    def add_space(self, owner, name, description, address='1 Main St'):
+        space = Space(
+            owner_id=owner.id, name=name, description=description, address=address,
+            capacity=5, hourly_price=10, daily_price=50, status=SpaceStatus.AVAILABLE
+        )
+        db.session.add(space)
+        db.session.commit()
+        return space
+
+    def test_prefix_search_ranks_matches(self, client, admin_user):
+        """Test client search matches word prefixes and ranks by relevance"""
+        self.add_space(admin_user, 'Quiet Office', 'A desk near the studio')
+        self.add_space(admin_user, 'Photo Studio', 'Studio lighting in a studio loft')
+        self.add_space(admin_user, 'Garden Room', 'Outdoor seating', address='9 Studley Rd')
+
+        response = client.get('/client/spaces?search=studi')
+        names = [s['name'] for s in response.get_json()['spaces']]
+        assert names == ['Photo Studio', 'Quiet Office']
+
+        response = client.get('/client/spaces?search=stud')
+        assert response.get_json()['pagination']['total_items'] == 3
+
+    def test_search_index_follows_updates(self, client, admin_user, admin_headers):
+        """Test the index is kept in sync when a space is renamed or deleted"""
+        space = self.add_space(admin_user, 'Rooftop Terrace', 'Open air')
+        client.put(f'/spaces/{space.id}', json={'name': 'Basement Lounge'}, headers=admin_headers)
+
+        assert client.get('/client/spaces?search=rooftop').get_json()['spaces'] == []
+        assert len(client.get('/client/spaces?search=lounge').get_json()['spaces']) == 1
+
+        client.delete(f'/spaces/{space.id}', headers=admin_headers)
+        assert client.get('/client/spaces?search=lounge').get_json()['spaces'] == []
+
+# Availability Tests
+def future_slot(days, hours=2):
+    start = (datetime.now(timezone.utc) + timedelta(days=days)).replace(minute=0, second=0, microsecond=0)
+    return start, start + timedelta(hours=hours)
+
+def book(client, headers, space_id, start, end):
+    intent = MagicMock(id=f'pi_{start.timestamp()}', client_secret='secret')
+    with patch('app.stripe.PaymentIntent.create', return_value=intent):
+        return client.post(f'/spaces/{space_id}/book',
+                           json={'start_time': start.isoformat(), 'end_time': end.isoformat()},
+                           headers=headers)
+
+class TestAvailability:
+    def test_booking_keeps_space_listed(self, client, admin_headers, sample_space):
+        """Test a booking only blocks its own slot, not the whole space"""
+        start, end = future_slot(3)
+        assert book(client, admin_headers, sample_space.id, start, end).status_code == 201
+        assert db.session.get(Space, sample_space.id).status == SpaceStatus.AVAILABLE
+
+        # Same slot conflicts, a later slot is still bookable
+        assert book(client, admin_headers, sample_space.id, start, end).status_code == 409
+        later_start, later_end = future_slot(4)
+        assert book(client, admin_headers, sample_space.id, later_start, later_end).status_code == 201
+
+    def test_availability_endpoint(self, client, admin_headers, sample_space):
+        """Test free windows and point checks reflect bookings"""
+        start, end = future_slot(2)
+        book(client, admin_headers, sample_space.id, start, end)
+
+        response = client.get(f'/spaces/{sample_space.id}/availability',
+                              query_string={'start': start.isoformat(), 'end': end.isoformat()})
+        assert response.status_code == 200
+        assert response.get_json()['available'] is False
+
+        response = client.get(f'/spaces/{sample_space.id}/availability?days=7')
+        windows = response.get_json()['free_windows']
+        assert len(windows) == 2
+        assert windows[0]['end'] == start.isoformat()
+        assert windows[1]['start'] == end.isoformat()
+
+    def test_cancelled_booking_frees_slot(self, client, admin_headers, sample_space):
+        """Test the calendar is patched when a booking is cancelled"""
+        start, end = future_slot(5)
+        booking_id = book(client, admin_headers, sample_space.id, start, end).get_json()['booking_id']
+        assert not availability.is_free(sample_space.id, start, end)
+
+        with patch('app.stripe.PaymentIntent.cancel'):
+            response = client.put(f'/bookings/{booking_id}/cancel', headers=admin_headers)
+        assert response.status_code == 200
+        assert availability.is_free(sample_space.id, start, end)
+
+    def test_stale_calendar_conflict_is_checked_against_the_database(self, client, admin_headers, sample_space):
+        """Test a slot freed by another process is bookable before the calendar reloads"""
+        start, end = future_slot(5)
+        booking_id = book(client, admin_headers, sample_space.id, start, end).get_json()['booking_id']
+        # Cancelled without going through this process's session events
+        db.session.execute(update(Booking).where(Booking.id == booking_id).values(status=BookingStatus.CANCELLED))
+        db.session.commit()
+        assert not availability.is_free(sample_space.id, start, end)
+
+        assert book(client, admin_headers, sample_space.id, start, end).status_code == 201
+        assert book(client, admin_headers, sample_space.id, start, end).status_code == 409
+
+
+def add_bookings(user, space, count):
+    start = datetime(2030, 1, 1)
+    db.session.add_all([Booking(
+        client_id=user.id,
+        space_id=space.id,
+        start_time=start + timedelta(days=i),
+        end_time=start + timedelta(days=i, hours=2),
+        total_price=Decimal('100'),
+        status=BookingStatus.CONFIRMED
+    ) for i in range(count)])
+    db.session.commit()
+
+# Profile Tests
+class TestProfile:
+    def profile_query_count(self, client, headers):
+        db.session.expire_all()
+        with recorded_queries() as statements:
+            response = client.get('/profile', headers=headers)
+        assert response.status_code == 200
+        return len(statements), response.get_json()
+
+    def test_profile_query_count_is_constant(self, client, admin_user, admin_headers, sample_space):
+        """Test the profile costs the same number of queries for 1 or 40 bookings"""
+        client.get('/profile', headers=admin_headers)  # warm the token check cache
+        add_bookings(admin_user, sample_space, 1)
+        few, _ = self.profile_query_count(client, admin_headers)
+
+        add_bookings(admin_user, sample_space, 39)
+        many, profile = self.profile_query_count(client, admin_headers)
+
+        assert few == many
+        assert len(profile['bookings']) == 40
+        assert profile['bookings'][0]['space_name'] == 'Test Space'
+
+    def test_profile_pagination(self, client, admin_user, admin_headers, sample_space):
+        """Test nested bookings are paginated through query params"""
+        add_bookings(admin_user, sample_space, 5)
+        response = client.get('/profile?bookings_page=2&bookings_per_page=2', headers=admin_headers)
+
+        profile = response.get_json()
+        assert [b['id'] for b in profile['bookings']] == [3, 4]
+        assert profile['pagination']['bookings']['total_items'] == 5
+        assert profile['pagination']['bookings']['has_next'] is True
+        assert len(profile['spaces']) == 1
+
+
+# Booking Tests
+class TestBookings:
+    def test_booking_list_query_count_is_constant(self, client, admin_user, admin_headers, sample_space):
+        """Test listing bookings doesn't lazy load each booking's space"""
+        client.get('/bookings', headers=admin_headers)  # warm the token check cache
+        add_bookings(admin_user, sample_space, 1)
+        db.session.expire_all()
+        few = client.get('/bookings', headers=admin_headers)
+
+        add_bookings(admin_user, sample_space, 9)
+        db.session.expire_all()
+        many = client.get('/bookings', headers=admin_headers)
+
+        assert few.headers['X-SQL-Query-Count'] == many.headers['X-SQL-Query-Count']
+        bookings = many.get_json()['bookings']
+        assert len(bookings) == 10
+        assert bookings[0]['space_name'] == 'Test Space'
+
+    def test_get_single_booking(self, client, admin_user, admin_headers, sample_space):
+        """Test a single booking is returned with its space details"""
+        add_bookings(admin_user, sample_space, 1)
+        response = client.get('/bookings/1', headers=admin_headers)
+
+        assert response.status_code == 200
+        booking = response.get_json()
+        assert booking['space_name'] == 'Test Space'
+        assert booking['space_address'] == '123 Test St'
+        assert booking['status'] == 'confirmed'
+
+
+    def test_concurrent_requests_for_one_slot_have_one_winner(self, client, admin_headers, sample_space):
+        """Test many threads booking the same slot produce exactly one hold"""
+        start, end = future_slot(days=3)
+        url = f'/spaces/{sample_space.id}/book'
+        barrier = threading.Barrier(12)
+        statuses = []
+
+        def attempt():
+            with app.test_client() as thread_client:
+                barrier.wait()
+                response = thread_client.post(url,
+                                              json={'start_time': start.isoformat(), 'end_time': end.isoformat()},
+                                              headers=admin_headers)
+                statuses.append(response.status_code)
+
+        intent = MagicMock(id='pi_race', client_secret='secret')
+        # Skip the in-memory fast reject so every thread reaches the database
+        with patch('app.stripe.PaymentIntent.create', return_value=intent), \
+                patch.object(availability, 'is_free', return_value=True):
+            threads = [threading.Thread(target=attempt) for _ in range(12)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+
+        assert sorted(statuses) == [201] + [409] * 11
+        assert Booking.query.filter_by(space_id=sample_space.id).count() == 1
+
+    def test_booking_is_a_pending_hold(self, client, admin_headers, sample_space):
+        """Test a new booking holds the slot until hold_expires_at"""
+        start, end = future_slot(days=3)
+        response = book(client, admin_headers, sample_space.id, start, end)
+
+        assert response.status_code == 201
+        booking = db.session.get(Booking, response.get_json()['booking_id'])
+        assert booking.status == BookingStatus.PENDING
+        assert booking.stripe_payment_intent_id == f'pi_{start.timestamp()}'
+        expected = datetime.now(timezone.utc).replace(tzinfo=None) + timedelta(minutes=app.config['BOOKING_HOLD_MINUTES'])
+        assert abs(booking.hold_expires_at - expected) < timedelta(minutes=1)
+
+    def test_cancellation_notice_is_measured_in_utc(self, client, admin_headers, sample_space, monkeypatch):
+        """Test the 24-hour cancellation window doesn't shift with the host's time zone"""
+        monkeypatch.setenv('TZ', 'Etc/GMT+10')  # UTC-10
+        time.tzset()
+        try:
+            start = datetime.now(timezone.utc) + timedelta(hours=20)
+            booking_id = book(client, admin_headers, sample_space.id, start, start + timedelta(hours=2)).get_json()['booking_id']
+            with patch('app.stripe.PaymentIntent.cancel'):
+                response = client.put(f'/bookings/{booking_id}/cancel', headers=admin_headers)
+            assert response.status_code == 400
+        finally:
+            monkeypatch.undo()
+            time.tzset()
+
+    def test_hold_is_placed_with_an_integer_client_id(self, client, admin_user, admin_headers, sample_space):
+        """Test the JWT identity is converted before being bound into the hold's INSERT"""
+        start, end = future_slot(days=3)
+        with patch('app.place_hold', wraps=place_hold) as spy:
+            assert book(client, admin_headers, sample_space.id, start, end).status_code == 201
+        assert spy.call_args.args[0] == admin_user.id
+        assert isinstance(spy.call_args.args[0], int)
+
+    def test_stripe_failure_releases_the_hold(self, client, admin_headers, sample_space):
+        """Test the slot is freed again when the PaymentIntent can't be created"""
+        start, end = future_slot(days=3)
+        error = stripe.error.APIConnectionError('Stripe is down')
+        with patch('app.stripe.PaymentIntent.create', side_effect=error):
+            response = client.post(f'/spaces/{sample_space.id}/book',
+                                   json={'start_time': start.isoformat(), 'end_time': end.isoformat()},
+                                   headers=admin_headers)
+
+        assert response.status_code == 402
+        assert Booking.query.one().status == BookingStatus.CANCELLED
+        assert book(client, admin_headers, sample_space.id, start, end).status_code == 201
+
+
+class TestHoldSweeper:
+    def test_expired_holds_are_cancelled_in_bulk(self, client, admin_headers, sample_space):
+        """Test the sweeper frees expired holds, cancels their intents and leaves live ones"""
+        slots = [future_slot(days=d) for d in (3, 4, 5)]
+        ids = [book(client, admin_headers, sample_space.id, *slot).get_json()['booking_id'] for slot in slots]
+        past = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(minutes=1)
+        for booking_id in ids[:2]:
+            db.session.get(Booking, booking_id).hold_expires_at = past
+        db.session.commit()
+
+        before = dict(hold_sweeper.metrics)
+        with patch('app.stripe.PaymentIntent.cancel') as cancel:
+            assert hold_sweeper.drain() == 2
+        assert sorted(c.args[0] for c in cancel.call_args_list) == \
+            sorted(f'pi_{slot[0].timestamp()}' for slot in slots[:2])
+
+        db.session.expire_all()
+        assert [db.session.get(Booking, i).status for i in ids] == \
+            [BookingStatus.CANCELLED, BookingStatus.CANCELLED, BookingStatus.PENDING]
+        assert hold_sweeper.metrics['holds_expired'] - before['holds_expired'] == 2
+        assert hold_sweeper.metrics['intents_cancelled'] - before['intents_cancelled'] == 2
+
+        # The freed slot can be booked again straight away
+        assert book(client, admin_headers, sample_space.id, *slots[0]).status_code == 201
+
+    def test_confirmed_bookings_are_never_expired(self, client, admin_user, sample_space):
+        """Test only PENDING bookings are swept, whatever their hold time"""
+        add_bookings(admin_user, sample_space, 1)
+        booking = Booking.query.one()
+        booking.hold_expires_at = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(hours=1)
+        db.session.commit()
+
+        assert hold_sweeper.drain() == 0
+        assert db.session.get(Booking, booking.id).status == BookingStatus.CONFIRMED
+
+    def test_cancel_failures_are_counted(self, client, admin_headers, sample_space):
+        """Test a Stripe error doesn't stop the hold from being expired"""
+        start, end = future_slot(days=3)
+        booking_id = book(client, admin_headers, sample_space.id, start, end).get_json()['booking_id']
+        db.session.get(Booking, booking_id).hold_expires_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        db.session.commit()
+
+        before = hold_sweeper.metrics['intent_cancel_failures']
+        with patch('app.stripe.PaymentIntent.cancel', side_effect=stripe.error.InvalidRequestError('already succeeded', None)):
+            assert hold_sweeper.drain() == 1
+        assert hold_sweeper.metrics['intent_cancel_failures'] == before + 1
+        assert db.session.get(Booking, booking_id).status == BookingStatus.CANCELLED
+
+    def test_expired_hold_stops_blocking_before_the_sweep(self, client, admin_headers, sample_space):
+        """Test a hold past hold_expires_at no longer conflicts, even unswept"""
+        start, end = future_slot(days=3)
+        booking_id = book(client, admin_headers, sample_space.id, start, end).get_json()['booking_id']
+        db.session.get(Booking, booking_id).hold_expires_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        db.session.commit()
+
+        later = start + timedelta(hours=1)
+        assert book(client, admin_headers, sample_space.id, later, later + timedelta(hours=2)).status_code == 201
+        assert db.session.get(Booking, booking_id).status == BookingStatus.PENDING
+
+    def test_sweeper_is_started_by_serving_requests(self, client):
+        """Test every serving process runs the sweeper, not only those placing holds"""
+        assert hold_sweeper.start() is False
+        with patch.object(hold_sweeper, 'start') as start:
+            client.get('/spaces')
+        start.assert_called_once_with()
+
+
+def stripe_event(event_id, event_type, payment_intent_id):
+    return {
+        'id': event_id,
+        'object': 'event',
+        'type': event_type,
+        'data': {'object': {
+            'id': payment_intent_id,
+            'object': 'payment_intent',
+            'charges': {'object': 'list', 'data': [{'id': f'ch_{payment_intent_id}', 'object': 'charge'}]}
+        }}
+    }
+
+def deliver(client, payload):
+    """POST a webhook, skipping signature checks but parsing the payload like Stripe's SDK"""
+    def construct_event(body, signature, secret):
+        return stripe.Event.construct_from(json.loads(body), stripe.api_key)
+    with patch('app.stripe.Webhook.construct_event', side_effect=construct_event):
+        return client.post('/stripe-webhook', data=json.dumps(payload),
+                           headers={'Stripe-Signature': 'test'}, content_type='application/json')
+
+class TestStripeWebhook:
+    def held_booking(self, client, admin_headers, sample_space):
+        start, end = future_slot(days=3)
+        booking_id = book(client, admin_headers, sample_space.id, start, end).get_json()['booking_id']
+        return db.session.get(Booking, booking_id)
+
+    def test_duplicate_delivery_is_acknowledged_once(self, client, admin_headers, sample_space):
+        """Test a redelivered event is acked without being applied again"""
+        booking = self.held_booking(client, admin_headers, sample_space)
+        payload = stripe_event('evt_1', 'payment_intent.succeeded', booking.stripe_payment_intent_id)
+
+        first = deliver(client, payload)
+        assert first.get_json() == {'received': True}
+        db.session.expire_all()
+        assert booking.status == BookingStatus.CONFIRMED
+
+        # Even if the booking changed since, the duplicate must not touch it
+        booking.status = BookingStatus.CANCELLED
+        db.session.commit()
+        with recorded_queries() as statements:
+            second = deliver(client, payload)
+        assert second.get_json() == {'received': True, 'duplicate': True}
+        assert len(statements) == 1
+        db.session.expire_all()
+        assert booking.status == BookingStatus.CANCELLED
+        assert StripeEvent.query.one().status == 'processed'
+
+    def test_async_mode_acks_then_worker_applies(self, client, admin_headers, sample_space, monkeypatch):
+        """Test async mode only records the event and the worker applies it"""
+        monkeypatch.setitem(app.config, 'STRIPE_WEBHOOK_ASYNC', True)
+        booking = self.held_booking(client, admin_headers, sample_space)
+
+        response = deliver(client, stripe_event('evt_2', 'payment_intent.payment_failed', booking.stripe_payment_intent_id))
+        assert response.status_code == 200
+        db.session.expire_all()
+        assert booking.status == BookingStatus.PENDING
+        assert StripeEvent.query.one().status == 'pending'
+
+        assert stripe_event_worker.drain() == 1
+        db.session.expire_all()
+        assert booking.status == BookingStatus.CANCELLED
+        assert StripeEvent.query.one().status == 'processed'
+
+    def test_payment_after_expiry_does_not_revive_booking(self, client, admin_headers, sample_space):
+        """Test a late payment for an expired hold leaves the booking cancelled and is refunded"""
+        booking = self.held_booking(client, admin_headers, sample_space)
+        booking.status = BookingStatus.CANCELLED
+        db.session.commit()
+
+        with patch('stripe_events.stripe.Refund.create') as refund:
+            deliver(client, stripe_event('evt_3', 'payment_intent.succeeded', booking.stripe_payment_intent_id))
+        refund.assert_called_once_with(
+            payment_intent=booking.stripe_payment_intent_id,
+            metadata={'booking_id': booking.id},
+            idempotency_key=f'refund-{booking.stripe_payment_intent_id}'
+        )
+        db.session.expire_all()
+        assert booking.status == BookingStatus.CANCELLED
+        assert booking.stripe_payment_status == 'refunded'
+
+    def test_failed_refund_is_retried(self, client, admin_headers, sample_space, monkeypatch):
+        """Test a Stripe error while refunding leaves the event queued for another attempt"""
+        monkeypatch.setitem(app.config, 'STRIPE_WEBHOOK_ASYNC', True)
+        booking = self.held_booking(client, admin_headers, sample_space)
+        booking.status = BookingStatus.CANCELLED
+        db.session.commit()
+        deliver(client, stripe_event('evt_6', 'payment_intent.succeeded', booking.stripe_payment_intent_id))
+
+        error = stripe.error.APIConnectionError('Stripe is down')
+        with patch('stripe_events.stripe.Refund.create', side_effect=error):
+            assert stripe_event_worker.drain() == 1
+        db.session.expire_all()
+        ledger_entry = StripeEvent.query.one()
+        assert (ledger_entry.status, ledger_entry.attempts) == ('pending', 1)
+        assert booking.stripe_payment_status != 'refunded'
+
+        ledger_entry.next_attempt_at = utcnow()
+        db.session.commit()
+        with patch('stripe_events.stripe.Refund.create') as refund:
+            assert stripe_event_worker.drain() == 1
+        refund.assert_called_once()
+        db.session.expire_all()
+        assert booking.stripe_payment_status == 'refunded'
+        assert StripeEvent.query.one().status == 'processed'
+
+    def test_payment_for_expired_rebooked_hold_does_not_confirm(self, client, admin_headers, sample_space):
+        """Test a late payment can't confirm a hold whose slot was booked after it expired"""
+        booking = self.held_booking(client, admin_headers, sample_space)
+        booking.hold_expires_at = utcnow()
+        db.session.commit()
+        later = booking.start_time.replace(tzinfo=timezone.utc) + timedelta(hours=1)
+        assert book(client, admin_headers, sample_space.id, later, later + timedelta(hours=2)).status_code == 201
+
+        with patch('stripe_events.stripe.Refund.create') as refund:
+            deliver(client, stripe_event('evt_5', 'payment_intent.succeeded', booking.stripe_payment_intent_id))
+        refund.assert_called_once()
+        db.session.expire_all()
+        assert booking.status == BookingStatus.CANCELLED
+
+    def test_failing_event_gives_up_after_max_attempts(self, client, admin_headers, sample_space, monkeypatch):
+        """Test each failed attempt counts, backs off further and ends in 'failed'"""
+        monkeypatch.setitem(app.config, 'STRIPE_WEBHOOK_ASYNC', True)
+        booking = self.held_booking(client, admin_headers, sample_space)
+        deliver(client, stripe_event('evt_4', 'payment_intent.succeeded', booking.stripe_payment_intent_id))
+
+        delays = []
+        with patch('stripe_events.apply_event', side_effect=RuntimeError('boom')):
+            for _ in range(app.config['STRIPE_EVENTS_MAX_ATTEMPTS']):
+                ledger_entry = StripeEvent.query.one()
+                ledger_entry.next_attempt_at = utcnow()
+                db.session.commit()
+                assert stripe_event_worker.drain() == 1
+                db.session.expire_all()
+                ledger_entry = StripeEvent.query.one()
+                delays.append((ledger_entry.next_attempt_at - utcnow()).total_seconds())
+
+        assert ledger_entry.status == 'failed'
+        assert ledger_entry.attempts == app.config['STRIPE_EVENTS_MAX_ATTEMPTS']
+        assert ledger_entry.last_error == 'boom'
+        assert delays[1] > delays[0] * 1.5
+
+
+class FakeStripeAPI(BaseHTTPRequestHandler):
+    """Serves GET /v1/payment_intents like Stripe: newest first, cursor paginated"""
+    protocol_version = 'HTTP/1.1'  # keep-alive, so connection reuse is observable
+    intents = []
+    requests = []
+    client_ports = []
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = {key: values[0] for key, values in parse_qs(url.query).items()}
+        self.requests.append(params)
+        self.client_ports.append(self.client_address[1])
+        matching = [i for i in self.intents if i['created'] >= int(params.get('created[gte]', 0))]
+        if 'starting_after' in params:
+            ids = [i['id'] for i in matching]
+            matching = matching[ids.index(params['starting_after']) + 1:]
+        limit = int(params.get('limit', 10))
+        body = json.dumps({
+            'object': 'list', 'url': '/v1/payment_intents',
+            'data': matching[:limit], 'has_more': len(matching) > limit
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+@pytest.fixture
+def fake_stripe(monkeypatch):
+    FakeStripeAPI.intents = []
+    FakeStripeAPI.requests = []
+    FakeStripeAPI.client_ports = []
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeStripeAPI)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setattr(stripe, 'api_base', f'http://127.0.0.1:{server.server_port}')
+    monkeypatch.setattr(stripe, 'api_key', 'sk_test_fake')
+    yield FakeStripeAPI
+    server.shutdown()
+
+def payment_intent(intent_id, created, status):
+    return {'id': intent_id, 'object': 'payment_intent', 'created': created, 'status': status,
+            'latest_charge': f'ch_{intent_id}' if status == 'succeeded' else None}
+
+class TestReconciliation:
+    def test_pages_through_intents_and_updates_bookings(self, client, admin_headers, sample_space, fake_stripe, monkeypatch):
+        """Test every page is fetched and matching bookings are brought up to date"""
+        monkeypatch.setitem(app.config, 'STRIPE_RECONCILE_PAGE_SIZE', 2)
+        ids = []
+        for days in (3, 4, 5):
+            start, end = future_slot(days=days)
+            ids.append(book(client, admin_headers, sample_space.id, start, end).get_json()['booking_id'])
+        bookings = [db.session.get(Booking, i) for i in ids]
+        now = int(time.time())
+        fake_stripe.intents = [
+            payment_intent(bookings[0].stripe_payment_intent_id, now - 10, 'succeeded'),
+            payment_intent('pi_unrelated', now - 20, 'succeeded'),
+            payment_intent(bookings[1].stripe_payment_intent_id, now - 30, 'canceled'),
+            payment_intent(bookings[2].stripe_payment_intent_id, now - 40, 'requires_payment_method'),
+        ]
+
+        stats = reconcile_payments()
+        assert stats == {'intents': 4, 'pages': 2, 'bookings_updated': 3}
+        assert [r.get('starting_after') for r in fake_stripe.requests] == [None, 'pi_unrelated']
+
+        db.session.expire_all()
+        assert [(b.status, b.stripe_payment_status) for b in bookings] == [
+            (BookingStatus.CONFIRMED, 'succeeded'),
+            (BookingStatus.CANCELLED, 'canceled'),
+            (BookingStatus.PENDING, 'requires_payment_method'),
+        ]
+        assert bookings[0].stripe_charge_id == f'ch_{bookings[0].stripe_payment_intent_id}'
+        assert db.session.get(SyncState, 'stripe_payment_intents').value == now - 10
+
+    def test_runs_resume_from_high_water_mark(self, client, fake_stripe):
+        """Test the next run starts at the stored mark minus the lookback window"""
+        db.session.add(SyncState(name='stripe_payment_intents', value=1_700_000_000))
+        db.session.commit()
+
+        assert reconcile_payments() == {'intents': 0, 'pages': 0, 'bookings_updated': 0}
+        lookback = app.config['STRIPE_RECONCILE_LOOKBACK_HOURS'] * 3600
+        assert fake_stripe.requests[0]['created[gte]'] == str(1_700_000_000 - lookback)
+        assert db.session.get(SyncState, 'stripe_payment_intents').value == 1_700_000_000
+
+class TestHTTPClient:
+    def test_stripe_pages_reuse_one_connection(self, client, fake_stripe, monkeypatch):
+        """Test paginated Stripe calls go over a single pooled keep-alive connection"""
+        monkeypatch.setitem(app.config, 'STRIPE_RECONCILE_PAGE_SIZE', 1)
+        now = int(time.time())
+        fake_stripe.intents = [payment_intent(f'pi_{n}', now - n, 'processing') for n in range(4)]
+        host_metrics.clear()
+
+        assert reconcile_payments()['pages'] == 4
+        assert len(fake_stripe.client_ports) == 4
+        assert len(set(fake_stripe.client_ports)) == 1
+
+        host = urlparse(stripe.api_base).netloc
+        assert host_metrics.snapshot()[host]['requests'] == 4
+        assert host_metrics.snapshot()[host]['errors'] == 0
+
+    def test_closing_a_session_keeps_the_shared_pool(self, fake_stripe):
+        """Test short-lived sessions (as authlib opens them) don't tear down the pool"""
+        url = f'{stripe.api_base}/v1/payment_intents'
+        http_session.get(url)
+        with PooledOAuth2Session(client_id='roomsy') as oauth_session:
+            oauth_session.get(url, withhold_token=True)
+        http_session.get(url)
+
+        assert len(set(fake_stripe.client_ports)) == 1
+
+    def test_default_timeout_applied(self, fake_stripe):
+        """Test requests without a timeout get HTTP_TIMEOUT"""
+        with patch.object(HTTPAdapter, 'send', autospec=True, side_effect=HTTPAdapter.send) as send:
+            http_session.get(f'{stripe.api_base}/v1/payment_intents')
+            http_session.get(f'{stripe.api_base}/v1/payment_intents', timeout=1)
+        assert [call.kwargs['timeout'] for call in send.call_args_list] == [app.config['HTTP_TIMEOUT'], 1]
+
+
+# Auth0 Tests
+AUTH0_METADATA = {
+    'issuer': 'https://roomsy.test/',
+    'authorization_endpoint': 'https://roomsy.test/authorize',
+    'token_endpoint': 'https://roomsy.test/oauth/token',
+    'jwks_uri': 'https://roomsy.test/.well-known/jwks.json',
+}
+AUTH0_KEY = JsonWebKey.generate_key('RSA', 2048, {'kid': 'key-1'}, is_private=True)
+
+@pytest.fixture
+def auth0_stub(client, monkeypatch):
+    """Serves AUTH0_METADATA and AUTH0_KEY's JWKS; records every fetched URL"""
+    fetched = []
+    keys = {'keys': [AUTH0_KEY.as_dict()]}
+
+    def fetch(self, url):
+        fetched.append(url)
+        return AUTH0_METADATA if url.endswith('openid-configuration') else keys
+
+    monkeypatch.setattr(OIDCCache, '_get', fetch)
+    monkeypatch.setitem(app.config, 'AUTH0_DOMAIN', 'roomsy.test')
+    monkeypatch.setattr(auth0, 'client_id', 'roomsy-client')
+    monkeypatch.setattr(oidc_cache, '_loaded_at', None)
+    oidc_cache.refresh()
+    fetched.clear()
+    return fetched
+
+def id_token(nonce, **claims):
+    now = int(time.time())
+    payload = {'iss': AUTH0_METADATA['issuer'], 'aud': 'roomsy-client', 'sub': 'auth0|42',
+               'iat': now, 'exp': now + 600, 'nonce': nonce,
+               'email': 'social@example.com', 'name': 'Social User', **claims}
+    return jose_jwt.encode({'alg': 'RS256', 'kid': 'key-1'}, payload, AUTH0_KEY).decode()
+
+class TestAuth0:
+    def test_callback_reads_claims_from_id_token(self, client, auth0_stub):
+        """Test a social login verifies the ID token locally without calling Auth0"""
+        user = User(email='social@example.com', username='social', role=UserRole.CLIENT)
+        user.password = 'password123'
+        db.session.add(user)
+        db.session.commit()
+        with app.test_request_context():
+            data = auth0.create_authorization_url(redirect_uri='http://localhost/auth0/callback')
+            auth0.save_authorize_data(redirect_uri='http://localhost/auth0/callback', **data)
+            saved = dict(session)
+        with client.session_transaction() as client_session:
+            client_session.update(saved)
+
+        token = {'access_token': 'at', 'token_type': 'Bearer', 'id_token': id_token(data['nonce'])}
+        with patch.object(type(auth0), 'fetch_access_token', return_value=token):
+            response = client.get(f'/auth0/callback?code=abc&state={data["state"]}')
+
+        assert response.status_code == 200
+        assert response.get_json()['email'] == 'social@example.com'
+        assert User.query.filter_by(email='social@example.com').one().auth0_sub == 'auth0|42'
+        assert auth0_stub == []
+
+    def test_cache_refetches_after_ttl_and_serves_stale_on_failure(self, auth0_stub, monkeypatch):
+        """Test documents are reused within the TTL and kept when a refresh fails"""
+        assert oidc_cache.metadata()['issuer'] == AUTH0_METADATA['issuer']
+        assert auth0_stub == []
+
+        monkeypatch.setattr(oidc_cache, '_loaded_at', time.monotonic() - app.config['OIDC_CACHE_TTL'] - 1)
+        oidc_cache.metadata()
+        assert len(auth0_stub) == 2
+
+        monkeypatch.setattr(oidc_cache, '_loaded_at', time.monotonic() - app.config['OIDC_CACHE_TTL'] - 1)
+        with patch.object(OIDCCache, '_get', side_effect=ConnectionError('down')):
+            assert oidc_cache.jwks() == {'keys': [AUTH0_KEY.as_dict()]}
+
+    def test_forced_key_refresh_is_rate_limited(self, auth0_stub, monkeypatch):
+        """Test unknown key ids refetch the JWKS at most once per OIDC_MIN_REFRESH_SECONDS"""
+        oidc_cache.jwks(force=True)
+        assert auth0_stub == []
+
+        monkeypatch.setattr(oidc_cache, '_jwks_loaded_at', time.monotonic() - app.config['OIDC_MIN_REFRESH_SECONDS'] - 1)
+        oidc_cache.jwks(force=True)
+        oidc_cache.jwks(force=True)
+        assert auth0_stub == [AUTH0_METADATA['jwks_uri']]
+
+
+# Mail Queue Tests
+class RecordingHandler:
+    def __init__(self):
+        self.messages = []
+        self.connections = set()
+
+    async def handle_DATA(self, server, session, envelope):
+        self.connections.add(id(session))
+        self.messages.append(envelope)
+        return '250 OK'
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+@pytest.fixture
+def smtp_server(monkeypatch):
+    """Local SMTP stand-in the mail worker is pointed at"""
+    handler = RecordingHandler()
+    controller = Controller(handler, hostname='127.0.0.1', port=free_port())
+    controller.start()
+    monkeypatch.setenv('EMAIL_USER', 'roomsy@example.com')
+    monkeypatch.delenv('EMAIL_PASSWORD', raising=False)
+    monkeypatch.setitem(app.config, 'MAIL_SERVER', '127.0.0.1')
+    monkeypatch.setitem(app.config, 'MAIL_PORT', controller.port)
+    monkeypatch.setitem(app.config, 'MAIL_USE_TLS', False)
+    yield handler
+    controller.stop()
+
+class TestMailQueue:
+    def test_register_queues_verification_email(self, client, smtp_server):
+        """Test registration only queues the email and the worker sends it"""
+        response = client.post('/register', json={
+            'email': 'new@example.com', 'username': 'newuser', 'password': 'Test123!'
+        })
+        assert response.status_code == 201
+        assert smtp_server.messages == []
+        assert OutboundEmail.query.one().status == 'pending'
+
+        assert mail_worker.drain() == 1
+        assert smtp_server.messages[0].rcpt_tos == ['new@example.com']
+        assert OutboundEmail.query.one().status == 'sent'
+
+    def test_batch_reuses_one_connection(self, client, smtp_server):
+        """Test a batch of emails goes out over a single SMTP session"""
+        for i in range(5):
+            db.session.add(OutboundEmail(recipient=f'user{i}@example.com', subject='Hi', body='Hello'))
+        db.session.commit()
+
+        mail_worker.drain()
+        assert len(smtp_server.messages) == 5
+        assert len(smtp_server.connections) == 1
+
+    def test_failed_send_backs_off(self, client, monkeypatch):
+        """Test an unreachable server reschedules the email with backoff"""
+        monkeypatch.setenv('EMAIL_USER', 'roomsy@example.com')
+        monkeypatch.setitem(app.config, 'MAIL_SERVER', '127.0.0.1')
+        monkeypatch.setitem(app.config, 'MAIL_PORT', free_port())
+        db.session.add(OutboundEmail(recipient='user@example.com', subject='Hi', body='Hello'))
+        db.session.commit()
+
+        mail_worker.drain()
+        email = OutboundEmail.query.one()
+        assert (email.status, email.attempts) == ('pending', 1)
+        assert email.next_attempt_at > datetime.now(timezone.utc).replace(tzinfo=None)
+        assert email.last_error
+
+def space_form(**files):
+    form = {
+        'name': 'Photo Studio', 'description': 'Bright studio', 'address': '1 Light St',
+        'capacity': '5', 'hourly_price': '40', 'daily_price': '200', 'status': 'AVAILABLE',
+        'amenities': '["wifi"]', 'rules': '[]'
+    }
+    form.update(files)
+    return form
+
+def image(name, size=(1200, 900)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size, 'teal').save(buffer, 'PNG')
+    buffer.seek(0)
+    return (buffer, name)
+
+def bomb_png(width=20000, height=20000):
+    """A PNG of a few bytes whose header declares `width` x `height` pixels"""
+    buffer = io.BytesIO()
+    Image.new('L', (1, 1)).save(buffer, 'PNG')
+    data = bytearray(buffer.getvalue())
+    # IHDR: length and type at 8, width and height at 16, its CRC at 29
+    data[16:24] = struct.pack('>II', width, height)
+    data[29:33] = struct.pack('>I', zlib.crc32(bytes(data[12:29])))
+    return bytes(data)
+
+class FakeCloudinary:
+    """Stands in for cloudinary.uploader.upload and tracks concurrency"""
+    def __init__(self, delay=0.2, fail=()):
+        self.delay = delay
+        self.fail = fail
+        self.in_flight = self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, image_file, **options):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            time.sleep(self.delay)
+            if image_file.filename.rsplit('-', 1)[0] in self.fail:
+                raise Exception('Upload rejected')
+            return {'secure_url': f'https://cdn.example.com/{image_file.filename}'}
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+@pytest.fixture
+def cloudinary_stub(monkeypatch, tmp_path):
+    monkeypatch.setitem(app.config, 'UPLOAD_BACKOFF_SECONDS', 0)
+    monkeypatch.setitem(app.config, 'MEDIA_STAGING_DIR', str(tmp_path))
+    monkeypatch.setenv('CLOUDINARY_CLOUD_NAME', 'test')
+    monkeypatch.setenv('CLOUDINARY_API_KEY', 'key')
+    monkeypatch.setenv('CLOUDINARY_API_SECRET', 'secret')
+
+    def install(**kwargs):
+        fake = FakeCloudinary(**kwargs)
+        monkeypatch.setattr('uploads.cloudinary.uploader.upload', fake)
+        return fake
+    return install
+
+def create_space_with_images(client, token, **files):
+    return client.post('/spaces', data=space_form(**files),
+                       headers={'Authorization': f'Bearer {token}'},
+                       content_type='multipart/form-data')
+
+class TestImageUploads:
+    def test_create_does_not_wait_for_uploads(self, client, admin_token, cloudinary_stub, tmp_path):
+        """Test images are staged and the space committed before any upload"""
+        fake = cloudinary_stub()
+        response = create_space_with_images(client, admin_token, images=[image('a.png'), image('b.png')])
+
+        assert response.status_code == 201
+        assert response.get_json()['image_status'] == 'pending'
+        assert fake.max_in_flight == 0
+        assert len(list(tmp_path.iterdir())) == 2
+        space = db.session.get(Space, response.get_json()['space_id'])
+        assert space.images == []
+
+    def test_worker_uploads_in_parallel(self, client, admin_token, admin_headers, cloudinary_stub, tmp_path):
+        """Test the worker uploads staged images concurrently, in order"""
+        fake = cloudinary_stub()
+        names = [f'photo{i}.png' for i in range(4)]
+        space_id = create_space_with_images(client, admin_token, images=[image(n) for n in names]).get_json()['space_id']
+
+        started = time.monotonic()
+        assert media_worker.drain() == 4
+        assert time.monotonic() - started < len(names) * len(VARIANTS) * fake.delay
+        assert fake.max_in_flight > 1
+
+        status = client.get(f'/spaces/{space_id}/images', headers=admin_headers).get_json()
+        assert status['image_status'] == 'ready'
+        assert [i['full'] for i in status['images']] == \
+            [f'https://cdn.example.com/photo{i}-full.{VARIANT_EXTENSION}' for i in range(4)]
+        assert list(tmp_path.iterdir()) == []
+
+    def test_partial_failure_is_reported(self, client, admin_token, admin_headers, cloudinary_stub, monkeypatch):
+        """Test invalid files are reported at once and failed uploads after retries"""
+        monkeypatch.setitem(app.config, 'MEDIA_MAX_ATTEMPTS', 1)
+        cloudinary_stub(delay=0, fail={'broken'})
+        response = create_space_with_images(client, admin_token,
+                                            images=[image('ok.png'), image('broken.png'), (io.BytesIO(b'plain text'), 'notes.png')])
+        assert response.status_code == 201
+        assert [f['filename'] for f in response.get_json()['failed_uploads']] == ['notes.png']
+
+        media_worker.drain()
+        status = client.get(response.get_json()['images_url'], headers=admin_headers).get_json()
+        assert status['image_status'] == 'failed'
+        assert [i['thumbnail'] for i in status['images']] == [f'https://cdn.example.com/ok-thumbnail.{VARIANT_EXTENSION}']
+        assert {u['filename']: u['status'] for u in status['uploads']} == {'ok.png': 'uploaded', 'broken.png': 'failed'}
+
+    def test_failed_upload_backs_off(self, client, admin_token, cloudinary_stub):
+        """Test a failed upload is rescheduled rather than retried right away"""
+        cloudinary_stub(delay=0, fail={'cover'})
+        space_id = create_space_with_images(client, admin_token, image=image('cover.png')).get_json()['space_id']
+
+        assert media_worker.drain() == 1
+        assert media_worker.drain() == 0
+        space = db.session.get(Space, space_id)
+        assert space.image_status == 'pending'
+        assert space.image_uploads[0].attempts == 1
+
+    def test_legacy_image_validation_still_rejects(self, client, admin_token, cloudinary_stub, tmp_path):
+        """Test a bad single 'image' still fails the request and stages nothing"""
+        cloudinary_stub()
+        response = create_space_with_images(client, admin_token, images=[image('a.png')], image=(io.BytesIO(b'plain text'), 'cover.png'))
+
+        assert response.status_code == 400
+        assert Space.query.count() == 0
+        assert list(tmp_path.iterdir()) == []
+
+    def test_variants_are_resized(self, tmp_path):
+        """Test each variant is re-encoded at its target size"""
+        path = tmp_path / 'wide.png'
+        Image.new('RGB', (4000, 1000), 'teal').save(path)
+
+        sizes = {name: Image.open(io.BytesIO(data)).size for name, data in make_variants(path).items()}
+        assert sizes == {'thumbnail': (320, 240), 'card': (640, 480), 'full': (1600, 400)}
+
+    def test_undecodable_image_fails_without_retry(self, client, admin_token, cloudinary_stub):
+        """Test a file that isn't an image fails at once instead of backing off"""
+        fake = cloudinary_stub(delay=0)
+        space_id = create_space_with_images(client, admin_token,
+                                            images=[(io.BytesIO(b'\x89PNG\r\n\x1a\ntruncated'), 'fake.png')]).get_json()['space_id']
+
+        media_worker.drain()
+        space = db.session.get(Space, space_id)
+        assert space.image_status == 'failed'
+        assert space.image_uploads[0].attempts == 1
+        assert fake.max_in_flight == 0
+
+    def test_huge_dimensions_are_rejected_up_front(self, client, admin_token, cloudinary_stub):
+        """Test an image declaring too many pixels is refused without being decoded"""
+        cloudinary_stub(delay=0)
+        response = create_space_with_images(client, admin_token,
+                                            images=[image('ok.png'), (io.BytesIO(bomb_png()), 'bomb.png')])
+
+        assert response.status_code == 201
+        assert [f['filename'] for f in response.get_json()['failed_uploads']] == ['bomb.png']
+        assert len(db.session.get(Space, response.get_json()['space_id']).image_uploads) == 1
+
+    def test_decompression_bomb_fails_only_its_upload(self, client, admin_token, cloudinary_stub):
+        """Test an image Pillow refuses to decode fails alone and the rest of the batch uploads"""
+        cloudinary_stub(delay=0)
+        space_id = create_space_with_images(client, admin_token,
+                                            images=[image('a.png'), image('b.png'), image('c.png')]).get_json()['space_id']
+        space = db.session.get(Space, space_id)
+        with open(space.image_uploads[1].staged_path, 'wb') as staged:
+            staged.write(bomb_png())
+
+        assert media_worker.drain() == 3
+        db.session.expire_all()
+        uploads = db.session.get(Space, space_id).image_uploads
+        assert [(u.status, u.attempts) for u in uploads] == [('uploaded', 1), ('failed', 1), ('uploaded', 1)]
+        assert 'decompression bomb' in uploads[1].last_error
+        assert media_worker.drain() == 0
+
+    def test_listings_only_return_thumbnails(self, client, admin_headers, sample_space):
+        """Test listings send one thumbnail, detail views the full images"""
+        sample_space.images = [
+            {'thumbnail': 'https://cdn.example.com/t.webp', 'card': 'https://cdn.example.com/c.webp',
+             'full': 'https://cdn.example.com/f.webp'},
+            'https://cdn.example.com/legacy.jpg'
+        ]
+        db.session.commit()
+
+        listed = client.get('/spaces', headers=admin_headers).get_json()['spaces'][0]
+        assert 'images' not in listed
+        assert listed['thumbnail'] == 'https://cdn.example.com/t.webp'
+        assert client.get('/client/spaces').get_json()['spaces'][0]['thumbnail'] == 'https://cdn.example.com/t.webp'
+
+        detail = client.get(f'/client/spaces/{sample_space.id}').get_json()
+        assert detail['images'] == ['https://cdn.example.com/f.webp', 'https://cdn.example.com/legacy.jpg']
+        assert detail['image_variants'][1]['thumbnail'] == 'https://cdn.example.com/legacy.jpg'
+
+class TestUploadLimits:
+    def test_type_comes_from_content_not_name(self, client, admin_token, cloudinary_stub):
+        """Test a real PNG is accepted whatever it is called, and a fake one rejected"""
+        cloudinary_stub()
+        response = create_space_with_images(client, admin_token,
+                                            images=[image('photo.txt'), (io.BytesIO(b'<svg/>'), 'photo.png')])
+
+        assert response.status_code == 201
+        assert [f['filename'] for f in response.get_json()['failed_uploads']] == ['photo.png']
+        assert Space.query.one().image_uploads[0].filename == 'photo.txt'
+
+    def test_oversized_file_is_rejected(self, client, admin_token, cloudinary_stub, monkeypatch, tmp_path):
+        """Test a file over MAX_IMAGE_SIZE is reported and never staged"""
+        cloudinary_stub()
+        monkeypatch.setitem(app.config, 'MAX_IMAGE_SIZE', 1024)
+        big = (io.BytesIO(b'\x89PNG\r\n\x1a\n' + b'0' * 4096), 'big.png')
+        response = create_space_with_images(client, admin_token, images=[big])
+
+        assert response.status_code == 201
+        assert 'exceeds' in response.get_json()['failed_uploads'][0]['error']
+        assert list(tmp_path.iterdir()) == []
+
+    def test_request_over_content_length_gets_413(self, client, admin_token, cloudinary_stub, monkeypatch):
+        """Test the whole request is refused past MAX_CONTENT_LENGTH"""
+        cloudinary_stub()
+        monkeypatch.setitem(app.config, 'MAX_CONTENT_LENGTH', 64 * 1024)
+        response = create_space_with_images(client, admin_token, images=[image('a.png', size=(800, 800)) for _ in range(4)] +
+                                            [(io.BytesIO(b'0' * 128 * 1024), 'padding.png')])
+
+        assert response.status_code == 413
+        assert Space.query.count() == 0
+
+    def test_capped_file_stops_buffering(self):
+        """Test data past the limit is discarded as it arrives"""
+        spool = CappedSpooledFile(limit=256 * 1024)
+        for _ in range(32):
+            spool.write(b'0' * 64 * 1024)
+
+        assert spool.oversized
+        assert spool.received == 2 * 1024 * 1024
+        assert spool.tell() == 0
+        # Never held more than the limit, so it never spilled to disk
+        assert not spool._rolled
@@ -0,0 +1,196 @@
+"""
+Image upload handling: request parsing, validation and upload to Cloudinary.
+
+UploadRequest makes Werkzeug spool each multipart file into a
+CappedSpooledFile, which stops keeping data once the file passes
+MAX_IMAGE_SIZE, so an oversized upload never takes more than that in memory
+or temp disk. MAX_CONTENT_LENGTH bounds the request as a whole.
+sniff_image_type() checks magic bytes rather than trusting the filename, and
+exceeds_pixel_limit() reads the declared dimensions without decoding, so a
+small file that would decompress to gigabytes is turned away too.
+
+upload_images() pushes a batch of files through a shared, bounded thread
+pool so a multi-photo listing uploads in parallel. Each upload retries with
+exponential backoff and a per-attempt network timeout, and the batch as a
+whole is bounded by UPLOAD_DEADLINE. Failures are reported per file rather
+than failing the batch.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import wraps
+import os
+import random
+from tempfile import SpooledTemporaryFile
+import time
+
+import cloudinary
+import cloudinary.uploader
+from flask import Request, current_app
+from PIL import Image
+
+from config import app
+
+# Leading bytes of each accepted image format
+IMAGE_SIGNATURES = [
+    (b'\x89PNG\r\n\x1a\n', 'png'),
+    (b'\xff\xd8\xff', 'jpg'),
+    (b'GIF87a', 'gif'),
+    (b'GIF89a', 'gif'),
+]
+SPOOL_MEMORY_SIZE = 500 * 1024  # Werkzeug's default before spilling to disk
+
+_executor = ThreadPoolExecutor(
+    max_workers=app.config['UPLOAD_CONCURRENCY'],
+    thread_name_prefix='image-upload'
+)
+
+
+class CappedSpooledFile(SpooledTemporaryFile):
+    """
+    Spooled upload buffer that keeps at most `limit` bytes. Past that it
+    empties itself, sets `oversized` and discards the rest of the file as
+    it streams in.
+    """
+
+    def __init__(self, limit):
+        super().__init__(max_size=SPOOL_MEMORY_SIZE)
+        self.limit = limit
+        self.received = 0
+        self.oversized = False
+
+    def write(self, data):
+        self.received += len(data)
+        if not self.oversized and self.received > self.limit:
+            self.oversized = True
+            self.seek(0)
+            self.truncate()
+        if self.oversized:
+            return len(data)
+        return super().write(data)
+
+
+class UploadRequest(Request):
+    # Plain form fields are small; don't let them buffer megabytes either
+    max_form_memory_size = SPOOL_MEMORY_SIZE
+
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return CappedSpooledFile(current_app.config['MAX_IMAGE_SIZE'])
+
+
+app.request_class = UploadRequest
+
+
+def is_oversized(file):
+    """True if `file` passed MAX_IMAGE_SIZE while it was being received"""
+    return getattr(file.stream, 'oversized', False)
+
+
+def sniff_image_type(file):
+    """The image format from `file`'s magic bytes, or None if it isn't one we accept"""
+    head = file.stream.read(16)
+    file.stream.seek(0)
+    for signature, image_type in IMAGE_SIGNATURES:
+        if head.startswith(signature):
+            return image_type
+    return None
+
+
+def exceeds_pixel_limit(file):
+    """True if `file`'s image header declares more than MAX_IMAGE_PIXELS pixels"""
+    try:
+        # Image.open only parses the header; nothing is decoded here
+        with Image.open(file.stream) as image:
+            width, height = image.size
+    except Image.DecompressionBombError:
+        return True
+    except OSError:
+        # Undecodable files are reported by the media worker
+        return False
+    finally:
+        file.stream.seek(0)
+    return width * height > current_app.config['MAX_IMAGE_PIXELS']
+
+
+def configure_cloudinary():
+    """Configure Cloudinary with environment variables"""
+    try:
+        cloudinary.config(
+            cloud_name=os.getenv('CLOUDINARY_CLOUD_NAME'),
+            api_key=os.getenv('CLOUDINARY_API_KEY'),
+            api_secret=os.getenv('CLOUDINARY_API_SECRET')
+        )
+    except Exception as e:
+        print(f"Error configuring Cloudinary: {str(e)}")
+        raise
+
+def require_cloudinary(f):
+    """Decorator to ensure Cloudinary is configured before upload"""
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if not all([
+            cloudinary.config().cloud_name,
+            cloudinary.config().api_key,
+            cloudinary.config().api_secret
+        ]):
+            configure_cloudinary()
+        return f(*args, **kwargs)
+    return decorated_function
+
+@require_cloudinary
+def upload_image_to_cloudinary(image_file):
+    """
+    Upload image to Cloudinary with error handling and retry logic
+    
+    Args:
+        image_file: File object from request.files
+    Returns:
+        str: Cloudinary secure URL of the uploaded image
+    Raises:
+        Exception: If upload fails after retries
+    """
+    max_retries = app.config['UPLOAD_MAX_RETRIES']
+    retry_count = 0
+    
+    while retry_count < max_retries:
+        try:
+            # Rewind in case a failed attempt consumed part of the stream
+            image_file.seek(0)
+            result = cloudinary.uploader.upload(
+                image_file,
+                folder="charity_stories",
+                timeout=app.config['UPLOAD_TIMEOUT']
+                # No transformation: media.py uploads pre-sized variants
+            )
+            return result['secure_url']
+        except Exception as e:
+            retry_count += 1
+            if retry_count == max_retries:
+                print(f"Failed to upload image after {max_retries} attempts: {str(e)}")
+                raise Exception("Failed to upload image to Cloudinary")
+            # Exponential backoff with jitter so parallel retries spread out
+            delay = app.config['UPLOAD_BACKOFF_SECONDS'] * 2 ** (retry_count - 1)
+            print(f"Upload attempt {retry_count} failed, retrying in {delay:.1f}s...")
+            time.sleep(delay * random.uniform(0.5, 1.5))
+
+
+def upload_images(files, upload=None):
+    """
+    Upload `files` concurrently.
+
+    Returns (urls, failures): the URLs of successful uploads in the order
+    the files were given, and (file, error message) pairs for the rest.
+    """
+    upload = upload or upload_image_to_cloudinary
+    futures = [(image_file, _executor.submit(upload, image_file)) for image_file in files]
+    done, _ = wait([future for _, future in futures], timeout=app.config['UPLOAD_DEADLINE'])
+
+    urls, failures = [], []
+    for image_file, future in futures:
+        if future not in done:
+            # Can't interrupt a running upload; it finishes in the background
+            future.cancel()
+            failures.append((image_file, 'Upload timed out'))
+        elif future.exception():
+            failures.append((image_file, str(future.exception())))
+        else:
+            urls.append(future.result())
+    return urls, failures
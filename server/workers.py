@@ -0,0 +1,126 @@
+"""
+Background workers for database-backed queues.
+
+A queue is a table with status, attempts, next_attempt_at, claim_token and
+claimed_at columns. QueueWorker claims due rows in batches, hands them to
+process_batch() and reschedules failures with exponential backoff. The
+worker thread starts on the first start() or wake() and then polls every
+<PREFIX>_POLL_SECONDS; drain() processes everything due synchronously for
+CLI commands and tests.
+"""
+from datetime import timedelta
+import threading
+import uuid
+
+from sqlalchemy import select, update, or_, and_
+
+from config import db
+from models import utcnow
+
+# Rows stuck in the claimed status this long (e.g. the process died
+# mid-batch) are claimed again
+CLAIM_TIMEOUT = timedelta(minutes=10)
+MAX_BACKOFF = timedelta(hours=1)
+
+
+class QueueWorker:
+    """
+    Subclasses set `name` and `config_prefix` (settings are read as
+    <PREFIX>_QUEUE_WORKER, <PREFIX>_BATCH_SIZE and <PREFIX>_POLL_SECONDS)
+    and implement process_batch(). Queue tables also set `model` and
+    `claimed_status` to use claim() and retry_later(), which read
+    <PREFIX>_MAX_ATTEMPTS and <PREFIX>_RETRY_BASE_SECONDS.
+    """
+    model = None
+    claimed_status = None
+    name = None
+    config_prefix = None
+
+    def __init__(self, app):
+        self.app = app
+        self._wake = threading.Event()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def setting(self, key):
+        return self.app.config[f'{self.config_prefix}_{key}']
+
+    def start(self):
+        """Start the worker thread if it isn't running; False if it's disabled"""
+        if not self.setting('QUEUE_WORKER'):
+            return False
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+                self._thread.start()
+        return True
+
+    def wake(self):
+        """Start the worker if needed and have it check the queue now"""
+        if self.start():
+            self._wake.set()
+
+    def _run(self):
+        while True:
+            self._wake.clear()
+            try:
+                with self.app.app_context():
+                    while self.process_batch() == self.setting('BATCH_SIZE'):
+                        pass
+            except Exception as e:
+                self.app.logger.error(f"{self.name} worker error: {e}")
+            self.idle()
+            self._wake.wait(timeout=self.setting('POLL_SECONDS'))
+
+    def idle(self):
+        """Called whenever the queue has been emptied"""
+
+    def claim(self):
+        """Mark a batch of due rows as claimed by this worker and return them"""
+        model = self.model
+        now = utcnow()
+        token = uuid.uuid4().hex
+        due = select(model.id).where(or_(
+            and_(model.status == 'pending', model.next_attempt_at <= now),
+            and_(model.status == self.claimed_status, model.claimed_at < now - CLAIM_TIMEOUT)
+        )).order_by(model.next_attempt_at).limit(self.setting('BATCH_SIZE'))
+
+        db.session.execute(
+            update(model)
+            .where(model.id.in_(due.scalar_subquery()))
+            .values(status=self.claimed_status, claim_token=token, claimed_at=now),
+            execution_options={'synchronize_session': False}
+        )
+        db.session.commit()
+        return model.query.filter_by(claim_token=token, status=self.claimed_status).all()
+
+    def retry_later(self, row, error):
+        """
+        Record a failed attempt on `row`: reschedule it with exponential
+        backoff, or mark it failed once MAX_ATTEMPTS is reached. Returns
+        True if it will be retried.
+        """
+        row.last_error = str(error)
+        row.claim_token = None
+        if row.attempts >= self.setting('MAX_ATTEMPTS'):
+            row.status = 'failed'
+            return False
+        backoff = timedelta(seconds=self.setting('RETRY_BASE_SECONDS') * 2 ** (row.attempts - 1))
+        row.status = 'pending'
+        row.next_attempt_at = utcnow() + min(backoff, MAX_BACKOFF)
+        return True
+
+    def process_batch(self):
+        """Process one claimed batch; returns how many rows were attempted"""
+        raise NotImplementedError
+
+    def drain(self):
+        """Process everything currently due, synchronously (CLI and tests)"""
+        total = 0
+        while True:
+            processed = self.process_batch()
+            total += processed
+            if processed < self.setting('BATCH_SIZE'):
+                break
+        self.idle()
+        return total